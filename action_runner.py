@@ -0,0 +1,376 @@
+"""
+action_runner.py
+アクションの実行（予算確認 → 入力の分割 → ストリーミング → 使用量記録）と、推論バックエンドの生成。
+Qt に依存しないため、ApiWorker（ポップアップ）・バックグラウンドジョブ・
+process_worker の子プロセスから同じ処理を使う。
+使用するバックエンドは config.POPAI_BACKEND で選択する（backends.py を参照）。
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable
+
+import config
+import usage
+import actions
+import backends
+import file_reader
+import prompt_builder
+import retrieval
+import singleflight
+import sse_stream
+from token_estimator import estimate_tokens
+
+logger = logging.getLogger("popai.api")
+
+# ================================================================== #
+# API クライアント キャッシュ
+# ================================================================== #
+# 複数セッションの ApiWorker が同時に初回生成しても、接続プールが 1 つになるようにする
+_client_lock = threading.Lock()
+
+_azure_client = None
+_azure_http_client = None
+
+def _get_azure_client():
+    """
+    AzureOpenAIクライアントをシングルトン的に生成して返す。
+    configやプロキシ環境変数が後から変更されることは想定しない。
+    """
+    global _azure_client, _azure_http_client
+    with _client_lock:
+        if _azure_client is None:
+            from openai import AzureOpenAI
+            import httpx
+
+            client_kwargs = {}
+            if getattr(config, "DISABLE_SSL_VERIFY", False):
+                logger.warning("SSL証明書の検証を無効にしています (DISABLE_SSL_VERIFY=True)")
+                client_kwargs["verify"] = False
+
+            http_proxy = os.getenv("HTTP_PROXY")
+            https_proxy = os.getenv("HTTPS_PROXY")
+
+            # Memory guidelines state: Proxy settings prioritize HTTPS_PROXY over HTTP_PROXY
+            # HTTP_PROXY を優先し、なければ HTTPS_PROXY を使用する (Old comment left for context, but logic changed)
+            proxy_url = http_proxy or https_proxy
+            if proxy_url:
+                logger.info("プロキシ設定を適用します")
+                client_kwargs["proxy"] = proxy_url
+
+            http_client = httpx.Client(**client_kwargs)
+            _azure_http_client = http_client
+
+            _azure_client = AzureOpenAI(
+                azure_endpoint = config.AZURE_OPENAI_ENDPOINT,
+                api_key        = config.AZURE_OPENAI_API_KEY,
+                api_version    = config.AZURE_OPENAI_API_VERSION,
+                http_client    = http_client,
+            )
+    return _azure_client
+
+
+_local_client = None
+_local_http_client = None
+
+def _get_local_client():
+    """
+    ローカルの OpenAI 互換サーバー用クライアントをシングルトン的に生成して返す。
+    社内ネットワーク内のサーバーを想定するため、プロキシは環境変数 (NO_PROXY 含む) に任せる。
+    """
+    global _local_client, _local_http_client
+    with _client_lock:
+        if _local_client is None:
+            from openai import OpenAI
+            import httpx
+
+            client_kwargs = {}
+            if getattr(config, "DISABLE_SSL_VERIFY", False):
+                client_kwargs["verify"] = False
+
+            _local_http_client = httpx.Client(**client_kwargs)
+            _local_client = OpenAI(
+                base_url    = config.LOCAL_OPENAI_BASE_URL,
+                api_key     = config.LOCAL_OPENAI_API_KEY,
+                http_client = _local_http_client,
+            )
+    return _local_client
+
+
+# ================================================================== #
+# バックエンドの選択
+# ================================================================== #
+def backend_name() -> str:
+    """config.POPAI_BACKEND が未指定なら USE_DUMMY_API から決める（従来設定との互換）。"""
+    return config.POPAI_BACKEND or ("dummy" if config.USE_DUMMY_API else "azure")
+
+
+# Azure OpenAI で stream_options.include_usage に対応した最初の API バージョン
+USAGE_API_VERSION = "2024-09-01-preview"
+
+
+def include_usage(name: str | None = None) -> bool:
+    """usage チャンクを要求するか。STREAM_INCLUDE_USAGE が未指定ならバックエンドと API バージョンで決める。"""
+    if config.STREAM_INCLUDE_USAGE is not None:
+        return config.STREAM_INCLUDE_USAGE
+    if (name or backend_name()) == "azure":
+        return config.AZURE_OPENAI_API_VERSION >= USAGE_API_VERSION
+    return True
+
+
+def create_backend(name: str | None = None) -> backends.Backend:
+    """
+    リクエスト 1 回分のバックエンドを生成する。
+    HTTP クライアント（接続プール）はキャッシュ済みのものを共有する。
+    """
+    name = name or backend_name()
+    if name == "dummy":
+        return backends.DummyBackend(config.DUMMY_TOKENS_PER_SEC, config.DUMMY_FIRST_TOKEN_DELAY)
+    if name == "azure":
+        client = _get_azure_client()
+        if config.FAST_SSE:
+            endpoint = config.AZURE_OPENAI_ENDPOINT.rstrip("/")
+            return sse_stream.SSEBackend(
+                "azure", client, _azure_http_client,
+                lambda model: f"{endpoint}/openai/deployments/{model}/chat/completions",
+                {"api-key": config.AZURE_OPENAI_API_KEY}, config.AZURE_OPENAI_DEPLOYMENT_NAME,
+                params={"api-version": config.AZURE_OPENAI_API_VERSION},
+                record_dir=config.STREAM_RECORD_DIR,
+            )
+        return backends.OpenAICompatibleBackend(
+            "azure", client, config.AZURE_OPENAI_DEPLOYMENT_NAME,
+            record_dir=config.STREAM_RECORD_DIR,
+        )
+    if name == "local":
+        client = _get_local_client()
+        if config.FAST_SSE:
+            base_url = config.LOCAL_OPENAI_BASE_URL.rstrip("/")
+            return sse_stream.SSEBackend(
+                "local", client, _local_http_client,
+                lambda model: f"{base_url}/chat/completions",
+                {"Authorization": f"Bearer {config.LOCAL_OPENAI_API_KEY}"}, config.LOCAL_OPENAI_MODEL,
+                record_dir=config.STREAM_RECORD_DIR,
+            )
+        return backends.OpenAICompatibleBackend(
+            "local", client, config.LOCAL_OPENAI_MODEL,
+            record_dir=config.STREAM_RECORD_DIR,
+        )
+    if name == "replay":
+        return backends.ReplayBackend(config.REPLAY_PATH, config.REPLAY_SPEED)
+    raise ValueError(f"未知のバックエンドです: {name} (dummy / azure / local / replay のいずれかを指定してください)")
+
+
+# ================================================================== #
+# アクションの実行
+# ================================================================== #
+class BudgetExceededError(Exception):
+    """本日のトークン予算を超過していて、BUDGET_MODE=block のため実行できない。"""
+
+
+def check_budget() -> str:
+    """本日の予算状況（usage.BUDGET_*）を返す。BUDGET_MODE=block で超過していれば BudgetExceededError。"""
+    tracker = usage.get_tracker()
+    budget = tracker.check_budget()
+    if budget == usage.BUDGET_BLOCK:
+        raise BudgetExceededError(
+            f"本日のトークン予算を超過しました "
+            f"({tracker.tokens_today():,} / {config.DAILY_TOKEN_BUDGET:,} tok)"
+        )
+    return budget
+
+
+def create_runner(button_key: str, user_text: str, history: list[dict] | None = None,
+                  on_chunk: Callable[[str], None] | None = None,
+                  source: file_reader.TextFile | None = None):
+    """
+    ActionRunner か、config.PROCESS_WORKER が有効なら別プロセスで実行する RemoteActionRunner を返す。
+    どちらも run() / cancel() / cancelled を持つ。
+    """
+    if config.PROCESS_WORKER:
+        import process_worker
+        return process_worker.RemoteActionRunner(button_key, user_text, history, on_chunk, source)
+    return ActionRunner(button_key, user_text, history, on_chunk, source)
+
+
+class ActionRunner:
+    """
+    1 つのアクション（予算確認 → 入力の分割 → ストリーミング → 使用量記録）を実行する。
+    ApiWorker（ポップアップ）とバックグラウンドジョブの両方から同じ処理を使うため、Qt に依存しない。
+    on_chunk は実行スレッドから呼ばれる。
+
+    budget と on_usage は別プロセスで実行する場合（process_worker）に使う。
+    予算の確認と使用量の記録は UI 側のプロセスで行い、ここでは渡された結果に従う。
+    """
+
+    def __init__(self, button_key: str, user_text: str, history: list[dict] | None = None,
+                 on_chunk: Callable[[str], None] | None = None,
+                 source: file_reader.TextFile | None = None,
+                 budget: str | None = None,
+                 on_usage: Callable[[usage.UsageRecord], None] | None = None):
+        self._button_key = button_key
+        self._user_text  = user_text
+        self._history    = list(history or [])
+        self._source     = source       # ファイル入力（user_text の代わりに少しずつ読み出す）
+        self._on_chunk   = on_chunk or (lambda text: None)
+        self._budget     = budget
+        self._on_usage   = on_usage
+        self._backend: backends.Backend | None = None
+        self._cancelled  = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        """実行中のストリームを中断する。"""
+        self._cancelled = True
+        backend = self._backend
+        if backend is not None:
+            backend.cancel()
+
+    def run(self) -> str | None:
+        """回答全体を返す。中断された場合は None。"""
+        budget = self._budget or check_budget()
+
+        # 同じ内容のリクエストが実行中なら、そのストリームに相乗りする
+        backend = singleflight.wrap(create_backend())
+        self._backend = backend
+        if self._cancelled:
+            return None
+
+        spec = actions.get_registry().get(self._button_key)
+        if self._source is not None:
+            logger.info("ファイル入力 %s (%s, %s)", self._source.name,
+                        file_reader.format_size(self._source.size), self._source.encoding)
+            plan = (spec or actions.ActionSpec(self._button_key, self._button_key)).plan_file(
+                self._source, config.FILE_MAX_CHUNKS)
+        elif spec:
+            plan = spec.plan_input(self._user_text)
+        else:
+            plan = actions.InputPlan("single", 0, [self._user_text])
+
+        # 文字列の += は長い回答で二乗の時間がかかるため、断片をリストに溜めて最後に連結する
+        parts: list[str] = []
+        if plan.warning:
+            notice = f"⚠️ {plan.warning}\n\n"
+            logger.warning(plan.warning)
+            parts.append(notice)
+            self._on_chunk(notice)
+
+        for i, part in enumerate(plan.chunks, 1):
+            if plan.count > 1:
+                sep = "\n\n" if i > 1 else ""
+                header = f"{sep}【{i}/{plan.count}】\n"
+                parts.append(header)
+                self._on_chunk(header)
+            parts.append(self._stream_part(backend, spec, part, budget))
+            if self._cancelled:
+                break
+
+        answer = "".join(parts)
+        if self._cancelled:
+            logger.info("中断されました (%d 文字)", len(answer))
+            return None
+
+        logger.info("完了 (%d 文字)", len(answer))
+        return answer
+
+    def _stream_part(self, backend: backends.Backend, spec: actions.ActionSpec | None,
+                     user_text: str, budget: str) -> str:
+        """1 回分のリクエストを送信し、チャンクを流しながら回答全体を返す。"""
+        profile = spec.resolve(user_text) if spec else actions.GenerationProfile()
+        messages = prompt_builder.build_messages(
+            spec.system_prompt if spec else "", user_text, self._history,
+            references=self._retrieve(spec, user_text),
+        )
+
+        deployment = profile.deployment or backend.default_model
+        if budget == usage.BUDGET_DOWNGRADE:
+            deployment = config.BUDGET_DOWNGRADE_DEPLOYMENT
+            logger.info("予算超過のため %s に切り替えます", deployment)
+
+        logger.info("リクエスト送信 backend=%s, key=%s, deployment=%s, chars=%d, history=%d",
+                    backend.name, self._button_key, deployment, len(user_text), len(self._history))
+
+        request = backends.GenerationRequest(
+            action        = self._button_key,
+            messages      = messages,
+            model         = deployment,
+            max_tokens    = profile.max_tokens,
+            temperature   = profile.temperature,
+            include_usage = include_usage(backend.name),
+        )
+
+        started = time.perf_counter()
+        ttft = None
+        reported_usage = None
+
+        texts: list[str] = []
+        if self._cancelled:
+            return ""
+        try:
+            for chunk in backend.stream(request):
+                # include_usage 指定時は最終チャンクに usage が載る
+                if chunk.usage is not None:
+                    reported_usage = chunk.usage
+                if chunk.text:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    texts.append(chunk.text)
+                    self._on_chunk(chunk.text)
+        except Exception:
+            # 中断でレスポンスを閉じたことによる読み込みエラーは、途中までの使用量を記録して終える
+            if not self._cancelled:
+                raise
+        answer = "".join(texts)
+
+        # 中断した場合も、送信済みの入力と途中までの出力は課金されるため推定値で記録する
+        # （予算を中断と再送信で超えられないように）。
+        # 相乗りしたストリームの使用量は、最後まで受信した 1 人（全員が抜けた場合は最後の 1 人）だけが記録する
+        if getattr(backend, "owns_usage", True):
+            record = self._make_usage_record(
+                deployment, messages, answer, reported_usage,
+                time.perf_counter() - started, ttft,
+            )
+            (self._on_usage or usage.get_tracker().record)(record)
+        return answer
+
+    def _retrieve(self, spec: actions.ActionSpec | None, user_text: str) -> list[tuple[str, str]]:
+        """文書検索が有効なアクションなら関連段落を返す。失敗しても回答は続ける。"""
+        if not (spec and spec.retrieval and retrieval.enabled()):
+            return []
+        try:
+            started = time.perf_counter()
+            passages = retrieval.retrieve(user_text)
+        except Exception as e:
+            logger.warning("文書検索に失敗したため検索なしで続けます: %s: %s", type(e).__name__, e)
+            return []
+        logger.info("文書検索 %d 件 (%.0f ms): %s", len(passages), (time.perf_counter() - started) * 1000,
+                    ", ".join(f"{p.source}={p.score:.2f}" for p in passages))
+        return [(p.source, p.text) for p in passages]
+
+    def _make_usage_record(self, deployment: str, messages: list[dict], answer: str,
+                           reported_usage: dict | None, elapsed: float,
+                           ttft: float | None) -> usage.UsageRecord:
+        """usage チャンクがあればその値を、無ければオフライン推定値を使って記録を作る。"""
+        reported_usage = reported_usage or {}
+        prompt_tokens = reported_usage.get("prompt_tokens")
+        completion_tokens = reported_usage.get("completion_tokens")
+        cached_tokens = reported_usage.get("cached_tokens") or 0
+        estimated = not (isinstance(prompt_tokens, int) and isinstance(completion_tokens, int))
+        if estimated:
+            prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+            completion_tokens = estimate_tokens(answer)
+            cached_tokens = 0
+        return usage.UsageRecord(
+            action            = self._button_key,
+            deployment        = deployment,
+            prompt_tokens     = prompt_tokens,
+            completion_tokens = completion_tokens,
+            elapsed           = elapsed,
+            ttft              = ttft,
+            estimated         = estimated,
+            cached_tokens     = cached_tokens,
+        )
@@ -0,0 +1,278 @@
+"""
+actions.py
+ボタン（アクション）の宣言的レジストリ。
+各アクションのラベル・色・システムプロンプト・デプロイメント・生成パラメータを
+config.ACTIONS_CONFIG_PATH の JSON ファイルから読み込み、更新日時 (mtime) が変われば自動で再読込する。
+ファイルが無い / 壊れている場合は組み込みの既定アクションを使う。
+
+【JSON の書式】
+  {
+    "actions": [
+      {
+        "key": "S", "label": "要約", "color": "#4CAF50",
+        "tooltip": "選択テキストを要約します (Alt+S)",
+        "system_prompt": "以下の文章を簡潔に要約してください。",
+        "deployment": "", "max_tokens": null, "temperature": null,
+        "max_input_tokens": 8000, "overflow": "chunk", "chunk_tokens": 4000,
+        "routes": [
+          {"max_input_tokens": 500, "deployment": "gpt-4o-mini", "max_tokens": 300}
+        ]
+      }
+    ]
+  }
+
+  routes は上から順に評価され、入力の推定トークン数が max_input_tokens 以下なら
+  そのルートの値で deployment / max_tokens / temperature を上書きする。
+  deployment が空文字のときは config.AZURE_OPENAI_DEPLOYMENT_NAME を使う。
+
+  max_input_tokens を超える入力は overflow に従って処理する。
+  （ファイル入力では "warn" も "truncate" と同じく先頭部分だけを送信する）
+    "warn"     … 警告を表示してそのまま送信（既定）
+    "truncate" … 先頭 max_input_tokens トークンに切り詰めて送信
+    "chunk"    … chunk_tokens（省略時は max_input_tokens）ごとに分割して順に処理
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field, fields, replace
+from typing import Iterable
+
+import config
+import token_estimator
+
+logger = logging.getLogger("popai.actions")
+
+
+# ================================================================== #
+# データ定義
+# ================================================================== #
+@dataclass(frozen=True)
+class GenerationProfile:
+    """1 リクエストに適用する生成パラメータ。"""
+    deployment: str = ""
+    max_tokens: int | None = None
+    temperature: float | None = None
+
+
+@dataclass(frozen=True)
+class InputRoute:
+    """入力サイズに応じた生成パラメータの上書き。"""
+    max_input_tokens: int
+    deployment: str = ""
+    max_tokens: int | None = None
+    temperature: float | None = None
+
+
+OVERFLOW_MODES = ("warn", "truncate", "chunk")
+
+
+@dataclass
+class InputPlan:
+    """送信前に決めた入力の処理方法。"""
+    mode: str               # "single" / "truncated" / "chunked"
+    tokens: int             # 元の入力の推定トークン数
+    chunks: Iterable[str]   # 実際に送信するテキスト（single / truncated なら 1 件）
+    warning: str = ""
+    count: int = 0          # chunks の件数（ファイル入力では chunks が送信時に読み出すイテレータになる）
+
+    def __post_init__(self):
+        if not self.count and isinstance(self.chunks, list):
+            self.count = len(self.chunks)
+
+
+@dataclass(frozen=True)
+class ActionSpec:
+    """1 つのボタン（アクション）の定義。"""
+    key: str
+    label: str
+    color: str = "#607D8B"
+    tooltip: str = ""
+    system_prompt: str = ""
+    deployment: str = ""
+    max_tokens: int | None = None
+    temperature: float | None = None
+    routes: tuple[InputRoute, ...] = field(default_factory=tuple)
+    max_input_tokens: int | None = None
+    overflow: str = "warn"
+    chunk_tokens: int | None = None
+    keep_history: bool = False      # True ならウィンドウを開いている間の会話履歴を送る
+    retrieval: bool = False         # True なら RETRIEVAL_DOCS_DIR の文書から関連段落を添える
+
+    @property
+    def button_text(self) -> str:
+        """ボタン表示用テキスト（1 文字キーならニーモニック付き）。"""
+        return f"{self.label}(&{self.key})" if len(self.key) == 1 else self.label
+
+    def resolve(self, user_text: str) -> GenerationProfile:
+        """入力テキストに応じて適用する生成パラメータを決定する。"""
+        profile = GenerationProfile(self.deployment, self.max_tokens, self.temperature)
+        if not self.routes:
+            return profile
+        tokens = token_estimator.estimate_tokens(user_text)
+        for route in self.routes:
+            if tokens <= route.max_input_tokens:
+                return replace(
+                    profile,
+                    deployment  = route.deployment or profile.deployment,
+                    max_tokens  = route.max_tokens if route.max_tokens is not None else profile.max_tokens,
+                    temperature = route.temperature if route.temperature is not None else profile.temperature,
+                )
+        return profile
+
+    def plan_input(self, user_text: str, tokens: int | None = None) -> InputPlan:
+        """入力の推定トークン数と max_input_tokens から、単発 / 切り詰め / 分割を決める。"""
+        if tokens is None:
+            tokens = token_estimator.estimate_tokens(user_text)
+        limit = self.max_input_tokens
+        if not limit or tokens <= limit:
+            return InputPlan("single", tokens, [user_text])
+        if self.overflow == "truncate":
+            return InputPlan(
+                "truncated", tokens, [token_estimator.truncate_to_tokens(user_text, limit)],
+                f"入力が上限 {limit:,} トークンを超えたため先頭部分のみ送信します (約 {tokens:,} tok)",
+            )
+        if self.overflow == "chunk":
+            chunks = token_estimator.split_into_chunks(user_text, self.chunk_tokens or limit)
+            return InputPlan(
+                "chunked", tokens, chunks,
+                f"入力が上限 {limit:,} トークンを超えたため {len(chunks)} 分割して処理します (約 {tokens:,} tok)",
+            )
+        return InputPlan(
+            "single", tokens, [user_text],
+            f"入力が上限 {limit:,} トークンを超えています (約 {tokens:,} tok)",
+        )
+
+    def plan_file(self, source, max_chunks: int = 0) -> InputPlan:
+        """
+        file_reader.TextFile の入力を plan_input と同じ規則で扱う。
+        ファイル全体は保持せず、チャンク数とトークン数だけを先に数えて、本文は送信時に読み出す。
+        """
+        limit = self.max_input_tokens or config.FILE_CHUNK_TOKENS
+        if self.overflow == "chunk":
+            part_tokens = self.chunk_tokens or limit
+            count, tokens = source.measure(part_tokens)
+            if count <= 1:
+                return InputPlan("single", tokens, source.iter_chunks(part_tokens), count=1)
+            warning = f"{source.name} (約 {tokens:,} tok) を {count} 分割して処理します"
+            if max_chunks and count > max_chunks:
+                warning += f"。上限 {max_chunks} 件を超える部分は処理しません"
+                count = max_chunks
+            return InputPlan("chunked", tokens,
+                             itertools.islice(source.iter_chunks(part_tokens), count), warning, count)
+
+        count, tokens = source.measure(limit)
+        chunks = itertools.islice(source.iter_chunks(limit), 1)
+        if count <= 1:
+            return InputPlan("single", tokens, chunks, count=1)
+        return InputPlan(
+            "truncated", tokens, chunks,
+            f"{source.name} が上限 {limit:,} トークンを超えたため先頭部分のみ送信します (約 {tokens:,} tok)",
+            count=1,
+        )
+
+
+DEFAULT_ACTIONS: tuple[ActionSpec, ...] = (
+    ActionSpec("S", "要約", "#4CAF50", "選択テキストを要約します (Alt+S)",
+               "以下の文章を簡潔に要約してください。"),
+    ActionSpec("Q", "質問", "#2196F3", "選択テキストについて質問します (Alt+Q)",
+               "以下の内容に関する質問に答えるか、詳細を解説してください。", retrieval=True),
+    ActionSpec("T", "添削", "#FF9800", "選択テキストを添削します (Alt+T)",
+               "あなたは優秀な校正者です。以下の文章の誤字脱字や文法を修正し、より読みやすく洗練された自然な文章に添削してください。修正箇所やアドバイスがあればそれも添えてください。"),
+    ActionSpec("C", "チャット", "#9C27B0", "チャットを開始します (Alt+C)",
+               "", keep_history=True),   # チャット: システムプロンプトなし
+)
+
+
+def _parse_action(raw: dict) -> ActionSpec:
+    known = {f.name for f in fields(ActionSpec)}
+    unknown = set(raw) - known
+    if unknown:
+        raise ValueError(f"未知の項目があります: {', '.join(sorted(unknown))}")
+    if not raw.get("key") or not raw.get("label"):
+        raise ValueError("key と label は必須です")
+    if raw.get("overflow", "warn") not in OVERFLOW_MODES:
+        raise ValueError(f"overflow は {' / '.join(OVERFLOW_MODES)} のいずれかです")
+    routes = tuple(
+        InputRoute(**r) for r in sorted(raw.get("routes") or [], key=lambda r: r["max_input_tokens"])
+    )
+    return ActionSpec(**{**raw, "key": str(raw["key"]), "routes": routes})
+
+
+def parse_actions(data: dict) -> tuple[ActionSpec, ...]:
+    """JSON から読み込んだ dict を ActionSpec の列に変換する。不正な場合は ValueError。"""
+    specs = tuple(_parse_action(raw) for raw in data.get("actions", []))
+    if not specs:
+        raise ValueError("actions が空です")
+    keys = [s.key for s in specs]
+    if len(keys) != len(set(keys)):
+        raise ValueError("key が重複しています")
+    return specs
+
+
+# ================================================================== #
+# レジストリ
+# ================================================================== #
+class ActionRegistry:
+    """
+    アクション定義を保持し、ファイルの mtime が変わったら再読込する。
+    UI スレッドとワーカースレッドの両方から参照されるためロックで保護する。
+    version は再読込のたびに増えるので、UI 側はボタンの再構築要否の判定に使える。
+    """
+
+    def __init__(self, path: str = ""):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime: float | None = None
+        self._actions: tuple[ActionSpec, ...] = DEFAULT_ACTIONS
+        self.version = 0
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """ファイルが更新されていれば読み直す。読み直した場合は True。"""
+        try:
+            mtime = os.stat(self._path).st_mtime if self._path else None
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            if mtime is None:
+                self._actions = DEFAULT_ACTIONS
+            else:
+                try:
+                    with open(self._path, encoding="utf-8") as f:
+                        self._actions = parse_actions(json.load(f))
+                    logger.info("%d 件のアクションを読み込みました: %s", len(self._actions), self._path)
+                except (OSError, ValueError, TypeError, KeyError) as e:
+                    # 編集途中の壊れたファイルでは直前の定義を維持する
+                    logger.warning("アクション定義の読み込みに失敗しました: %s", e)
+                    return False
+            self.version += 1
+            return True
+
+    def actions(self) -> tuple[ActionSpec, ...]:
+        self.reload_if_changed()
+        with self._lock:
+            return self._actions
+
+    def get(self, key: str) -> ActionSpec | None:
+        for spec in self.actions():
+            if spec.key == key:
+                return spec
+        return None
+
+
+_registry: ActionRegistry | None = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ActionRegistry:
+    """ActionRegistry をシングルトン的に生成して返す。"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ActionRegistry(config.ACTIONS_CONFIG_PATH)
+        return _registry
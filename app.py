@@ -0,0 +1,318 @@
+"""
+app.py
+PopAI - Windows 11 デスクトップ常駐アシスタントのアプリ本体。
+システムトレイに常駐し、グローバルホットキー (Ctrl+Alt+Space) でフロートウィンドウを起動する。
+起動は main.py から行う。
+"""
+
+import sys
+import logging
+from PyQt6.QtWidgets import QApplication, QSystemTrayIcon, QMenu, QWidget, QMessageBox, QFileDialog
+from PyQt6.QtGui import QIcon, QPixmap, QColor, QPainter, QBrush
+from PyQt6.QtCore import Qt, QTimer, QObject, pyqtSignal
+
+from hotkey import HotkeyThread
+from session_manager import SessionManager
+from api_worker import HealthCheckWorker
+import config
+import job_queue
+import logging_setup
+import process_worker
+import profiling
+import retrieval
+import stall_watchdog
+import actions
+import usage
+
+logger = logging.getLogger("popai.app")
+
+
+# ------------------------------------------------------------------ #
+# トレイアイコン用のシンプルな画像を動的生成
+# ------------------------------------------------------------------ #
+def make_tray_icon() -> QIcon:
+    pixmap = QPixmap(32, 32)
+    pixmap.fill(Qt.GlobalColor.transparent)
+    painter = QPainter(pixmap)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    painter.setBrush(QBrush(QColor("#9C27B0")))
+    painter.setPen(Qt.PenStyle.NoPen)
+    painter.drawEllipse(2, 2, 28, 28)
+    painter.setPen(QColor("white"))
+    font = painter.font()
+    font.setBold(True)
+    font.setPixelSize(16)
+    painter.setFont(font)
+    painter.drawText(pixmap.rect(), Qt.AlignmentFlag.AlignCenter, "P")
+    painter.end()
+    return QIcon(pixmap)
+
+
+class _JobNotifier(QObject):
+    """ジョブワーカースレッドからの完了通知をメインスレッドへ渡す。"""
+    finished = pyqtSignal(int)
+
+
+# ------------------------------------------------------------------ #
+# メインクラス
+# ------------------------------------------------------------------ #
+class PopAIApp:
+    def __init__(self):
+        # print() の代わりにキュー経由のログを使う（I/O は専用スレッドで行う）
+        logging_setup.setup_logging()
+        self.app = QApplication(sys.argv)
+        # 最後のウィンドウが閉じてもアプリを終了しない（トレイ常駐）
+        self.app.setQuitOnLastWindowClosed(False)
+
+        # システムトレイが利用可能か確認
+        if not QSystemTrayIcon.isSystemTrayAvailable():
+            logger.error("システムトレイが利用できません。")
+            logging_setup.shutdown_logging()
+            sys.exit(1)
+
+        self._sessions = SessionManager(config.MAX_SESSIONS, on_background=self._submit_job)
+        # バックグラウンドジョブ（完了通知はシグナルでメインスレッドに戻す）
+        self._job_notifier = _JobNotifier()
+        self._job_notifier.finished.connect(self._on_job_finished)
+        self._jobs = job_queue.get_queue(on_finished=lambda job: self._job_notifier.finished.emit(job.id))
+        # 通知バルーンのクリックで開くジョブ
+        self._notified_job_id: int | None = None
+        self._health_worker: HealthCheckWorker | None = None
+        # QMenu の親として非表示 QWidget を使う（Windows 11 での互換性向上）
+        self._tray_parent = QWidget()
+        self._tray_parent.hide()
+        self._setup_tray()
+        self._setup_hotkey()
+        self._jobs.start()
+        self.app.aboutToQuit.connect(self._jobs.stop)
+
+        # 別プロセス実行の場合は、最初のリクエストを待たせないよう子プロセスを先に起動しておく
+        if config.PROCESS_WORKER:
+            process_worker.get_engine().start()
+            self.app.aboutToQuit.connect(process_worker.shutdown)
+
+        # 文書検索を使う場合は、最初の質問を待たせないよう先にインデックスを更新しておく
+        # （別プロセス実行では検索も子プロセスで行うため、更新は子プロセスの起動時に行う）
+        if retrieval.enabled() and not config.PROCESS_WORKER:
+            retrieval.refresh_in_background()
+
+        self._watchdog: stall_watchdog.StallWatchdog | None = None
+        if config.STALL_WATCHDOG:
+            self._setup_watchdog()
+
+        # POPAI_PROFILE=true なら起動直後から全スレッドを計測する
+        if config.POPAI_PROFILE:
+            self._toggle_profiling()
+
+        # 終了処理の最後に、キューに残ったログを書き出す
+        self.app.aboutToQuit.connect(logging_setup.shutdown_logging)
+
+    # ------------------------------------------------------------------ #
+    # システムトレイ
+    # ------------------------------------------------------------------ #
+    def _setup_tray(self):
+        icon = make_tray_icon()
+        self._tray = QSystemTrayIcon(icon, parent=self._tray_parent)
+        self._tray.setToolTip("PopAI - Ctrl+Alt+Space でアシスタントを起動")
+
+        # メニューも同じ親を使う
+        menu = QMenu(self._tray_parent)
+        show_action = menu.addAction("ウィンドウを表示")
+        show_action.triggered.connect(lambda: self._open_session(""))
+        open_file_action = menu.addAction("ファイルを開く...")
+        open_file_action.triggered.connect(self._open_file)
+        usage_action = menu.addAction("使用量の統計")
+        usage_action.triggered.connect(self._show_usage_stats)
+        health_action = menu.addAction("接続確認")
+        health_action.triggered.connect(self._run_health_check)
+        self._profile_action = menu.addAction("プロファイル開始")
+        self._profile_action.triggered.connect(self._toggle_profiling)
+        self._jobs_menu = menu.addMenu("バックグラウンドジョブ")
+        self._jobs_menu.aboutToShow.connect(self._populate_jobs_menu)
+        stall_action = menu.addAction("フリーズ統計")
+        stall_action.triggered.connect(self._show_stall_stats)
+        menu.addSeparator()
+        quit_action = menu.addAction("終了")
+        quit_action.triggered.connect(self.app.quit)
+        self.app.aboutToQuit.connect(profiling.stop_and_dump)
+
+        self._tray.setContextMenu(menu)
+        self._tray.show()
+
+        # isVisible で表示確認
+        if self._tray.isVisible():
+            logger.info("システムトレイアイコンの表示に成功しました。")
+        else:
+            logger.warning("トレイアイコンが表示されていません。")
+
+        # ダブルクリックでもウィンドウを表示
+        self._tray.activated.connect(self._on_tray_activated)
+        self._tray.messageClicked.connect(self._on_message_clicked)
+
+    def _on_tray_activated(self, reason: QSystemTrayIcon.ActivationReason):
+        if reason == QSystemTrayIcon.ActivationReason.DoubleClick:
+            self._open_session("")
+
+    def _notify(self, title: str, message: str, icon: QSystemTrayIcon.MessageIcon,
+                job_id: int | None = None):
+        """トレイ通知を表示する。job_id を渡すと、通知のクリックでそのジョブの結果を開く。"""
+        self._notified_job_id = job_id
+        self._tray.showMessage(title, message, icon)
+
+    def _on_message_clicked(self):
+        if self._notified_job_id is not None:
+            self._open_job(self._notified_job_id)
+
+    # ------------------------------------------------------------------ #
+    # バックグラウンドジョブ
+    # ------------------------------------------------------------------ #
+    def _submit_job(self, action: str, text: str, priority: int):
+        job = self._jobs.submit(action, text, priority)
+        pending = self._jobs.store.pending_count()
+        self._notify("PopAI - バックグラウンドへ登録",
+                     f"ジョブ #{job.id} を登録しました（処理待ち {pending} 件）",
+                     QSystemTrayIcon.MessageIcon.Information)
+
+    def _on_job_finished(self, job_id: int):
+        job = self._jobs.store.get(job_id)
+        if job is None or job.status == job_queue.STATUS_CANCELLED:
+            return
+        spec = actions.get_registry().get(job.action)
+        label = spec.label if spec else job.action
+        if job.status == job_queue.STATUS_DONE:
+            preview = job.result.strip().replace("\n", " ")[:80]
+            self._notify(f"PopAI - {label} 完了 (#{job.id})", f"{preview}\n（クリックで結果を表示）",
+                         QSystemTrayIcon.MessageIcon.Information, job.id)
+        else:
+            self._notify(f"PopAI - {label} 失敗 (#{job.id})", job.error,
+                         QSystemTrayIcon.MessageIcon.Warning, job.id)
+
+    def _open_job(self, job_id: int):
+        job = self._jobs.store.get(job_id)
+        if job is None:
+            return
+        answer = job.result if job.status == job_queue.STATUS_DONE else f"❌ {job.error or job.status}"
+        self._sessions.open_result(job.text, answer)
+
+    def _populate_jobs_menu(self):
+        """トレイメニューを開くたびに最近のジョブ一覧を作り直す。"""
+        self._jobs_menu.clear()
+        marks = {
+            job_queue.STATUS_QUEUED:    "⏳", job_queue.STATUS_RUNNING:   "▶",
+            job_queue.STATUS_DONE:      "✅", job_queue.STATUS_FAILED:    "❌",
+            job_queue.STATUS_CANCELLED: "—",
+        }
+        jobs = self._jobs.store.recent(10)
+        if not jobs:
+            self._jobs_menu.addAction("(ジョブなし)").setEnabled(False)
+        for job in jobs:
+            spec = actions.get_registry().get(job.action)
+            label = spec.label if spec else job.action
+            preview = job.text.strip().replace("\n", " ")[:30]
+            item = self._jobs_menu.addAction(f"{marks.get(job.status, '?')} #{job.id} {label}: {preview}")
+            if job.status in (job_queue.STATUS_DONE, job_queue.STATUS_FAILED):
+                item.triggered.connect(lambda _, i=job.id: self._open_job(i))
+            else:
+                item.setEnabled(False)
+
+    def _show_usage_stats(self):
+        QMessageBox.information(
+            self._tray_parent, "PopAI - 使用量の統計", usage.get_tracker().format_summary()
+        )
+
+    def _run_health_check(self):
+        # 前回のチェックが終わっていなければ結果を待つ
+        if self._health_worker and self._health_worker.isRunning():
+            return
+        self._health_worker = HealthCheckWorker()
+        self._health_worker.checked.connect(self._on_health_checked)
+        self._health_worker.start()
+
+    def _on_health_checked(self, ok: bool, message: str):
+        icon = (QSystemTrayIcon.MessageIcon.Information if ok
+                else QSystemTrayIcon.MessageIcon.Warning)
+        title = "PopAI - 接続OK" if ok else "PopAI - 接続エラー"
+        self._notify(title, message, icon)
+
+    def _toggle_profiling(self):
+        profiler = profiling.get_profiler()
+        if not profiler.running:
+            profiler.start()
+            self._profile_action.setText("プロファイル停止して保存")
+            return
+        paths = profiling.stop_and_dump()
+        self._profile_action.setText("プロファイル開始")
+        if paths:
+            self._notify("PopAI - プロファイル保存", "\n".join(paths),
+                         QSystemTrayIcon.MessageIcon.Information)
+
+    def _show_stall_stats(self):
+        text = (self._watchdog.format_histogram() if self._watchdog
+                else "ウォッチドッグは無効です (STALL_WATCHDOG=False)")
+        QMessageBox.information(self._tray_parent, "PopAI - フリーズ統計", text)
+
+    # ------------------------------------------------------------------ #
+    # UI フリーズ検出
+    # ------------------------------------------------------------------ #
+    def _setup_watchdog(self):
+        self._watchdog = stall_watchdog.StallWatchdog(
+            threshold        = config.STALL_THRESHOLD_MS / 1000,
+            context_provider = self._sessions.request_info,
+            log_path         = config.STALL_LOG_PATH,
+        )
+        # イベントループが回っている限り一定間隔で beat() が呼ばれる
+        self._heartbeat = QTimer()
+        self._heartbeat.setInterval(config.STALL_HEARTBEAT_MS)
+        self._heartbeat.timeout.connect(self._watchdog.beat)
+        self._heartbeat.start()
+        self._watchdog.start()
+        self.app.aboutToQuit.connect(self._watchdog.stop)
+
+    # ------------------------------------------------------------------ #
+    # ホットキースレッド
+    # ------------------------------------------------------------------ #
+    def _setup_hotkey(self):
+        self._hotkey_thread = HotkeyThread()
+        self._hotkey_thread.clipboard_ready.connect(self._on_clipboard_ready)
+        self._hotkey_thread.start()
+
+    # ------------------------------------------------------------------ #
+    # クリップボード受信 → フロートウィンドウ表示
+    # ------------------------------------------------------------------ #
+    def _on_clipboard_ready(self, text: str):
+        logger.info("クリップボード取得: %d 文字", len(text))
+        self._open_session(text)
+
+    def _open_session(self, text: str):
+        if self._sessions.open(text) is None:
+            self._notify(
+                "PopAI - ウィンドウ上限",
+                f"処理中のウィンドウが上限 ({self._sessions.max_sessions} 件) に達しています。"
+                "いずれかの処理が終わってから再度お試しください。",
+                QSystemTrayIcon.MessageIcon.Warning,
+            )
+
+    def _open_file(self):
+        path, _ = QFileDialog.getOpenFileName(
+            None, "PopAI - ファイルを開く", "",
+            "テキストファイル (*.txt *.md *.log *.csv *.json *.py);;すべてのファイル (*)",
+        )
+        if not path:
+            return
+        logger.info("ファイルを開きます: %s", path)
+        if self._sessions.open_file(path) is None:
+            self._notify(
+                "PopAI - ウィンドウ上限",
+                f"処理中のウィンドウが上限 ({self._sessions.max_sessions} 件) に達しています。"
+                "いずれかの処理が終わってから再度お試しください。",
+                QSystemTrayIcon.MessageIcon.Warning,
+            )
+
+    # ------------------------------------------------------------------ #
+    # 起動
+    # ------------------------------------------------------------------ #
+    def run(self) -> int:
+        logger.info("起動しました。Ctrl+Alt+Space でアシスタントを呼び出せます。")
+        logger.info("トレイアイコンを右クリックして「終了」を選択すると終了します。")
+        logger.info("※トレイアイコンが見えない場合はタスクバー右端の「^」をクリックしてください。")
+        return self.app.exec()
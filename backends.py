@@ -0,0 +1,314 @@
+"""
+backends.py
+推論バックエンドの共通プロトコルと実装。
+どのバックエンドも「ストリーミング生成 / キャンセル / ヘルスチェック」を提供し、
+ApiWorker はバックエンドの種類を意識せずに StreamChunk を受け取るだけでよい。
+
+  OpenAICompatibleBackend … Azure OpenAI / ローカルの OpenAI 互換サーバー（openai SDK 経由）
+  DummyBackend            … 課金なしのダミー応答をトークン単位で流すバックエンド
+  ReplayBackend           … stream_recorder で記録した実ストリームを再生するバックエンド
+
+インスタンスはリクエストごとに生成する（cancel() はそのリクエストだけを止める）。
+HTTP 接続プールは action_runner 側でキャッシュしたクライアントを共有する。
+"""
+
+import itertools
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator, Protocol
+
+import actions
+import stream_recorder
+
+logger = logging.getLogger("popai.api")
+
+
+# ================================================================== #
+# データ定義
+# ================================================================== #
+@dataclass
+class GenerationRequest:
+    """バックエンドに渡す 1 回分の生成リクエスト。"""
+    action: str
+    messages: list[dict]
+    model: str
+    max_tokens: int | None = None
+    temperature: float | None = None
+    include_usage: bool = False
+
+
+@dataclass
+class StreamChunk:
+    """
+    ストリームの 1 要素。
+    text が空で usage だけを持つチャンク（最終 usage チャンク）もある。
+    """
+    text: str = ""
+    finish_reason: str | None = None
+    usage: dict | None = None
+
+
+@dataclass
+class HealthStatus:
+    ok: bool
+    detail: str = ""
+    latency: float = 0.0
+
+
+class Backend(Protocol):
+    """全バックエンドが実装するプロトコル。"""
+    name: str
+    default_model: str
+
+    def stream(self, request: GenerationRequest) -> Iterator[StreamChunk]: ...
+    def cancel(self) -> None: ...
+    def health_check(self) -> HealthStatus: ...
+
+
+def _usage_dict(usage) -> dict | None:
+    if usage is None:
+        return None
+    # プロンプトキャッシュに対応したモデル・API バージョンでのみ prompt_tokens_details が付く
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens":     getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "cached_tokens":     getattr(details, "cached_tokens", None) or 0,
+    }
+
+
+def chunk_from_payload(payload: dict) -> StreamChunk | None:
+    """
+    chat.completion.chunk の JSON (dict) から StreamChunk を作る。
+    SDK オブジェクトから作る場合と同じ規則で、意味のない空チャンクは None を返す。
+    """
+    usage = payload.get("usage")
+    if usage is not None:
+        details = usage.get("prompt_tokens_details") or {}
+        usage = {
+            "prompt_tokens":     usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "cached_tokens":     details.get("cached_tokens") or 0,
+        }
+    choices = payload.get("choices")
+    if not choices:
+        return StreamChunk(usage=usage) if usage is not None else None
+    choice = choices[0]
+    text = (choice.get("delta") or {}).get("content") or ""
+    finish_reason = choice.get("finish_reason")
+    if text or finish_reason or usage:
+        return StreamChunk(text, finish_reason, usage)
+    return None
+
+
+# ================================================================== #
+# OpenAI 互換バックエンド（Azure / ローカルサーバー）
+# ================================================================== #
+class OpenAICompatibleBackend:
+    """
+    openai SDK のクライアント（AzureOpenAI / OpenAI）を使うバックエンド。
+    client は action_runner でキャッシュしたものを受け取る。
+    record_dir を指定すると、受信したチャンクをタイミング付きで記録する。
+    """
+
+    def __init__(self, name: str, client, default_model: str, record_dir: str = ""):
+        self.name = name
+        self.default_model = default_model
+        self._client = client
+        self._record_dir = record_dir
+        self._cancelled = threading.Event()
+        self._response = None
+
+    def stream(self, request: GenerationRequest) -> Iterator[StreamChunk]:
+        kwargs = {}
+        if request.max_tokens is not None:
+            kwargs["max_tokens"] = request.max_tokens
+        if request.temperature is not None:
+            kwargs["temperature"] = request.temperature
+        if request.include_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+
+        if self._cancelled.is_set():
+            return
+        recorder = None
+        if self._record_dir:
+            recorder = stream_recorder.StreamRecorder.create(
+                self._record_dir, self.name, request.action, request.model
+            )
+        try:
+            response = self._client.chat.completions.create(
+                model    = request.model,
+                messages = request.messages,
+                stream   = True,
+                **kwargs,
+            )
+        except Exception:
+            if recorder is not None:
+                recorder.close()
+            raise
+        self._response = response
+        try:
+            for chunk in response:
+                if self._cancelled.is_set():
+                    break
+                if recorder is not None:
+                    recorder.write(chunk)
+                usage = _usage_dict(getattr(chunk, "usage", None))
+                # Azure のコンテンツフィルタ結果や include_usage の最終チャンクは choices が空
+                if not chunk.choices:
+                    if usage is not None:
+                        yield StreamChunk(usage=usage)
+                    continue
+                choice = chunk.choices[0]
+                text = getattr(choice.delta, "content", None) or ""
+                finish_reason = getattr(choice, "finish_reason", None)
+                if text or finish_reason or usage:
+                    yield StreamChunk(text, finish_reason, usage)
+        finally:
+            self._response = None
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+            if recorder is not None:
+                recorder.close()
+                logger.info("ストリームを記録しました: %s", recorder.path)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        response = self._response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass    # 読み込み中のクローズ失敗は無視する（ループ側で中断される）
+
+    def health_check(self) -> HealthStatus:
+        started = time.perf_counter()
+        try:
+            self._client.models.list()
+        except Exception as e:
+            return HealthStatus(False, f"{type(e).__name__}: {e}", time.perf_counter() - started)
+        return HealthStatus(True, "OK", time.perf_counter() - started)
+
+
+# ================================================================== #
+# ダミーバックエンド
+# ================================================================== #
+# 英数字の連続は 1 トークン、それ以外（日本語・記号）は 1 文字 1 トークンとして流す
+_DUMMY_TOKEN_RE = re.compile(r"\s*[A-Za-z0-9_]+|\s*[^\sA-Za-z0-9_]|\s+")
+
+
+class DummyBackend:
+    """
+    Azure OpenAI の代替となるダミーバックエンド（課金なし / GUI テスト用）。
+    first_token_delay 秒の待ち時間の後、tokens_per_sec の速度でトークンを流す。
+    tokens_per_sec <= 0 の場合は待たずに流し切る。
+    """
+
+    name = "dummy"
+    default_model = "dummy"
+
+    def __init__(self, tokens_per_sec: float = 40.0, first_token_delay: float = 0.5):
+        self._tokens_per_sec = tokens_per_sec
+        self._first_token_delay = first_token_delay
+        self._cancelled = threading.Event()
+
+    def _make_text(self, request: GenerationRequest) -> str:
+        spec = actions.get_registry().get(request.action)
+        label = spec.label if spec else request.action
+        user_text = request.messages[-1]["content"] if request.messages else ""
+        char_count = len(user_text)
+        return (
+            f"[{label}] のダミー回答です。\n\n"
+            f"受け取ったテキストの文字数: {char_count} 文字\n\n"
+            f"--- 受け取ったテキスト（先頭100文字）---\n"
+            f"{user_text[:100]}{'...' if char_count > 100 else ''}\n\n"
+            f"※ USE_DUMMY_API = True のため実際のAPIは呼び出されていません。\n"
+            f"  本番に切り替えるには config.py の USE_DUMMY_API を False にしてください。"
+        )
+
+    def stream(self, request: GenerationRequest) -> Iterator[StreamChunk]:
+        text = self._make_text(request)
+        tokens = _DUMMY_TOKEN_RE.findall(text)
+        interval = 1.0 / self._tokens_per_sec if self._tokens_per_sec > 0 else 0.0
+
+        # 通信遅延のシミュレート（Event.wait なのでキャンセルで即座に抜ける）
+        if self._cancelled.wait(self._first_token_delay):
+            return
+        for token in tokens:
+            yield StreamChunk(token)
+            if interval and self._cancelled.wait(interval):
+                return
+            if self._cancelled.is_set():
+                return
+
+        prompt_tokens = sum(len(_DUMMY_TOKEN_RE.findall(m["content"])) for m in request.messages)
+        yield StreamChunk(finish_reason="stop", usage={
+            "prompt_tokens":     prompt_tokens,
+            "completion_tokens": len(tokens),
+            "cached_tokens":     0,
+        })
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def health_check(self) -> HealthStatus:
+        return HealthStatus(True, "ダミーバックエンド")
+
+
+# ================================================================== #
+# 記録再生バックエンド
+# ================================================================== #
+_replay_counter = itertools.count()
+
+
+class ReplayBackend:
+    """
+    stream_recorder で記録したストリームを再生するバックエンド。
+    speed = 1.0 で記録時と同じ間隔、2.0 で 2 倍速、0 以下で待たずに流し切る。
+    path がディレクトリの場合は、中の記録ファイルをリクエストごとに順番に使う。
+    チャンクは SSE の JSON と同じ dict から組み立てるので、解析処理の負荷も再現される。
+    """
+
+    name = "replay"
+    default_model = "replay"
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self._path = path
+        self._speed = speed
+        self._cancelled = threading.Event()
+
+    def _next_file(self) -> str:
+        files = stream_recorder.list_recordings(self._path)
+        if not files:
+            raise FileNotFoundError(f"記録ファイルがありません: {self._path}")
+        return files[next(_replay_counter) % len(files)]
+
+    def stream(self, request: GenerationRequest) -> Iterator[StreamChunk]:
+        _, events = stream_recorder.read_recording(self._next_file())
+        started = time.perf_counter()
+        for elapsed, payload in events:
+            if self._speed > 0:
+                delay = started + elapsed / self._speed - time.perf_counter()
+                if delay > 0 and self._cancelled.wait(delay):
+                    return
+            if self._cancelled.is_set():
+                return
+            chunk = chunk_from_payload(payload)
+            if chunk is not None:
+                yield chunk
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def health_check(self) -> HealthStatus:
+        try:
+            files = stream_recorder.list_recordings(self._path)
+        except OSError as e:
+            return HealthStatus(False, f"{type(e).__name__}: {e}")
+        if not files:
+            return HealthStatus(False, f"記録ファイルがありません: {self._path}")
+        return HealthStatus(True, f"{len(files)} 件の記録ファイル")
@@ -0,0 +1,83 @@
+"""
+bench_replay.py
+記録したストリーム（STREAM_RECORD_DIR で保存したファイル）を再生して、
+解析処理と UI 描画の性能をネットワーク無しで再現性よく測定するスクリプト。
+
+  python bench_replay.py <記録ファイル or ディレクトリ> [--speed 0] [--repeat 20] [--ui]
+
+  --speed 0 : 待たずに流し切る（既定）。1.0 で記録時と同じ間隔で再生する
+  --ui      : オフスクリーンの FloatWindow に実際に描画し、UI スレッドの処理時間も測る
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import backends
+
+
+def _request() -> backends.GenerationRequest:
+    return backends.GenerationRequest(action="S", messages=[], model="replay")
+
+
+def bench_parse(path: str, speed: float, repeat: int):
+    """バックエンドの再生・解析だけを測定する。"""
+    wall, cpu, chunks = [], [], 0
+    for _ in range(repeat):
+        backend = backends.ReplayBackend(path, speed)
+        w0, c0 = time.perf_counter(), time.process_time()
+        chunks = sum(1 for _ in backend.stream(_request()))
+        wall.append(time.perf_counter() - w0)
+        cpu.append(time.process_time() - c0)
+    print(f"[parse] {chunks} chunks x {repeat}: "
+          f"wall median {statistics.median(wall) * 1000:.2f} ms, "
+          f"cpu median {statistics.median(cpu) * 1000:.2f} ms")
+
+
+def bench_ui(path: str, speed: float, repeat: int):
+    """ApiWorker → FloatWindow の描画までを測定する。"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import config
+    config.POPAI_BACKEND = "replay"
+    config.REPLAY_PATH = path
+    config.REPLAY_SPEED = speed
+    config.USAGE_LOG_PATH = ""
+
+    from PyQt6.QtWidgets import QApplication
+    from float_window import FloatWindow
+
+    app = QApplication(sys.argv)
+    window = FloatWindow()
+    window.show_with_text("bench")
+
+    wall = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        window._on_button_clicked("S")
+        worker = window._api_worker
+        while not worker.isFinished():
+            app.processEvents()
+        app.processEvents()     # キューに残ったチャンクのシグナルを描画し切る
+        wall.append(time.perf_counter() - started)
+    print(f"[ui] {repeat} runs: wall median {statistics.median(wall) * 1000:.2f} ms, "
+          f"max {max(wall) * 1000:.2f} ms, "
+          f"result {len(window._result_area.toPlainText())} chars")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録したストリームを再生して性能を測定する")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--ui", action="store_true")
+    args = parser.parse_args()
+
+    bench_parse(args.path, args.speed, args.repeat)
+    if args.ui:
+        bench_ui(args.path, args.speed, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+bench_sse.py
+openai SDK 経由の受信（OpenAICompatibleBackend）と SSE 直接解析の高速経路（sse_stream.SSEBackend）の
+CPU 時間を比較するスクリプト。ローカルに起動した偽の Chat Completions サーバーからストリームを受信する。
+
+  python bench_sse.py [--tokens 2000] [--repeat 10]
+
+サーバーは別プロセスで動かすため、表示される CPU 時間は受信側（PopAI 側）の処理だけを含む。
+"""
+
+import argparse
+import json
+import multiprocessing
+import statistics
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import backends
+import sse_stream
+
+# Azure のチャンクに近い形（コンテンツフィルタ結果付き）にする
+_FILTER = {name: {"filtered": False, "severity": "safe"}
+           for name in ("hate", "self_harm", "sexual", "violence")}
+_WORDS = ["これは", "ベンチマーク", "用の", "応答", "です。", " The", " quick", " brown", " fox", "\n"]
+
+
+def _event(payload: dict) -> bytes:
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def _chunk(content: str | None, finish_reason: str | None = None) -> dict:
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0,
+        "model": "bench", "system_fingerprint": "fp_bench",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason,
+                     "logprobs": None, "content_filter_results": _FILTER}],
+    }
+
+
+def build_stream(tokens: int) -> bytes:
+    events = [_event(_chunk(_WORDS[i % len(_WORDS)])) for i in range(tokens)]
+    events.append(_event(_chunk(None, "stop")))
+    events.append(_event({
+        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+        "choices": [],
+        "usage": {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens,
+                  "prompt_tokens_details": {"cached_tokens": 0}},
+    }))
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+
+def _serve(tokens: int, ready):
+    body = build_stream(tokens)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # 実際のストリームと同じく、小さな HTTP チャンクに分けて送る
+            for start in range(0, len(body), 4096):
+                piece = body[start:start + 4096]
+                self.wfile.write(f"{len(piece):x}\r\n".encode() + piece + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+def _request() -> backends.GenerationRequest:
+    return backends.GenerationRequest(action="S", messages=[{"role": "user", "content": "bench"}],
+                                      model="bench", include_usage=True)
+
+
+def bench(label: str, backend_factory, repeat: int):
+    cpu, wall, tokens, chars = [], [], 0, 0
+    for _ in range(repeat + 1):
+        backend = backend_factory()
+        w0, c0 = time.perf_counter(), time.process_time()
+        texts: list[str] = []
+        count = 0
+        for chunk in backend.stream(_request()):
+            if chunk.text:
+                texts.append(chunk.text)
+                count += 1
+        answer = "".join(texts)
+        elapsed_cpu, elapsed_wall = time.process_time() - c0, time.perf_counter() - w0
+        if not texts:
+            raise RuntimeError(f"{label}: ストリームを受信できませんでした")
+        tokens, chars = count, len(answer)
+        cpu.append(elapsed_cpu)
+        wall.append(elapsed_wall)
+    # 1 回目は接続確立と import を含むため除く
+    cpu, wall = cpu[1:], wall[1:]
+    per_1k = statistics.median(cpu) / tokens * 1000
+    print(f"[{label:4}] {tokens} tokens ({chars} chars) x {repeat}: "
+          f"cpu median {statistics.median(cpu) * 1000:.2f} ms ({per_1k * 1000:.2f} ms / 1k tokens), "
+          f"wall median {statistics.median(wall) * 1000:.2f} ms")
+    return per_1k
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SDK 経由と SSE 直接解析の受信 CPU 時間を比較する")
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    import httpx
+    from openai import OpenAI
+
+    ready, child_ready = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=_serve, args=(args.tokens, child_ready), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{ready.recv()}/v1"
+
+    # action_runner と同じく、1 つの httpx.Client（接続プール）を両方の経路で共有する
+    http_client = httpx.Client()
+    client = OpenAI(base_url=base_url, api_key="bench", http_client=http_client)
+    try:
+        sdk = bench("sdk", lambda: backends.OpenAICompatibleBackend("local", client, "bench"), args.repeat)
+        fast = bench("fast", lambda: sse_stream.SSEBackend(
+            "local", client, http_client, lambda model: f"{base_url}/chat/completions",
+            {"Authorization": "Bearer bench"}, "bench",
+        ), args.repeat)
+        print(f"高速経路の CPU 時間は SDK 経由の {fast / sdk:.0%}")
+    finally:
+        http_client.close()
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
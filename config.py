@@ -5,6 +5,7 @@ Azure OpenAI 認証情報 + ダミーモードの設定ファイル。
 【ダミーモードから本番への切り替え】
   USE_DUMMY_API = True  → ダミー応答（課金なし / GUI テスト用）
   USE_DUMMY_API = False → 実際の Azure OpenAI API を呼び出す
+  ※ POPAI_BACKEND ("dummy" / "azure" / "local" / "replay") を指定した場合はそちらが優先される
 
 【認証情報の設定方法】
   A) 環境変数（推奨）:
@@ -54,3 +55,154 @@ AZURE_OPENAI_API_VERSION = os.getenv(
 # True にすると、Azure OpenAI 通信時に SSL 証明書の検証を行いません。
 _disable_ssl = os.getenv("DISABLE_SSL_VERIFY", "False").lower()
 DISABLE_SSL_VERIFY: bool = (_disable_ssl == "true")
+
+# ── ローカルデータの保存先 ────────────────────────────────────────────
+POPAI_DATA_DIR = os.getenv(
+    "POPAI_DATA_DIR",
+    os.path.join(os.path.expanduser("~"), ".popai")
+)
+
+# ── トークン使用量の記録 ─────────────────────────────────────────────
+# 空文字にするとファイルへ保存せず、起動中のみメモリ上で集計する。
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", os.path.join(POPAI_DATA_DIR, "usage.jsonl"))
+
+# True にするとストリームの最終チャンクで usage を受け取る (stream_options.include_usage)。
+# 未指定（None）なら有効にする。ただし azure で AZURE_OPENAI_API_VERSION が
+# 2024-09-01-preview より古い場合は未対応（400 エラー）のため無効にする（action_runner.include_usage）。
+# 無効または usage が返らない場合はオフライン推定値で記録する。
+_include_usage = os.getenv("STREAM_INCLUDE_USAGE", "").lower()
+STREAM_INCLUDE_USAGE: bool | None = (_include_usage == "true") if _include_usage else None
+
+# 1000 トークンあたりの単価（0 ならコストは表示しない）
+PRICE_PER_1K_PROMPT_TOKENS     = float(os.getenv("PRICE_PER_1K_PROMPT_TOKENS", "0"))
+PRICE_PER_1K_COMPLETION_TOKENS = float(os.getenv("PRICE_PER_1K_COMPLETION_TOKENS", "0"))
+PRICE_CURRENCY                 = os.getenv("PRICE_CURRENCY", "USD")
+
+# ── 1日あたりのトークン予算 ─────────────────────────────────────────
+# DAILY_TOKEN_BUDGET = 0 なら無制限。
+# BUDGET_MODE = "block"     → 予算超過時はリクエストを拒否する
+# BUDGET_MODE = "downgrade" → 予算超過時は BUDGET_DOWNGRADE_DEPLOYMENT に切り替える
+DAILY_TOKEN_BUDGET          = int(os.getenv("DAILY_TOKEN_BUDGET", "0"))
+BUDGET_MODE                 = os.getenv("BUDGET_MODE", "block").lower()
+BUDGET_DOWNGRADE_DEPLOYMENT = os.getenv("BUDGET_DOWNGRADE_DEPLOYMENT", "")
+
+# ── アクション（ボタン）定義ファイル ─────────────────────────────────
+# JSON で各ボタンのプロンプト・デプロイメント・生成パラメータを定義する。
+# 起動中にファイルを編集すると自動で再読込される（書式は actions.py を参照）。
+ACTIONS_CONFIG_PATH = os.getenv(
+    "ACTIONS_CONFIG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "actions.json")
+)
+
+# ── プロンプトの共通部分（プロンプトキャッシュ向け） ─────────────────────
+# 全アクションの system メッセージ末尾に付ける参考情報（用語集・社内ルールなど）。
+# 毎回同じ内容が先頭に来るため、1024 トークンを超えると Azure のプロンプトキャッシュが効く。
+SHARED_CONTEXT_FILE = os.getenv("SHARED_CONTEXT_FILE", "")
+
+# keep_history のアクション（チャット）で送る過去のやり取りの最大往復数
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))
+
+# ── 同時に開けるポップアップ（セッション） ──────────────────────────────
+# ホットキーのたびに空いているウィンドウを再利用するか、新しいウィンドウを開く。
+# 上限はウィンドウ数（＝同時リクエスト数）で、メモリと API クォータの消費を抑える。
+MAX_SESSIONS = max(1, int(os.getenv("MAX_SESSIONS", "4")))
+
+# 同じアクション・同じテキストのリクエストが同時に走った場合、上流のストリームを 1 本にまとめる
+_single_flight = os.getenv("SINGLE_FLIGHT", "True").lower()
+SINGLE_FLIGHT: bool = (_single_flight != "false")
+
+# openai SDK の代わりに SSE を直接解析してストリームを受信する（azure / local バックエンドのみ）
+# SDK がデルタごとに組み立てるチャンクオブジェクトを省き、受信時の CPU 負荷を下げる（sse_stream.py）
+_fast_sse = os.getenv("FAST_SSE", "False").lower()
+FAST_SSE: bool = (_fast_sse == "true")
+
+# ── 別プロセスでの実行（任意） ──────────────────────────────────────────
+# True にすると、ストリームの受信・解析を子プロセス（process_worker.py）で行い、
+# UI のプロセスは受け取った文字列の表示だけを行う。子プロセスが落ちても自動で再起動する。
+_process_worker = os.getenv("PROCESS_WORKER", "False").lower()
+PROCESS_WORKER: bool = (_process_worker == "true")
+# 子プロセスから受信テキストをまとめて送る間隔（ミリ秒）
+PROCESS_WORKER_FLUSH_MS = max(1, int(os.getenv("PROCESS_WORKER_FLUSH_MS", "30")))
+
+# ── ファイル入力（ドラッグ＆ドロップ / ファイルを開く） ──────────────────
+# max_input_tokens の無いアクションでファイルを処理するときの 1 回あたりのトークン数
+FILE_CHUNK_TOKENS = int(os.getenv("FILE_CHUNK_TOKENS", "6000"))
+# 分割処理するチャンク数の上限（巨大なログで API を使い切らないように）
+FILE_MAX_CHUNKS   = int(os.getenv("FILE_MAX_CHUNKS", "50"))
+
+# ── バックグラウンドジョブ ──────────────────────────────────────────────
+# 「バックグラウンドへ」で登録したジョブは SQLite に保存され、アプリを再起動しても残る。
+JOB_DB_PATH       = os.getenv("JOB_DB_PATH", os.path.join(POPAI_DATA_DIR, "jobs.sqlite3"))
+# 同時に処理するジョブ数（ポップアップのリクエストとは別枠）
+JOB_WORKERS       = max(1, int(os.getenv("JOB_WORKERS", "2")))
+# 完了済みジョブを何件まで残すか
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "200"))
+
+# ── 文書検索（質問アクション向け・任意） ────────────────────────────────
+# RETRIEVAL_DOCS_DIR を指定すると、retrieval が true のアクションでフォルダ内の文書から
+# 関連する段落を探してプロンプトに添える（詳細は retrieval.py を参照）。要 numpy。
+RETRIEVAL_DOCS_DIR     = os.getenv("RETRIEVAL_DOCS_DIR", "")
+RETRIEVAL_INDEX_DIR    = os.getenv("RETRIEVAL_INDEX_DIR", os.path.join(POPAI_DATA_DIR, "index"))
+# "azure"（埋め込みデプロイメントを使う）/ "hashing"（ネットワーク不要の簡易版）
+RETRIEVAL_EMBEDDING    = os.getenv("RETRIEVAL_EMBEDDING", "azure").lower()
+RETRIEVAL_EMBEDDING_DEPLOYMENT = os.getenv("RETRIEVAL_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+RETRIEVAL_TOP_K        = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv("RETRIEVAL_CHUNK_TOKENS", "400"))
+RETRIEVAL_EXTENSIONS   = tuple(
+    e.strip().lower() for e in os.getenv("RETRIEVAL_EXTENSIONS", ".txt,.md").split(",") if e.strip()
+)
+# バックグラウンドでフォルダの変更を確認する間隔（秒）。0 なら起動時の 1 回だけ
+RETRIEVAL_RESCAN_SEC   = float(os.getenv("RETRIEVAL_RESCAN_SEC", "30"))
+
+# ── 推論バックエンドの選択 ───────────────────────────────────────────
+# "dummy" / "azure" / "local" / "replay" のいずれか。
+# 未指定の場合は USE_DUMMY_API に従う（True → dummy, False → azure）。
+POPAI_BACKEND = os.getenv("POPAI_BACKEND", "").lower()
+
+# ダミーバックエンドのストリーミング速度（0 なら待たずに流し切る）
+DUMMY_TOKENS_PER_SEC    = float(os.getenv("DUMMY_TOKENS_PER_SEC", "40"))
+DUMMY_FIRST_TOKEN_DELAY = float(os.getenv("DUMMY_FIRST_TOKEN_DELAY", "0.5"))
+
+# ローカルの OpenAI 互換サーバー（llama.cpp / vLLM / Ollama など）
+LOCAL_OPENAI_BASE_URL = os.getenv("LOCAL_OPENAI_BASE_URL", "http://localhost:8000/v1")
+LOCAL_OPENAI_API_KEY  = os.getenv("LOCAL_OPENAI_API_KEY", "not-needed")
+LOCAL_OPENAI_MODEL    = os.getenv("LOCAL_OPENAI_MODEL", "local-model")
+
+# ── ストリームの記録 / 再生（性能測定用） ──────────────────────────────
+# STREAM_RECORD_DIR を指定すると azure / local の受信チャンクをタイミング付きで保存する。
+STREAM_RECORD_DIR = os.getenv("STREAM_RECORD_DIR", "")
+# POPAI_BACKEND=replay のときに再生するファイル（ディレクトリなら中のファイルを順番に使う）
+REPLAY_PATH  = os.getenv("REPLAY_PATH", os.path.join(POPAI_DATA_DIR, "recordings"))
+# 1.0 = 記録時と同じ速度 / 2.0 = 2 倍速 / 0 = 待たずに流し切る
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1.0"))
+
+# ── プロファイリング（全スレッドのサンプリング） ────────────────────────
+# True にすると起動時から計測を開始する（トレイメニューからも開始 / 停止できる）。
+_profile = os.getenv("POPAI_PROFILE", "False").lower()
+POPAI_PROFILE: bool = (_profile == "true")
+PROFILE_DIR         = os.getenv("PROFILE_DIR", os.path.join(POPAI_DATA_DIR, "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# ── UI フリーズ検出（イベントループのウォッチドッグ） ──────────────────
+_stall_watchdog = os.getenv("STALL_WATCHDOG", "True").lower()
+STALL_WATCHDOG: bool = (_stall_watchdog != "false")
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS", "500"))
+STALL_HEARTBEAT_MS = int(os.getenv("STALL_HEARTBEAT_MS", "100"))
+STALL_LOG_PATH     = os.getenv("STALL_LOG_PATH", os.path.join(POPAI_DATA_DIR, "stalls.jsonl"))
+
+# ── ログ出力 ─────────────────────────────────────────────────────────
+# LOG_LEVEL: DEBUG / INFO / WARNING / ERROR / OFF
+# LOG_MODULE_LEVELS: モジュール別のレベル 例) "api=DEBUG,hotkey=WARNING"
+#   (api / app / hotkey / actions / usage / profile / watchdog / jobs / retrieval など)
+LOG_LEVEL         = os.getenv("LOG_LEVEL", "INFO")
+LOG_MODULE_LEVELS = os.getenv("LOG_MODULE_LEVELS", "")
+LOG_FORMAT        = os.getenv("LOG_FORMAT", "text").lower()     # "text" / "json"
+_log_console = os.getenv("LOG_CONSOLE", "True").lower()
+LOG_CONSOLE: bool = (_log_console != "false")
+# 空文字にするとファイルには出力しない
+LOG_FILE           = os.getenv("LOG_FILE", os.path.join(POPAI_DATA_DIR, "logs", "popai.log"))
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(1024 * 1024)))
+LOG_FILE_BACKUPS   = int(os.getenv("LOG_FILE_BACKUPS", "3"))
+# True にするとクリップボード / 入力テキストの先頭部分をログに出す（既定は文字数のみ）
+_log_clipboard = os.getenv("LOG_CLIPBOARD_CONTENT", "False").lower()
+LOG_CLIPBOARD_CONTENT: bool = (_log_clipboard == "true")
@@ -0,0 +1,154 @@
+"""
+file_reader.py
+ドロップされたファイル・「ファイルを開く」で選んだファイルの読み込み。
+ファイル全体を 1 つの文字列にせず、mmap で一定サイズずつ読み出して
+インクリメンタルデコーダで文字列に変換するため、大きなログでもメモリ使用量が一定に収まる。
+
+【文字コードの判定】先頭のバイト列から次の順で判定する
+  1. BOM（UTF-8 / UTF-16 LE / UTF-16 BE）
+  2. NUL バイトの偏り（BOM なし UTF-16）
+  3. UTF-8 として読めるか（末尾で切れたマルチバイト文字は許容）
+  4. いずれでもなければ cp932（Shift_JIS）
+UTF-16 でないのに NUL バイトが多いものはバイナリとみなして ValueError にする。
+判定に使うのは先頭 64 KB だけなので、UTF-8 と判定したファイルの途中で
+UTF-8 として読めないバイト列が現れた場合は、そこから cp932 に切り替えて読む。
+"""
+
+import codecs
+import mmap
+import os
+from typing import Iterator
+
+from token_estimator import estimate_tokens, split_into_chunks
+
+# mmap から一度に読み出すバイト数
+BLOCK_SIZE = 1 << 20
+# 文字コード判定に使う先頭のバイト数
+_SNIFF_SIZE = 64 * 1024
+# UTF-16 でないのに、判定用サンプル中の NUL バイトがこの割合を超えたらバイナリとみなす
+_BINARY_NUL_RATIO = 0.01
+
+_BOMS = (
+    (codecs.BOM_UTF8,     "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+def detect_encoding(head: bytes) -> tuple[str, int]:
+    """(エンコーディング名, 読み飛ばす BOM のバイト数) を返す。バイナリの場合は ValueError。"""
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+
+    sample = head[:4096]
+    if len(sample) >= 4:
+        even_nuls = sample[0::2].count(0)
+        odd_nuls = sample[1::2].count(0)
+        half = len(sample) // 2
+        # ASCII 主体の UTF-16 は上位バイトがほぼ 0 になる
+        if odd_nuls > half * 0.3 and even_nuls < half * 0.05:
+            return "utf-16-le", 0
+        if even_nuls > half * 0.3 and odd_nuls < half * 0.05:
+            return "utf-16-be", 0
+    if sample.count(0) > len(sample) * _BINARY_NUL_RATIO:
+        raise ValueError("テキストファイルではないようです（NUL バイトを含みます）")
+
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8", 0
+    except UnicodeDecodeError:
+        return "cp932", 0
+
+
+def _cp932_decoder():
+    return codecs.getincrementaldecoder("cp932")(errors="replace")
+
+
+class TextFile:
+    """mmap とインクリメンタルデコーダでテキストファイルを少しずつ読む。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            self.encoding, self._offset = detect_encoding(f.read(_SNIFF_SIZE))
+        self._fallback = self.encoding == "utf-8" and self._offset == 0
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def iter_text(self, block_size: int = BLOCK_SIZE) -> Iterator[str]:
+        """改行を \\n に揃えた文字列を block_size バイト分ずつ返す。"""
+        if self.size <= self._offset:
+            return
+        # UTF-8（BOM なし）は strict で読み、読めなかった時点で cp932 に切り替える
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="strict" if self._fallback else "replace")
+        carry = ""
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(self._offset, len(mm), block_size):
+                data = mm[start:start + block_size]
+                try:
+                    decoded = decoder.decode(data)
+                except UnicodeDecodeError as e:
+                    # 読めた部分までは UTF-8、以降は cp932 で読む
+                    decoder = _cp932_decoder()
+                    decoded = e.object[:e.start].decode("utf-8") + decoder.decode(e.object[e.start:])
+                text = carry + decoded
+                # "\r\n" がブロックの境目で分かれた場合に備え、末尾の "\r" は次に回す
+                carry = ""
+                if text.endswith("\r"):
+                    text, carry = text[:-1], "\r"
+                if text:
+                    yield text.replace("\r\n", "\n")
+        try:
+            tail = decoder.decode(b"", final=True)
+        except UnicodeDecodeError as e:
+            tail = e.object[:e.start].decode("utf-8") + _cp932_decoder().decode(e.object[e.start:], final=True)
+        tail = carry + tail
+        if tail:
+            yield tail.replace("\r\n", "\n")
+
+    def iter_chunks(self, max_tokens: int, block_size: int = BLOCK_SIZE) -> Iterator[str]:
+        """
+        推定トークン数が max_tokens 以下のチャンクを先頭から順に返す。
+        保持するのは読み出し中のブロックと、次のチャンクに回す端数だけ。
+        """
+        buffer = ""
+        for block in self.iter_text(block_size):
+            buffer += block
+            if estimate_tokens(buffer) <= max_tokens:
+                continue
+            pieces = split_into_chunks(buffer, max_tokens)
+            # 最後の断片は続きのテキストと合わせて区切り直す
+            yield from pieces[:-1]
+            buffer = pieces[-1]
+        if buffer.strip():
+            yield from split_into_chunks(buffer, max_tokens)
+
+    def measure(self, max_tokens: int) -> tuple[int, int]:
+        """iter_chunks() が返すチャンク数と、全体の推定トークン数（中身は保持せずに数える）。"""
+        count = tokens = 0
+        for chunk in self.iter_chunks(max_tokens):
+            count += 1
+            tokens += estimate_tokens(chunk)
+        return count, tokens
+
+    def preview(self, max_chars: int = 4000) -> str:
+        """表示用に先頭の max_chars 文字だけを返す。"""
+        parts, length = [], 0
+        for block in self.iter_text(block_size=max(4096, max_chars * 4)):
+            parts.append(block)
+            length += len(block)
+            if length >= max_chars:
+                break
+        return "".join(parts)[:max_chars]
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
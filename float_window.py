@@ -2,17 +2,27 @@
 float_window.py
 クリップボード内容を表示し、Azure OpenAI API の結果を表示するフロートウィンドウ。
 最前面・フレームレスで画面中央（またはマウス位置付近）に表示される。
+ファイルをドロップすると、先頭部分だけを表示し、本文は処理時に file_reader で少しずつ読み出す。
 """
 
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextEdit, QLabel, QSizePolicy, QFrame,
-    QApplication
+    QApplication, QMenu
 )
-from PyQt6.QtCore import Qt, QPoint
+from PyQt6.QtCore import Qt, QPoint, QTimer, pyqtSignal
 from PyQt6.QtGui import QCursor, QKeySequence, QShortcut, QColor
 
 from api_worker import ApiWorker
+import actions
+import config
+import file_reader
+import job_queue
+import token_estimator
+
+
+# ファイル入力時に入力欄へ表示する先頭部分の文字数
+FILE_PREVIEW_CHARS = 4000
 
 
 class FloatWindow(QWidget):
@@ -20,17 +30,16 @@ class FloatWindow(QWidget):
     フロートポップアップウィンドウ（2ペイン構成）。
     上段: 入力テキスト (クリップボード)
     下段: AI 回答 / ローディング / エラー表示
+
+    シグナル:
+        background_requested(str, str, int) – 「バックグラウンドへ」で選んだ (アクション, テキスト, 優先度)
     """
 
-    BUTTONS = [
-        ("要約(&S)", "S", "#4CAF50", "選択テキストを要約します (Alt+S)"),
-        ("質問(&Q)", "Q", "#2196F3", "選択テキストについて質問します (Alt+Q)"),
-        ("添削(&T)", "T", "#FF9800", "選択テキストを添削します (Alt+T)"),
-        ("チャット(&C)", "C", "#9C27B0", "チャットを開始します (Alt+C)"),
-    ]
+    background_requested = pyqtSignal(str, str, int)
 
-    def __init__(self, parent=None):
+    def __init__(self, session_id: int = 1, parent=None):
         super().__init__(parent)
+        self.session_id = session_id
 
         self.setWindowFlags(
             Qt.WindowType.FramelessWindowHint |
@@ -41,10 +50,24 @@ class FloatWindow(QWidget):
 
         self._drag_pos: QPoint | None = None
         self._api_worker: ApiWorker | None = None
+        # 中断したが、まだスレッドが終わっていないワーカー（実行中の QThread を破棄しないよう参照を残す）
+        self._retired_workers: set[ApiWorker] = set()
+        # ウォッチドッグが別スレッドから読むための情報（Qt ウィジェットには触れない）
+        self._active_key: str | None = None
+        self._input_chars = 0
+        self._result_chars = 0
+        # keep_history のアクションで送る会話履歴（ウィンドウを開き直すとリセット）
+        self._history: list[dict] = []
+        self._pending_turn: dict | None = None
+        # ドロップ / 「ファイルを開く」で指定されたファイル（入力欄には先頭部分のみ表示）
+        self._file: file_reader.TextFile | None = None
         self._buttons: list[QPushButton] = []
+        self._actions_version = -1
+        self._style_sheet = ""
 
         self._init_ui()
         self._apply_style()
+        self.setAcceptDrops(True)
 
         shortcut = QShortcut(QKeySequence("Escape"), self)
         shortcut.activated.connect(self.close)
@@ -65,7 +88,8 @@ class FloatWindow(QWidget):
 
         # ── タイトルバー ──
         title_bar = QHBoxLayout()
-        title_label = QLabel("📋  PopAI")
+        title = "📋  PopAI" if self.session_id == 1 else f"📋  PopAI #{self.session_id}"
+        title_label = QLabel(title)
         title_label.setObjectName("titleLabel")
         title_bar.addWidget(title_label)
         title_bar.addStretch()
@@ -78,25 +102,49 @@ class FloatWindow(QWidget):
         layout.addLayout(title_bar)
 
         # ── 入力テキストエリア ──
+        input_header = QHBoxLayout()
         input_label = QLabel("📄 選択テキスト")
         input_label.setObjectName("sectionLabel")
-        layout.addWidget(input_label)
+        input_header.addWidget(input_label)
+        input_header.addStretch()
+        self._token_label = QLabel("")
+        self._token_label.setObjectName("tokenLabel")
+        input_header.addWidget(self._token_label)
+        self._file_clear_btn = QPushButton("✕ ファイルを外す")
+        self._file_clear_btn.setObjectName("fileClearBtn")
+        self._file_clear_btn.clicked.connect(lambda: self.detach_file(clear=True))
+        self._file_clear_btn.hide()
+        input_header.addWidget(self._file_clear_btn)
+        layout.addLayout(input_header)
 
         self._input_area = QTextEdit()
         self._input_area.setObjectName("inputArea")
         self._input_area.setPlaceholderText("クリップボードのテキストがここに表示されます...")
         self._input_area.setMinimumHeight(150)
         self._input_area.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
+        # ファイルのドロップはウィンドウ側で受け取る（入力欄に URL 文字列として貼り付けない）
+        self._input_area.setAcceptDrops(False)
         layout.addWidget(self._input_area)
 
-        # ── ボタン行 ──
-        btn_layout = QHBoxLayout()
-        btn_layout.setSpacing(8)
-        for label, key, color, tip in self.BUTTONS:
-            btn = self._make_button(label, key, color, tip)
-            btn_layout.addWidget(btn)
-            self._buttons.append(btn)
-        layout.addLayout(btn_layout)
+        # 入力のたびにトークン数を再計算する（連続入力中はまとめて 1 回）
+        self._token_timer = QTimer(self)
+        self._token_timer.setSingleShot(True)
+        self._token_timer.setInterval(150)
+        self._token_timer.timeout.connect(self._update_token_count)
+        self._input_area.textChanged.connect(self._token_timer.start)
+
+        # ── ボタン行（actions.json から生成） ──
+        self._btn_layout = QHBoxLayout()
+        self._btn_layout.setSpacing(8)
+        self._bg_menu = QMenu(self)
+        self._bg_btn = QPushButton("⏬ バックグラウンドへ")
+        self._bg_btn.setObjectName("bgBtn")
+        self._bg_btn.setFixedHeight(36)
+        self._bg_btn.setToolTip("選択テキストをジョブとして登録し、完了したらトレイで通知します")
+        self._bg_btn.setMenu(self._bg_menu)
+        self._btn_layout.addWidget(self._bg_btn)
+        self._rebuild_buttons()
+        layout.addLayout(self._btn_layout)
 
         # ── セパレータ ──
         sep = QFrame()
@@ -123,20 +171,60 @@ class FloatWindow(QWidget):
         self.setMinimumHeight(600)
         self.resize(800, 600)
 
-    def _make_button(self, label: str, key: str, color: str, tip: str) -> QPushButton:
-        btn = QPushButton(label)
-        btn.setToolTip(tip)
+    def _make_button(self, spec: actions.ActionSpec) -> QPushButton:
+        btn = QPushButton(spec.button_text)
+        btn.setToolTip(spec.tooltip)
         btn.setFixedHeight(36)
-        btn.setObjectName(f"btn_{key}")
-        btn.setProperty("btnColor", color)
-        btn.clicked.connect(lambda _, k=key: self._on_button_clicked(k))
+        btn.setObjectName(f"btn_{spec.key}")
+        btn.setProperty("btnColor", spec.color)
+        btn.clicked.connect(lambda _, k=spec.key: self._on_button_clicked(k))
         return btn
 
+    def _rebuild_buttons(self) -> bool:
+        """アクション定義が更新されていればボタン行を作り直す。作り直した場合は True。"""
+        registry = actions.get_registry()
+        specs = registry.actions()
+        if registry.version == self._actions_version:
+            return False
+        self._actions_version = registry.version
+
+        for btn in self._buttons:
+            self._btn_layout.removeWidget(btn)
+            btn.deleteLater()
+        self._buttons.clear()
+        # アクションのボタンは「バックグラウンドへ」ボタンより前に並べる
+        for i, spec in enumerate(specs):
+            btn = self._make_button(spec)
+            self._btn_layout.insertWidget(i, btn)
+            self._buttons.append(btn)
+        self._rebuild_background_menu(specs)
+        self._style_sheet = self._build_style_sheet(specs)
+        return True
+
+    def _rebuild_background_menu(self, specs):
+        self._bg_menu.clear()
+        for spec in specs:
+            item = self._bg_menu.addAction(spec.label)
+            item.triggered.connect(lambda _, k=spec.key: self._send_to_background(k))
+        self._bg_menu.addSeparator()
+        self._bg_priority = self._bg_menu.addAction("優先して処理する")
+        self._bg_priority.setCheckable(True)
+
     # ------------------------------------------------------------------ #
     # スタイル
     # ------------------------------------------------------------------ #
-    def _apply_style(self):
-        self.setStyleSheet("""
+    BUTTON_STYLE = """
+            QPushButton[btnColor="{color}"] {{
+                background-color: {color}; color:white; border:none;
+                border-radius:8px; font-weight:bold;
+                font-family:"Segoe UI","Yu Gothic UI",sans-serif; font-size:12pt;
+            }}
+            QPushButton[btnColor="{color}"]:hover    {{ background-color:{hover}; }}
+            QPushButton[btnColor="{color}"]:pressed  {{ background-color:{pressed}; }}
+            QPushButton[btnColor="{color}"]:disabled {{ background-color:{disabled}; color:#666; }}
+    """
+
+    BASE_STYLE = """
             QWidget#container {
                 background-color: rgba(22, 22, 30, 230);
                 border-radius: 14px;
@@ -156,6 +244,27 @@ class FloatWindow(QWidget):
                 font-family: "Segoe UI", "Yu Gothic UI", sans-serif;
             }
 
+            QLabel#tokenLabel {
+                color: #888;
+                font-size: 11px;
+                font-family: "Segoe UI", "Yu Gothic UI", sans-serif;
+            }
+            QLabel#tokenLabel[overBudget="true"] { color: #FFB74D; }
+
+            QPushButton#bgBtn {
+                background-color: rgba(255,255,255,0.08); color: #C8C8C8;
+                border: 1px solid rgba(255,255,255,0.15); border-radius: 8px;
+                font-family: "Segoe UI", "Yu Gothic UI", sans-serif; font-size: 10pt;
+                padding: 0 10px;
+            }
+            QPushButton#bgBtn:hover { background-color: rgba(255,255,255,0.15); }
+
+            QPushButton#fileClearBtn {
+                background: transparent; color: #888; border: none;
+                font-size: 11px; font-family: "Segoe UI", "Yu Gothic UI", sans-serif;
+            }
+            QPushButton#fileClearBtn:hover { color: #fff; }
+
             QPushButton#closeBtn {
                 background: transparent;
                 color: #888;
@@ -192,51 +301,38 @@ class FloatWindow(QWidget):
                 padding: 10px;
                 selection-background-color: #264F78;
             }
+    """
 
-            QPushButton[btnColor="#4CAF50"] {
-                background-color: #4CAF50; color:white; border:none;
-                border-radius:8px; font-weight:bold;
-                font-family:"Segoe UI","Yu Gothic UI",sans-serif; font-size:12pt;
-            }
-            QPushButton[btnColor="#4CAF50"]:hover   { background-color:#66BB6A; }
-            QPushButton[btnColor="#4CAF50"]:pressed  { background-color:#388E3C; }
-            QPushButton[btnColor="#4CAF50"]:disabled { background-color:#2E5E30; color:#666; }
-
-            QPushButton[btnColor="#2196F3"] {
-                background-color: #2196F3; color:white; border:none;
-                border-radius:8px; font-weight:bold;
-                font-family:"Segoe UI","Yu Gothic UI",sans-serif; font-size:12pt;
-            }
-            QPushButton[btnColor="#2196F3"]:hover   { background-color:#42A5F5; }
-            QPushButton[btnColor="#2196F3"]:pressed  { background-color:#1565C0; }
-            QPushButton[btnColor="#2196F3"]:disabled { background-color:#1A3A6E; color:#666; }
-
-            QPushButton[btnColor="#FF9800"] {
-                background-color: #FF9800; color:white; border:none;
-                border-radius:8px; font-weight:bold;
-                font-family:"Segoe UI","Yu Gothic UI",sans-serif; font-size:12pt;
-            }
-            QPushButton[btnColor="#FF9800"]:hover   { background-color:#FFA726; }
-            QPushButton[btnColor="#FF9800"]:pressed  { background-color:#E65100; }
-            QPushButton[btnColor="#FF9800"]:disabled { background-color:#7A4A00; color:#666; }
+    def _build_style_sheet(self, specs) -> str:
+        """ボタン色ごとのスタイルを含むスタイルシート全体を組み立てる。"""
+        button_styles = []
+        for color in dict.fromkeys(spec.color for spec in specs):
+            base = QColor(color)
+            button_styles.append(self.BUTTON_STYLE.format(
+                color    = color,
+                hover    = base.lighter(115).name(),
+                pressed  = base.darker(130).name(),
+                disabled = base.darker(170).name(),
+            ))
+        return self.BASE_STYLE + "".join(button_styles)
 
-            QPushButton[btnColor="#9C27B0"] {
-                background-color: #9C27B0; color:white; border:none;
-                border-radius:8px; font-weight:bold;
-                font-family:"Segoe UI","Yu Gothic UI",sans-serif; font-size:12pt;
-            }
-            QPushButton[btnColor="#9C27B0"]:hover   { background-color:#AB47BC; }
-            QPushButton[btnColor="#9C27B0"]:pressed  { background-color:#6A1B9A; }
-            QPushButton[btnColor="#9C27B0"]:disabled { background-color:#4A1260; color:#666; }
-        """)
+    def _apply_style(self):
+        self.setStyleSheet(self._style_sheet)
 
     # ------------------------------------------------------------------ #
     # 公開 API
     # ------------------------------------------------------------------ #
-    def show_with_text(self, text: str):
-        """テキストをセットしてウィンドウを表示する。"""
+    def show_with_text(self, text: str, offset: int = 0):
+        """
+        テキストをセットしてウィンドウを表示する。
+        offset は他のセッションと重ならないよう右下にずらす量（ピクセル）。
+        """
+        if self._rebuild_buttons():
+            self._apply_style()
+        self.detach_file()
         self._input_area.setPlainText(text)
         self._result_area.clear()
+        self._history.clear()
         self._set_buttons_enabled(True)
 
         screen = QApplication.primaryScreen().geometry()
@@ -244,39 +340,174 @@ class FloatWindow(QWidget):
 
         self.adjustSize()
         w, h = self.width(), self.height()
-        x = max(screen.left(), min(cursor_pos.x() - w // 2, screen.right()  - w))
-        y = max(screen.top(),  min(cursor_pos.y() - h // 2, screen.bottom() - h))
+        x = max(screen.left(), min(cursor_pos.x() - w // 2 + offset, screen.right()  - w))
+        y = max(screen.top(),  min(cursor_pos.y() - h // 2 + offset, screen.bottom() - h))
 
         self.move(x, y)
         self.show()
         self.raise_()
         self.activateWindow()
 
+    def attach_file(self, path: str) -> bool:
+        """
+        ファイルを入力にする。入力欄には先頭部分だけを表示し、編集できないようにする。
+        読み込めなかった場合は結果欄にエラーを表示して False を返す。
+        """
+        try:
+            source = file_reader.TextFile(path)
+            preview = source.preview(FILE_PREVIEW_CHARS)
+        except (OSError, ValueError) as e:
+            self._result_area.setPlainText(f"❌ ファイルを開けませんでした:\n{e}")
+            return False
+
+        self._file = source
+        if len(preview) >= FILE_PREVIEW_CHARS:
+            preview += "\n\n…（以下省略。全体は処理時に少しずつ読み込みます）"
+        self._input_area.setPlainText(preview)
+        self._input_area.setReadOnly(True)
+        self._file_clear_btn.show()
+        # ファイルは行単位で読み出すため、バックグラウンドジョブ（テキストを保存する）には送れない
+        self._bg_btn.setEnabled(False)
+        self._update_token_count()
+        return True
+
+    def detach_file(self, clear: bool = False):
+        """ファイル入力をやめて、通常のテキスト入力に戻す。"""
+        if self._file is None:
+            return
+        self._file = None
+        self._input_area.setReadOnly(False)
+        self._file_clear_btn.hide()
+        self._bg_btn.setEnabled(True)
+        if clear:
+            self._input_area.clear()
+        self._update_token_count()
+
+    def set_result(self, answer: str):
+        """完了済みの回答（バックグラウンドジョブの結果など）を表示する。"""
+        self._result_area.setPlainText(answer)
+
+    def is_busy(self) -> bool:
+        """リクエストを処理中なら True。"""
+        return self._active_key is not None
+
+    def request_info(self) -> dict:
+        """
+        実行中のリクエストの概要を返す。
+        ウォッチドッグの補助スレッドから呼ばれるため、Python の属性だけを読む。
+        """
+        return {
+            "session":      self.session_id,
+            "action":       self._active_key,
+            "input_chars":  self._input_chars,
+            "result_chars": self._result_chars,
+        }
+
+    # ------------------------------------------------------------------ #
+    # トークン数表示
+    # ------------------------------------------------------------------ #
+    def _update_token_count(self):
+        if self._file is not None:
+            # ファイル全体のトークン数は処理時にワーカースレッドで数える
+            self._token_label.setText(f"📎 {self._file.name} ({file_reader.format_size(self._file.size)}, "
+                                      f"{self._file.encoding})")
+            self._set_over_budget(False)
+            return
+        text = self._input_area.toPlainText()
+        tokens = token_estimator.estimate_tokens(text)
+        if not tokens:
+            self._token_label.setText("")
+            self._set_over_budget(False)
+            return
+
+        # 上限を超えるアクションがあれば、どう処理されるかを併記する
+        notes = []
+        for spec in actions.get_registry().actions():
+            if spec.max_input_tokens and tokens > spec.max_input_tokens:
+                mode = {"truncate": "切り詰め", "chunk": "分割"}.get(spec.overflow, "上限超過")
+                notes.append(f"{spec.label}: {mode}")
+        label = f"約 {tokens:,} tok"
+        if notes:
+            label += f"  ⚠️ {' / '.join(notes)}"
+        self._token_label.setText(label)
+        self._set_over_budget(bool(notes))
+
+    def _set_over_budget(self, over: bool):
+        if self._token_label.property("overBudget") == over:
+            return
+        self._token_label.setProperty("overBudget", over)
+        # 動的プロパティの変更をスタイルに反映させる
+        self._token_label.style().unpolish(self._token_label)
+        self._token_label.style().polish(self._token_label)
+
     # ------------------------------------------------------------------ #
     # ボタンアクション
     # ------------------------------------------------------------------ #
     def _on_button_clicked(self, key: str):
-        text = self._input_area.toPlainText().strip()
-        if not text:
+        source = self._file
+        text = "" if source else self._input_area.toPlainText().strip()
+        if not text and not source:
             self._result_area.setPlainText("⚠️ テキストが入力されていません。")
             return
 
-        # 前回のワーカーが残っている場合は終了を待たずに破棄
-        if self._api_worker and self._api_worker.isRunning():
-            self._api_worker.quit()
+        # 前回のワーカーが残っている場合はストリームを中断して破棄
+        self._retire_worker()
 
         # ローディング表示
         self._result_area.setPlainText("⏳ 処理中...\n\n")
         self._set_buttons_enabled(False)
 
         # ワーカー起動
-        self._api_worker = ApiWorker(button_key=key, user_text=text)
+        self._active_key = key
+        self._input_chars = source.size if source else len(text)
+        self._result_chars = 0
+        spec = actions.get_registry().get(key)
+        history = None
+        self._pending_turn = None
+        if spec and spec.keep_history and not source:
+            history = self._history
+            self._pending_turn = {"role": "user", "content": text}
+        self._api_worker = ApiWorker(button_key=key, user_text=text, history=history, source=source)
         self._api_worker.chunk_received.connect(self._on_chunk_received)
         self._api_worker.result_ready.connect(self._on_result)
         self._api_worker.error_occurred.connect(self._on_error)
-        self._api_worker.finished.connect(lambda: self._set_buttons_enabled(True))
+        self._api_worker.finished.connect(self._on_worker_finished)
         self._api_worker.start()
 
+    def _send_to_background(self, key: str):
+        text = self._input_area.toPlainText().strip()
+        if not text:
+            self._result_area.setPlainText("⚠️ テキストが入力されていません。")
+            return
+        priority = job_queue.PRIORITY_HIGH if self._bg_priority.isChecked() else job_queue.PRIORITY_NORMAL
+        self.background_requested.emit(key, text, priority)
+        # 登録したらウィンドウを閉じ、続けて別の選択範囲を送れるようにする
+        self.close()
+
+    def _retire_worker(self):
+        """
+        現在のワーカーを中断し、シグナルを切り離す。
+        古いワーカーの finished が新しいリクエストの処理中に届くと、
+        ボタンが有効に戻り is_busy() も False になってしまうため。
+        """
+        worker = self._api_worker
+        if worker is None:
+            return
+        self._api_worker = None
+        for signal in (worker.chunk_received, worker.result_ready, worker.error_occurred, worker.finished):
+            try:
+                signal.disconnect()
+            except TypeError:
+                pass    # 接続されていない
+        if worker.isRunning():
+            worker.cancel()
+            self._retired_workers.add(worker)
+            worker.finished.connect(lambda: self._retired_workers.discard(worker))
+
+    def _on_worker_finished(self):
+        self._active_key = None
+        self._set_buttons_enabled(True)
+
     def _on_chunk_received(self, chunk: str):
         # 最初に来る「⏳ 処理中...\n\n」を消すための簡易判定
         current_text = self._result_area.toPlainText()
@@ -285,12 +516,17 @@ class FloatWindow(QWidget):
 
         # テキストエリアの末尾に追加する
         self._result_area.insertPlainText(chunk)
+        self._result_chars += len(chunk)
 
         # スクロールバーを一番下に移動する
         scrollbar = self._result_area.verticalScrollBar()
         scrollbar.setValue(scrollbar.maximum())
 
     def _on_result(self, answer: str):
+        if self._pending_turn is not None:
+            self._append_history(self._pending_turn, answer)
+            self._pending_turn = None
+
         # チャンクごとに描画しているため、完了時に全体を再設定する必要は基本ないが、
         # 最終的な結果として整合性を保つためセットしておく
         self._result_area.setPlainText(answer)
@@ -319,6 +555,18 @@ class FloatWindow(QWidget):
             "font-family:'Segoe UI','Yu Gothic UI',sans-serif; font-size:12pt; padding:10px; }"
         )
 
+    def _append_history(self, user_turn: dict, answer: str):
+        """
+        1 往復分を履歴に追加する。
+        先頭からの一致がプロンプトキャッシュに効くため、古い往復は上限を超えたときだけまとめて落とす。
+        """
+        self._history += [user_turn, {"role": "assistant", "content": answer}]
+        max_turns = config.CHAT_HISTORY_MAX_TURNS
+        if max_turns > 0 and len(self._history) > max_turns * 2:
+            # 1 往復ずつ落とすと毎回先頭が変わってキャッシュが効かないため、半分まで減らす
+            keep = max(1, max_turns // 2) * 2
+            self._history = self._history[-keep:]
+
     def _set_buttons_enabled(self, enabled: bool):
         for btn in self._buttons:
             btn.setEnabled(enabled)
@@ -341,5 +589,39 @@ class FloatWindow(QWidget):
     def mouseReleaseEvent(self, event):
         self._drag_pos = None
 
+    # ------------------------------------------------------------------ #
+    # ファイルのドラッグ＆ドロップ
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _dropped_file(event) -> str | None:
+        mime = event.mimeData()
+        if not mime.hasUrls():
+            return None
+        for url in mime.urls():
+            if url.isLocalFile():
+                return url.toLocalFile()
+        return None
+
+    def dragEnterEvent(self, event):
+        if self._dropped_file(event):
+            event.acceptProposedAction()
+        else:
+            super().dragEnterEvent(event)
+
+    def dropEvent(self, event):
+        path = self._dropped_file(event)
+        if not path:
+            super().dropEvent(event)
+            return
+        event.acceptProposedAction()
+        if self.attach_file(path):
+            self._result_area.clear()
+
+    def closeEvent(self, event):
+        # 閉じたセッションのリクエストは続けても表示先が無いため中断する
+        if self._api_worker and self._api_worker.isRunning():
+            self._api_worker.cancel()
+        super().closeEvent(event)
+
     def focusOutEvent(self, event):
         super().focusOutEvent(event)
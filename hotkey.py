@@ -6,12 +6,17 @@ hotkey.py
 
 import time
 import ctypes
+import logging
 import ctypes.wintypes
 import threading
 from pynput import keyboard as pynput_kb
 
 from PyQt6.QtCore import QThread, pyqtSignal
 
+from logging_setup import redact
+
+logger = logging.getLogger("popai.hotkey")
+
 
 # ------------------------------------------------------------------ #
 # 正規化済みホットキーの定義
@@ -116,10 +121,9 @@ def send_keys(*inputs: INPUT) -> int:
     arr = (INPUT * len(inputs))(*inputs)
     n = _user32.SendInput(len(inputs), arr, _sizeof_INPUT)
     if n == 0:
-        err = ctypes.get_last_error()
-        print(f"[PopAI] SendInput 失敗 (送信数={n}, LastError={err})")
+        logger.warning("SendInput 失敗 (送信数=%d, LastError=%d)", n, ctypes.get_last_error())
     else:
-        print(f"[PopAI] SendInput: {n} イベント送信成功")
+        logger.debug("SendInput: %d イベント送信成功", n)
     return n
 
 def release_hotkey_keys() -> None:
@@ -150,12 +154,12 @@ CF_UNICODETEXT = 13
 
 def get_clipboard_text() -> str:
     if not _user32.OpenClipboard(0):
-        print(f"[PopAI] OpenClipboard 失敗 err={ctypes.get_last_error()}")
+        logger.warning("OpenClipboard 失敗 err=%d", ctypes.get_last_error())
         return ""
     try:
         handle = _user32.GetClipboardData(CF_UNICODETEXT)
         if not handle:
-            print("[PopAI] GetClipboardData 失敗（テキスト形式なし）")
+            logger.info("GetClipboardData 失敗（テキスト形式なし）")
             return ""
         ptr = _kernel32.GlobalLock(handle)
         if not ptr:
@@ -165,7 +169,7 @@ def get_clipboard_text() -> str:
         finally:
             _kernel32.GlobalUnlock(ptr)
     except Exception as e:
-        print(f"[PopAI] クリップボード取得エラー: {e}")
+        logger.warning("クリップボード取得エラー: %s", e)
         return ""
     finally:
         _user32.CloseClipboard()
@@ -207,8 +211,9 @@ class HotkeyThread(QThread):
         if HOTKEY_NORMALIZED.issubset(self._current_keys) and not self._triggered:
             self._triggered = True
             self._keys_released.clear()
-            print(f"[PopAI] ホットキー検出！HWND={self._prev_hwnd:#010x}, INPUT size={_sizeof_INPUT}")
-            threading.Thread(target=self._fetch_clipboard, daemon=True).start()
+            logger.info("ホットキー検出！HWND=%#010x, INPUT size=%d", self._prev_hwnd or 0, _sizeof_INPUT)
+            threading.Thread(target=self._fetch_clipboard, name="PopAI-fetch-clipboard",
+                             daemon=True).start()
 
     def _on_release(self, key):
         normalized = self._normalize(key)
@@ -239,11 +244,12 @@ class HotkeyThread(QThread):
         time.sleep(0.5)   # コピー完了を待つ
 
         text = get_clipboard_text()
-        print(f"[PopAI] 取得テキスト ({len(text)} 文字): {text[:60]!r}")
+        logger.info("取得テキスト (%d 文字): %s", len(text), redact(text))
         self.clipboard_ready.emit(text)
 
     def run(self):
-        print(f"[PopAI] ホットキー監視スレッド開始 (Ctrl+Alt+Space) INPUT_SIZE={_sizeof_INPUT}")
+        threading.current_thread().name = "HotkeyThread"
+        logger.info("ホットキー監視スレッド開始 (Ctrl+Alt+Space) INPUT_SIZE=%d", _sizeof_INPUT)
         with pynput_kb.Listener(
             on_press=self._on_press,
             on_release=self._on_release,
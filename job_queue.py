@@ -0,0 +1,288 @@
+"""
+job_queue.py
+バックグラウンドジョブのキューと実行プール。
+FloatWindow の「バックグラウンドへ」で登録したアクションを SQLite に保存し、
+JOB_WORKERS 個のスレッドで優先度の高い順（同じ優先度なら登録順）に処理する。
+
+  JobStore … ジョブの永続化（アプリを終了しても未処理のジョブは次回起動時に再開する）
+  JobQueue … ワーカースレッドのプール。処理は action_runner.ActionRunner をそのまま使う
+
+完了通知の on_finished はワーカースレッドから呼ばれる。
+UI に表示する場合は Qt のシグナルなどでメインスレッドへ渡すこと。
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import config
+
+logger = logging.getLogger("popai.jobs")
+
+STATUS_QUEUED    = "queued"
+STATUS_RUNNING   = "running"
+STATUS_DONE      = "done"
+STATUS_FAILED    = "failed"
+STATUS_CANCELLED = "cancelled"
+
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH   = 10
+
+
+@dataclass
+class Job:
+    id: int
+    action: str
+    text: str
+    priority: int
+    status: str
+    result: str = ""
+    error: str = ""
+    created_at: float = 0.0
+    finished_at: float | None = None
+
+
+_COLUMNS = "id, action, text, priority, status, result, error, created_at, finished_at"
+
+
+# ================================================================== #
+# 永続化
+# ================================================================== #
+class JobStore:
+    """
+    ジョブを SQLite に保存する。複数のワーカースレッドから使うため 1 本の接続をロックで保護する。
+    path が空文字の場合はメモリ上のデータベースを使う。
+    """
+
+    def __init__(self, path: str = ""):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    action      TEXT    NOT NULL,
+                    text        TEXT    NOT NULL,
+                    priority    INTEGER NOT NULL DEFAULT 0,
+                    status      TEXT    NOT NULL,
+                    result      TEXT    NOT NULL DEFAULT '',
+                    error       TEXT    NOT NULL DEFAULT '',
+                    created_at  REAL    NOT NULL,
+                    finished_at REAL
+                )""")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, id)")
+            # 前回の終了時に処理中だったジョブはやり直す
+            resumed = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?", (STATUS_QUEUED, STATUS_RUNNING),
+            ).rowcount
+        if resumed:
+            logger.info("中断されていたジョブ %d 件を再開します", resumed)
+
+    def add(self, action: str, text: str, priority: int = PRIORITY_NORMAL) -> Job:
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO jobs (action, text, priority, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (action, text, priority, STATUS_QUEUED, now),
+            )
+        return Job(cur.lastrowid, action, text, priority, STATUS_QUEUED, created_at=now)
+
+    def claim_next(self) -> Job | None:
+        """待機中のジョブのうち最も優先度の高いものを処理中にして返す。"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE status = ? ORDER BY priority DESC, id LIMIT 1",
+                (STATUS_QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (STATUS_RUNNING, row[0]))
+        job = Job(*row)
+        job.status = STATUS_RUNNING
+        return job
+
+    def finish(self, job_id: int, status: str, result: str = "", error: str = ""):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def requeue(self, job_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (STATUS_QUEUED, job_id))
+
+    def cancel(self, job_id: int) -> bool:
+        """待機中のジョブを取り消す。取り消せた場合は True。"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (STATUS_CANCELLED, time.time(), job_id, STATUS_QUEUED),
+            ).rowcount > 0
+
+    def get(self, job_id: int) -> Job | None:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(*row) if row else None
+
+    def recent(self, limit: int = 10) -> list[Job]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [Job(*row) for row in rows]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (STATUS_QUEUED, STATUS_RUNNING),
+            ).fetchone()[0]
+
+    def prune(self, keep: int):
+        """完了・失敗・取消済みのジョブを新しい順に keep 件だけ残す。"""
+        if keep <= 0:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("""
+                DELETE FROM jobs WHERE status IN (?, ?, ?) AND id NOT IN (
+                    SELECT id FROM jobs WHERE status IN (?, ?, ?) ORDER BY id DESC LIMIT ?
+                )""", (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED) * 2 + (keep,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# ================================================================== #
+# 実行プール
+# ================================================================== #
+def _default_runner_factory(action: str, text: str):
+    from action_runner import create_runner
+    return create_runner(action, text)
+
+
+class JobQueue:
+    """
+    JobStore のジョブを workers 個のスレッドで処理する。
+    runner_factory(action, text) は run() -> str | None・cancel()・cancelled を持つオブジェクトを返す。
+    """
+
+    def __init__(self, store: JobStore, workers: int = 2,
+                 on_finished: Callable[[Job], None] | None = None,
+                 runner_factory: Callable = _default_runner_factory,
+                 history_limit: int = 0):
+        self._store = store
+        self._workers = workers
+        self._on_finished = on_finished
+        self._runner_factory = runner_factory
+        self._history_limit = history_limit
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._threads: list[threading.Thread] = []
+        self._running: dict[int, object] = {}     # job id → 実行中の runner
+
+    @property
+    def store(self) -> JobStore:
+        return self._store
+
+    def start(self):
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"PopAI-job-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("ジョブワーカーを %d 個起動しました (待機中 %d 件)",
+                    self._workers, self._store.pending_count())
+
+    def submit(self, action: str, text: str, priority: int = PRIORITY_NORMAL) -> Job:
+        job = self._store.add(action, text, priority)
+        logger.info("ジョブ #%d を登録しました action=%s, priority=%d, chars=%d",
+                    job.id, action, priority, len(text))
+        with self._cond:
+            self._cond.notify()
+        return job
+
+    def stop(self, timeout: float = 2.0):
+        """実行中のジョブを中断してワーカーを止める。中断したジョブは次回起動時に再開する。"""
+        with self._cond:
+            self._stopping = True
+            runners = list(self._running.values())
+            self._cond.notify_all()
+        for runner in runners:
+            runner.cancel()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads.clear()
+
+    def _next_job(self) -> Job | None:
+        with self._cond:
+            while not self._stopping:
+                job = self._store.claim_next()
+                if job is not None:
+                    return job
+                self._cond.wait()
+        return None
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._run_job(job)
+
+    def _run_job(self, job: Job):
+        started = time.perf_counter()
+        runner = None
+        try:
+            # 未知のアクションやバックエンドの生成失敗も、ジョブの失敗として記録する
+            runner = self._runner_factory(job.action, job.text)
+            with self._cond:
+                if self._stopping:
+                    self._store.requeue(job.id)
+                    return
+                self._running[job.id] = runner
+            answer = runner.run()
+            if answer is None:
+                if self._stopping:
+                    self._store.requeue(job.id)
+                    return
+                job.status = STATUS_CANCELLED
+            else:
+                job.status, job.result = STATUS_DONE, answer
+        except Exception as e:
+            # stop() で中断すると、閉じられたストリームの読み込みで例外になることがある
+            if self._stopping or (runner is not None and runner.cancelled):
+                logger.info("ジョブ #%d を中断しました。次回起動時に再開します", job.id)
+                self._store.requeue(job.id)
+                return
+            job.status, job.error = STATUS_FAILED, f"{type(e).__name__}: {e}"
+            logger.error("ジョブ #%d が失敗しました: %s", job.id, job.error, exc_info=True)
+        finally:
+            with self._cond:
+                self._running.pop(job.id, None)
+
+        job.finished_at = time.time()
+        self._store.finish(job.id, job.status, job.result, job.error)
+        self._store.prune(self._history_limit)
+        logger.info("ジョブ #%d %s (%.1f 秒)", job.id, job.status, time.perf_counter() - started)
+        if self._on_finished is not None:
+            self._on_finished(job)
+
+
+_queue: JobQueue | None = None
+_queue_lock = threading.Lock()
+
+def get_queue(on_finished: Callable[[Job], None] | None = None) -> JobQueue:
+    """JobQueue をシングルトン的に生成して返す（ワーカーの起動は呼び出し側で start() する）。"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(JobStore(config.JOB_DB_PATH), config.JOB_WORKERS,
+                              on_finished=on_finished, history_limit=config.JOB_HISTORY_LIMIT)
+        return _queue
@@ -0,0 +1,164 @@
+"""
+logging_setup.py
+PopAI 全体のログ出力の設定。
+各モジュールは logging.getLogger("popai.<モジュール>") でロガーを取得して使う。
+
+【構成】
+  ロガー → QueueHandler → (キュー) → QueueListener の専用スレッド → コンソール / ローテートファイル
+  ログ呼び出し側のスレッド（UI・ホットキー・ワーカー）はキューに積むだけで、
+  文字列整形と I/O はすべてリスナースレッドで行う。
+  レベルが無効なログは logger の isEnabledFor 判定だけで捨てられるため、
+  引数は必ず %s 形式で渡し、f-string で事前に整形しないこと。
+
+【クリップボード内容の伏せ字】
+  クリップボードや入力テキストは redact() で包んで渡す。
+  config.LOG_CLIPBOARD_CONTENT = False（既定）の間は文字数だけが出力される。
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+import config
+
+ROOT_LOGGER = "popai"
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class Redacted:
+    """ログ出力時にだけ文字列化される伏せ字ラッパー。"""
+
+    __slots__ = ("_text", "_preview")
+
+    def __init__(self, text: str, preview: int = 60):
+        self._text = text
+        self._preview = preview
+
+    def __str__(self) -> str:
+        if config.LOG_CLIPBOARD_CONTENT:
+            return repr(self._text[:self._preview])
+        return f"<{len(self._text)} 文字 非表示>"
+
+    __repr__ = __str__
+
+
+def redact(text: str, preview: int = 60) -> Redacted:
+    return Redacted(text, preview)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    標準の QueueHandler は呼び出し側で整形するため、整形をリスナー側に回す。
+    整形はリスナースレッドで後から行うため、dict / list / set の引数はキューに積む時点で複製する
+    （ウォッチドッグの context のように、呼び出し側がログ後に書き換える値があるため）。
+    複製は 1 段だけなので、入れ子の中身まで書き換える場合は呼び出し側で複製して渡すこと。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if isinstance(args, dict):
+            record.args = dict(args)
+        elif args:
+            record.args = tuple(copy.copy(a) if isinstance(a, (dict, list, set)) else a for a in args)
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """1 行 1 レコードの JSON 形式（LOG_FORMAT=json）。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts":     self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level":  record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg":    record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def _parse_level(name: str) -> int:
+    name = name.strip().upper()
+    if name == "OFF":
+        return logging.CRITICAL + 1
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        raise ValueError(f"不明なログレベルです: {name}")
+    return level
+
+
+def parse_module_levels(spec: str) -> dict[str, int]:
+    """"api=DEBUG,hotkey=WARNING" 形式を {"popai.api": 10, ...} に変換する。"""
+    levels = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        module, _, level = item.partition("=")
+        levels[f"{ROOT_LOGGER}.{module.strip()}"] = _parse_level(level)
+    return levels
+
+
+def setup_logging() -> None:
+    """config に従ってログ出力を構成し、リスナースレッドを開始する（2 回目以降は何もしない）。"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if config.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s.%(msecs)03d %(levelname)-7s %(name)s [%(threadName)s] %(message)s",
+            "%H:%M:%S",
+        )
+
+    handlers: list[logging.Handler] = []
+    # pythonw で起動した場合 sys.stdout は None になる
+    if config.LOG_CONSOLE and sys.stdout is not None:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    if config.LOG_FILE:
+        os.makedirs(os.path.dirname(config.LOG_FILE) or ".", exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            config.LOG_FILE, maxBytes=config.LOG_FILE_MAX_BYTES,
+            backupCount=config.LOG_FILE_BACKUPS, encoding="utf-8",
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = _configure_levels()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def setup_forwarding(handler: logging.Handler) -> None:
+    """
+    子プロセス（process_worker）用。レベルは setup_logging と同じにして、
+    出力は handler（親プロセスへの転送）に任せる。
+    """
+    _configure_levels().addHandler(handler)
+
+
+def _configure_levels() -> logging.Logger:
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(_parse_level(config.LOG_LEVEL))
+    root.propagate = False
+    for name, level in parse_module_levels(config.LOG_MODULE_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    return root
+
+
+def shutdown_logging() -> None:
+    """キューに残ったログを書き出してリスナースレッドを止める。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
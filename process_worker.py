@@ -0,0 +1,412 @@
+"""
+process_worker.py
+推論バックエンドとの通信を子プロセスで行う（config.PROCESS_WORKER = True のとき）。
+SSE の解析・SDK のチャンクオブジェクト生成・回答の組み立ては子プロセスの GIL で行い、
+UI のプロセスは受け取った文字列の表示だけを行う。
+
+【構成】
+  UI プロセス                                    子プロセス（PopAI-engine）
+    RemoteActionRunner.run()  ── ("run", id, 入力) ──→  ActionRunner を専用スレッドで実行
+    ProcessEngine の受信スレッド ←─ ("chunks", {id: 文字列}) ── 一定間隔でまとめて送る
+                               ←─ ("usage", id, UsageRecord)
+                               ←─ ("done", id, 完了したか) / ("error", id, 例外名, 内容)
+                               ←─ ("log", LogRecord の属性)   子プロセスのログは親で出力する
+
+  ・受信テキストはリクエストごとに溜め、PROCESS_WORKER_FLUSH_MS ごとに 1 通にまとめて送る
+    （トークンごとにパイプ送信・シグナル送出をしない）
+  ・予算の確認と使用量の記録は UI プロセスで行う（usage.jsonl を書くのは 1 プロセスだけ）
+  ・子プロセスは Qt に依存しない action_runner だけを読み込む。文書検索のインデックスも子プロセスが持つ
+  ・子プロセスが異常終了したら、次のリクエストで新しい子プロセスを起動する。
+    まだ 1 文字も受け取っていなかったリクエストは、新しい子プロセスで 1 回だけ送り直す
+"""
+
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from typing import Callable
+
+import config
+import file_reader
+import logging_setup
+import usage
+
+logger = logging.getLogger("popai.api")
+
+# 溜めた文字数がこれを超えたら、間隔を待たずに送る
+_FLUSH_CHARS = 16 * 1024
+# 子プロセスの異常終了時に、未受信のリクエストを送り直す回数
+_MAX_RESUBMITS = 1
+
+
+class RemoteActionError(Exception):
+    """子プロセスでの実行中に発生した例外（例外オブジェクトはプロセスをまたいで渡せないため名前と内容だけ）。"""
+
+    def __init__(self, remote_type: str, message: str):
+        super().__init__(f"{remote_type}: {message}")
+        self.remote_type = remote_type
+
+
+class WorkerCrashedError(Exception):
+    """受信の途中で子プロセスが異常終了した。"""
+
+
+# ================================================================== #
+# 子プロセス側
+# ================================================================== #
+def _default_runner_factory(payload: dict, on_chunk: Callable[[str], None],
+                            on_usage: Callable[[usage.UsageRecord], None]):
+    from action_runner import ActionRunner
+    return ActionRunner(
+        payload["button_key"], payload["user_text"], payload["history"],
+        on_chunk=on_chunk, source=payload["source"],
+        budget=payload["budget"], on_usage=on_usage,
+    )
+
+
+class _PipeLogHandler(logging.Handler):
+    """子プロセスのログを親プロセスへ送る。引数はここで文字列に整形してから送る。"""
+
+    def __init__(self, worker: "_ChildWorker"):
+        super().__init__()
+        self._worker = worker
+        self._formatter = logging.Formatter()
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            attrs = dict(record.__dict__)
+            attrs["msg"] = record.getMessage()
+            attrs["args"] = None
+            attrs["exc_info"] = None
+            if record.exc_info:
+                attrs["exc_text"] = self._formatter.formatException(record.exc_info)
+            self._worker.send(("log", attrs))
+        except Exception:
+            self.handleError(record)
+
+
+class _ChildWorker:
+    """子プロセスで親からの要求を受け、ActionRunner をリクエストごとのスレッドで実行する。"""
+
+    def __init__(self, conn, flush_interval: float, runner_factory: Callable = _default_runner_factory):
+        self._conn = conn
+        self._flush_interval = flush_interval
+        self._runner_factory = runner_factory
+        # conn.send と送信待ちテキストを守る（チャンクと完了通知の順序を保つため同じロックにする）
+        self._lock = threading.Lock()
+        self._pending: dict[int, list[str]] = {}
+        self._pending_chars = 0
+        self._runners: dict[int, object] = {}
+        self._closed = threading.Event()
+
+    def serve(self):
+        threading.Thread(target=self._flush_loop, name="PopAI-engine-flush", daemon=True).start()
+        while not self._closed.is_set():
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "run":
+                self._start(message[1], message[2])
+            elif kind == "cancel":
+                runner = self._runners.get(message[1])
+                if runner is not None:
+                    runner.cancel()
+            elif kind == "stop":
+                break
+        self._closed.set()
+        for runner in list(self._runners.values()):
+            runner.cancel()
+
+    def send(self, message):
+        with self._lock:
+            self._send_locked(message)
+
+    def _send_locked(self, message):
+        try:
+            self._conn.send(message)
+        except (OSError, ValueError):
+            # 親プロセスが終了している
+            self._closed.set()
+
+    def _start(self, request_id: int, payload: dict):
+        runner = self._runner_factory(
+            payload,
+            lambda text: self._buffer(request_id, text),
+            lambda record: self.send(("usage", request_id, record)),
+        )
+        self._runners[request_id] = runner
+        threading.Thread(target=self._run, args=(request_id, runner),
+                         name=f"Engine-{payload['button_key']}", daemon=True).start()
+
+    def _run(self, request_id: int, runner):
+        try:
+            answer = runner.run()
+            message = ("done", request_id, answer is not None)
+        except Exception as e:
+            if not runner.cancelled:
+                logger.error("%s: %s", type(e).__name__, e, exc_info=True)
+            message = ("error", request_id, type(e).__name__, str(e))
+        finally:
+            self._runners.pop(request_id, None)
+        with self._lock:
+            # 残りのテキストを先に送ってから完了を知らせる
+            self._flush_locked()
+            self._send_locked(message)
+
+    def _buffer(self, request_id: int, text: str):
+        with self._lock:
+            self._pending.setdefault(request_id, []).append(text)
+            self._pending_chars += len(text)
+            if self._pending_chars >= _FLUSH_CHARS:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        batch = {request_id: "".join(parts) for request_id, parts in self._pending.items()}
+        self._pending.clear()
+        self._pending_chars = 0
+        self._send_locked(("chunks", batch))
+
+    def _flush_loop(self):
+        while not self._closed.wait(self._flush_interval):
+            with self._lock:
+                self._flush_locked()
+
+
+def _child_main(conn, flush_interval: float, runner_factory: Callable = _default_runner_factory):
+    """子プロセスのエントリポイント。"""
+    threading.current_thread().name = "PopAI-engine"
+    worker = _ChildWorker(conn, flush_interval, runner_factory)
+    logging_setup.setup_forwarding(_PipeLogHandler(worker))
+    # 文書検索も子プロセスで行うため、インデックスの更新はここで始める（親プロセスでは行わない）
+    import retrieval
+    if retrieval.enabled():
+        retrieval.refresh_in_background()
+    worker.serve()
+
+
+# ================================================================== #
+# UI プロセス側
+# ================================================================== #
+class ProcessEngine:
+    """子プロセスを 1 つ持ち、複数の RemoteActionRunner のリクエストを多重化する。"""
+
+    def __init__(self, flush_interval: float, runner_factory: Callable = _default_runner_factory):
+        self._flush_interval = flush_interval
+        self._runner_factory = runner_factory
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._conn = None
+        self._process: multiprocessing.process.BaseProcess | None = None
+        self._runs: dict[int, "RemoteActionRunner"] = {}
+        self._ids = itertools.count(1)
+        self._stopped = False
+        self.restarts = 0
+
+    def start(self):
+        """子プロセスを起動しておく（初回リクエストの待ち時間を減らすため）。"""
+        with self._lock:
+            if self._conn is None and not self._stopped:
+                self._start_locked()
+
+    def _start_locked(self):
+        # Windows と同じ spawn で起動する（Qt を読み込んだプロセスの fork は避ける）
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=_child_main, args=(child_conn, self._flush_interval, self._runner_factory),
+            name="PopAI-engine", daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self._conn, self._process = parent_conn, process
+        threading.Thread(target=self._read_loop, args=(parent_conn, process),
+                         name="PopAI-engine-reader", daemon=True).start()
+        logger.info("ワーカープロセスを起動しました pid=%s", process.pid)
+
+    def submit(self, run: "RemoteActionRunner", payload: dict) -> int:
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("ワーカープロセスは停止済みです")
+            if self._conn is None:
+                self._start_locked()
+            request_id = next(self._ids)
+            conn = self._conn
+            self._runs[request_id] = run
+        # 送信に失敗した場合は受信スレッドが異常終了を検知し、run に知らせる
+        self._send(conn, ("run", request_id, payload))
+        return request_id
+
+    def cancel(self, request_id: int):
+        with self._lock:
+            self._runs.pop(request_id, None)
+            conn = self._conn
+        if conn is not None:
+            self._send(conn, ("cancel", request_id))
+
+    def stop(self, timeout: float = 2.0):
+        with self._lock:
+            self._stopped = True
+            conn, process = self._conn, self._process
+        if conn is None:
+            return
+        self._send(conn, ("stop",))
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+    def _send(self, conn, message):
+        try:
+            with self._send_lock:
+                conn.send(message)
+        except (OSError, ValueError) as e:
+            logger.warning("ワーカープロセスへの送信に失敗しました: %s", e)
+
+    def _read_loop(self, conn, process):
+        try:
+            while True:
+                self._dispatch(conn.recv())
+        except (EOFError, OSError):
+            pass
+        process.join(1.0)
+        self._lost(conn, process)
+
+    def _dispatch(self, message):
+        kind = message[0]
+        if kind == "log":
+            record = logging.makeLogRecord(message[1])
+            logging.getLogger(record.name).handle(record)
+            return
+        if kind == "usage":
+            # 中断済み（_runs から外した）リクエストの使用量も予算に数えるため、ここで記録する
+            usage.get_tracker().record(message[2])
+            return
+        if kind == "chunks":
+            with self._lock:
+                targets = [(self._runs.get(request_id), text) for request_id, text in message[1].items()]
+            for run, text in targets:
+                if run is not None:
+                    run._post(("chunk", text))
+            return
+
+        request_id = message[1]
+        with self._lock:
+            run = self._runs.get(request_id)
+            if kind in ("done", "error"):
+                self._runs.pop(request_id, None)
+        if run is not None:
+            run._post((kind, *message[2:]))
+
+    def _lost(self, conn, process):
+        with self._lock:
+            if self._conn is not conn:
+                return
+            self._conn, self._process = None, None
+            lost = list(self._runs.values())
+            self._runs.clear()
+            stopped = self._stopped
+        conn.close()
+        if stopped:
+            logger.info("ワーカープロセスを終了しました")
+            return
+        self.restarts += 1
+        logger.error("ワーカープロセスが異常終了しました (exitcode=%s, 処理中 %d 件)。次のリクエストで再起動します",
+                     process.exitcode, len(lost))
+        for run in lost:
+            run._post(("lost",))
+
+
+class RemoteActionRunner:
+    """
+    ActionRunner と同じ使い方（run / cancel / cancelled）で、実行を子プロセスに任せる。
+    on_chunk は run() を呼んだスレッドから、まとめて受け取った単位で呼ばれる。
+    """
+
+    def __init__(self, button_key: str, user_text: str, history: list[dict] | None = None,
+                 on_chunk: Callable[[str], None] | None = None,
+                 source: file_reader.TextFile | None = None,
+                 engine: ProcessEngine | None = None):
+        self._payload = {
+            "button_key": button_key,
+            "user_text":  user_text,
+            "history":    list(history or []),
+            "source":     source,
+            "budget":     None,
+        }
+        self._on_chunk = on_chunk or (lambda text: None)
+        self._engine = engine
+        self._events: queue.SimpleQueue = queue.SimpleQueue()
+        self._request_id: int | None = None
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+        request_id = self._request_id
+        if request_id is not None:
+            self._engine.cancel(request_id)
+        self._post(("cancelled",))
+
+    def _post(self, event: tuple):
+        self._events.put(event)
+
+    def run(self) -> str | None:
+        """回答全体を返す。中断された場合は None。"""
+        from action_runner import check_budget
+        self._payload["budget"] = check_budget()
+        self._engine = self._engine or get_engine()
+
+        parts: list[str] = []
+        for attempt in range(_MAX_RESUBMITS + 1):
+            if self._cancelled:
+                return None
+            self._request_id = self._engine.submit(self, self._payload)
+            if self._cancelled:
+                # submit 中に cancel() された場合、子プロセスにはまだ中断が届いていない
+                self._engine.cancel(self._request_id)
+                return None
+            while True:
+                event = self._events.get()
+                if self._cancelled:
+                    return None
+                kind = event[0]
+                if kind == "chunk":
+                    parts.append(event[1])
+                    self._on_chunk(event[1])
+                elif kind == "done":
+                    return "".join(parts) if event[1] else None
+                elif kind == "error":
+                    raise RemoteActionError(event[1], event[2])
+                elif kind == "lost":
+                    break
+            if parts or attempt == _MAX_RESUBMITS:
+                raise WorkerCrashedError("ワーカープロセスが受信の途中で異常終了しました。もう一度お試しください")
+            logger.warning("ワーカープロセスの異常終了のため、リクエストを送り直します key=%s",
+                           self._payload["button_key"])
+
+
+_engine: ProcessEngine | None = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> ProcessEngine:
+    """ProcessEngine をシングルトン的に生成して返す。"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ProcessEngine(config.PROCESS_WORKER_FLUSH_MS / 1000)
+        return _engine
+
+
+def shutdown():
+    """アプリ終了時に子プロセスを止める（起動していなければ何もしない）。"""
+    with _engine_lock:
+        engine = _engine
+    if engine is not None:
+        engine.stop()
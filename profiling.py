@@ -0,0 +1,148 @@
+"""
+profiling.py
+全スレッド対応のサンプリングプロファイラ（オプトイン）。
+cProfile はメインスレッドしか見えないため、一定間隔で sys._current_frames() を取得して
+HotkeyThread / クリップボード取得スレッド / ApiWorker を含む全スレッドのスタックを集計する。
+
+【有効化】
+  環境変数 POPAI_PROFILE=true で起動時から計測する。
+  またはトレイメニューの「プロファイル開始 / 停止」で任意の区間だけ計測する。
+
+【出力】config.PROFILE_DIR に以下を保存する
+  popai-<日時>.collapsed … flamegraph.pl / speedscope で読める collapsed stack 形式
+  popai-<日時>.txt       … スレッド別サンプル数と、self / inclusive の上位関数
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import config
+
+logger = logging.getLogger("popai.profile")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_names() -> dict[int, str]:
+    # QThread で動く Python コードは threading 上では _DummyThread として見える
+    # （ApiWorker などは run() の先頭で名前を付けている）
+    return {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+
+
+class SamplingProfiler:
+    """
+    interval 秒ごとに全スレッドのスタックを採取する。
+    start() / stop() は何度でも繰り返せ、stop() のたびに採取結果をリセットして返す。
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._samples: Counter = Counter()
+        self._started_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._samples = Counter()
+            self._started_at = time.time()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="PopAI-profiler", daemon=True)
+            self._thread.start()
+        logger.info("計測を開始しました (間隔 %.1f ms)", self._interval * 1000)
+
+    def stop(self) -> Counter:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return Counter()
+        self._stop_event.set()
+        thread.join()
+        logger.info("計測を停止しました (%d サンプル)", sum(self._samples.values()))
+        return self._samples
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self._interval):
+            names = _thread_names()
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                stack.reverse()
+                self._samples[tuple(stack)] += 1
+
+    def dump(self, samples: Counter, directory: str) -> tuple[str, str]:
+        """採取結果を collapsed stack 形式とテキスト要約で保存し、2 つのパスを返す。"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, time.strftime("popai-%Y%m%d-%H%M%S",
+                                                     time.localtime(self._started_at)))
+        collapsed_path, summary_path = base + ".collapsed", base + ".txt"
+
+        with open(collapsed_path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(";".join(s.replace(";", ",") for s in stack) + f" {count}\n")
+
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(format_summary(samples, self._interval))
+        logger.info("保存しました: %s", collapsed_path)
+        return collapsed_path, summary_path
+
+
+def format_summary(samples: Counter, interval: float, top: int = 30) -> str:
+    """スレッド別サンプル数と、self / inclusive の上位関数をテキストにまとめる。"""
+    per_thread: Counter = Counter()
+    self_counts: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in samples.items():
+        per_thread[stack[0]] += count
+        if len(stack) > 1:
+            self_counts[stack[-1]] += count
+        for label in set(stack[1:]):
+            inclusive[label] += count
+
+    total = sum(samples.values()) or 1
+    lines = [f"サンプル数: {sum(samples.values())} (間隔 {interval * 1000:.1f} ms)", "", "■ スレッド別"]
+    for name, count in per_thread.most_common():
+        lines.append(f"  {count:7d}  {count / total:6.1%}  {name}")
+    for title, counter in (("■ self 上位", self_counts), ("■ inclusive 上位", inclusive)):
+        lines += ["", title]
+        for label, count in counter.most_common(top):
+            lines.append(f"  {count:7d}  {count / total:6.1%}  {label}")
+    return "\n".join(lines) + "\n"
+
+
+_profiler: SamplingProfiler | None = None
+
+def get_profiler() -> SamplingProfiler:
+    """SamplingProfiler をシングルトン的に生成して返す。"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(config.PROFILE_INTERVAL_MS / 1000)
+    return _profiler
+
+
+def stop_and_dump() -> tuple[str, str] | None:
+    """計測中なら停止して保存する。保存したファイルのパスを返す。"""
+    profiler = get_profiler()
+    if not profiler.running:
+        return None
+    return profiler.dump(profiler.stop(), config.PROFILE_DIR)
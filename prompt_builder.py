@@ -0,0 +1,97 @@
+"""
+prompt_builder.py
+API に送る messages の組み立て。
+Azure OpenAI のプロンプトキャッシュは「先頭から一致する部分」（1024 トークン以上）を再利用するため、
+変化しない内容ほど前に、毎回変わる内容ほど後ろに、常に同じ順序で並べる。
+
+  1. アクションの指示（system_prompt）          … アクションごとに固定
+  2. 共有コンテキスト（SHARED_CONTEXT_FILE）     … 全アクション共通・ほぼ固定
+  3. チャット履歴                               … 会話が続く間は前方一致で伸びていく
+  4. 今回の入力テキスト                         … 毎回変わる
+     （文書検索の結果は質問ごとに変わるため、ここに「参考資料」として前置する）
+
+1 と 2 は 1 つの system メッセージにまとめ、区切りも固定文字列にする
+（空白や順序が 1 文字でも違うとキャッシュが効かなくなるため）。
+"""
+
+import logging
+import os
+import threading
+
+import config
+
+logger = logging.getLogger("popai.api")
+
+_SHARED_CONTEXT_HEADER = "\n\n# 参考情報\n"
+_REFERENCES_HEADER = "# 参考資料（社内文書からの抜粋）\n"
+_QUESTION_HEADER = "\n# 入力\n"
+
+
+class _SharedContext:
+    """共有コンテキストファイルを mtime が変わったときだけ読み直す。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = ""
+        self._mtime: float | None = None
+        self._text = ""
+
+    def get(self, path: str) -> str:
+        if not path:
+            return ""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            if path == self._path and mtime == self._mtime:
+                return self._text
+            self._path, self._mtime, self._text = path, mtime, ""
+            if mtime is not None:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        self._text = f.read().strip()
+                    logger.info("共有コンテキストを読み込みました: %s (%d 文字)", path, len(self._text))
+                except OSError as e:
+                    logger.warning("共有コンテキストの読み込みに失敗しました: %s", e)
+            return self._text
+
+
+_shared_context = _SharedContext()
+
+
+def shared_context() -> str:
+    return _shared_context.get(config.SHARED_CONTEXT_FILE)
+
+
+def format_references(references: list[tuple[str, str]]) -> str:
+    """(出典, 本文) の列を「参考資料」ブロックにする。"""
+    parts = [_REFERENCES_HEADER]
+    for i, (source, text) in enumerate(references, 1):
+        parts.append(f"[{i}] {source}\n{text}\n")
+    return "\n".join(parts)
+
+
+def build_messages(system_prompt: str, user_text: str,
+                   history: list[dict] | None = None, context: str | None = None,
+                   references: list[tuple[str, str]] | None = None) -> list[dict]:
+    """
+    固定部分が先頭に来る順序で messages を組み立てる。
+    context を省略すると SHARED_CONTEXT_FILE の内容を使う。
+    references（文書検索の結果）は最後の user メッセージの先頭に付ける。
+    """
+    if context is None:
+        context = shared_context()
+
+    system = system_prompt
+    if context:
+        system = f"{system}{_SHARED_CONTEXT_HEADER}{context}" if system else context
+
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.extend(history or [])
+    if references:
+        user_text = f"{format_references(references)}{_QUESTION_HEADER}{user_text}"
+    messages.append({"role": "user", "content": user_text})
+    return messages
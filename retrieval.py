@@ -0,0 +1,401 @@
+"""
+retrieval.py
+社内文書フォルダの検索（質問アクション向け・オプトイン）。
+config.RETRIEVAL_DOCS_DIR 以下のテキストを段落単位に分割して埋め込みベクトル化し、
+質問に近い上位 k 件の段落だけをプロンプトに入れる（文書全体を貼り付けずに済む）。
+
+【インデックスの保存形式】config.RETRIEVAL_INDEX_DIR
+  manifest.json        … ファイルごとの mtime / size / 行範囲、段落テキスト、埋め込みの提供元と次元
+  embeddings-<n>.npy   … 全段落の埋め込み（float16, L2 正規化済み）。np.load(mmap_mode="r") で開く
+  更新のたびに新しい番号のファイルへ書き出して manifest を差し替える。
+  （Windows では mmap 中のファイルを上書きできないため。古いファイルは次回の更新時に削除する）
+
+【差分更新】
+  mtime と size が変わっていないファイルは既存の行をそのまま使い、
+  追加・変更されたファイルだけを埋め込み直す。削除されたファイルの行は落とす。
+  更新はバックグラウンドのスレッドが RETRIEVAL_RESCAN_SEC ごとに行い、質問時は今のインデックスを検索するだけ。
+  文書は file_reader で読む（文字コードの判定は添付ファイルと同じ。バイナリは索引に入れない）。
+
+【埋め込みの提供元】config.RETRIEVAL_EMBEDDING
+  "azure"   … Azure OpenAI の埋め込みデプロイメント (RETRIEVAL_EMBEDDING_DEPLOYMENT)
+  "hashing" … 文字 n-gram のハッシュによる決定的なベクトル（ネットワーク不要・テスト用）
+
+numpy は検索を有効にした場合だけ必要になるため、関数内で import する。
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Protocol
+
+import config
+import file_reader
+from token_estimator import split_into_chunks, truncate_to_tokens
+
+logger = logging.getLogger("popai.retrieval")
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# 1 回の行列積で扱う行数（float16 → float32 変換の一時メモリを抑える）
+_SCORE_BLOCK_ROWS = 8192
+# 質問テキストを埋め込むときの上限（埋め込みモデルの入力上限より十分小さく）
+_QUERY_MAX_TOKENS = 2000
+
+
+@dataclass
+class Passage:
+    """検索結果の 1 段落。"""
+    source: str     # RETRIEVAL_DOCS_DIR からの相対パス
+    text: str
+    score: float
+
+
+# ================================================================== #
+# 埋め込みの提供元
+# ================================================================== #
+class EmbeddingProvider(Protocol):
+    """テキストの列を L2 正規化済みの float32 行列 (len(texts), dim) に変換する。"""
+
+    name: str
+
+    def embed(self, texts: list[str]): ...
+
+
+def _normalize(matrix):
+    import numpy as np
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+
+
+class HashingEmbeddingProvider:
+    """
+    英数字は単語、それ以外（かな・漢字）は文字 bi-gram を特徴量とし、
+    crc32 で dim 個のバケットへ符号付きで加算する。同じ入力には常に同じベクトルを返す。
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        text = text.lower()
+        features = _WORD_RE.findall(text)
+        rest = _WORD_RE.sub(" ", text)
+        for part in rest.split():
+            features += [part[i:i + 2] for i in range(max(1, len(part) - 1))]
+        return features
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(matrix)
+
+
+class AzureEmbeddingProvider:
+    """Azure OpenAI の埋め込みデプロイメントを使う。client は action_runner のキャッシュを共有する。"""
+
+    def __init__(self, client, deployment: str, batch_size: int = 64):
+        self._client = client
+        self._deployment = deployment
+        self._batch_size = batch_size
+        self.name = f"azure-{deployment}"
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+        rows = []
+        for i in range(0, len(texts), self._batch_size):
+            response = self._client.embeddings.create(
+                model=self._deployment, input=texts[i:i + self._batch_size])
+            rows += [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        return _normalize(np.asarray(rows, dtype=np.float32))
+
+
+def create_provider(name: str | None = None) -> EmbeddingProvider:
+    name = name or config.RETRIEVAL_EMBEDDING
+    if name == "hashing":
+        return HashingEmbeddingProvider()
+    if name == "azure":
+        from action_runner import _get_azure_client
+        return AzureEmbeddingProvider(_get_azure_client(), config.RETRIEVAL_EMBEDDING_DEPLOYMENT)
+    raise ValueError(f"未知の埋め込み提供元です: {name} (azure / hashing のいずれかを指定してください)")
+
+
+# ================================================================== #
+# インデックス
+# ================================================================== #
+def _scan(docs_dir: str, extensions: tuple[str, ...]) -> dict[str, tuple[float, int]]:
+    """docs_dir 以下の対象ファイルの {相対パス: (mtime, size)} を返す。"""
+    found = {}
+    for root, dirs, files in os.walk(docs_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if not name.lower().endswith(extensions):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, docs_dir).replace(os.sep, "/")
+            found[rel] = (st.st_mtime, st.st_size)
+    return found
+
+
+class DocumentIndex:
+    """
+    docs_dir の埋め込みインデックス。refresh() で差分更新し、search() で上位 k 件を返す。
+    ApiWorker とバックグラウンドジョブの複数スレッドから使うためロックで保護する。
+    _lock は参照の入れ替えだけに使い、埋め込み（通信を伴う）の間は保持しない。
+    refresh() 同士は _refresh_lock で直列化する。
+    """
+
+    def __init__(self, docs_dir: str, index_dir: str, provider: EmbeddingProvider,
+                 chunk_tokens: int = 400, extensions: tuple[str, ...] = (".txt", ".md")):
+        self._docs_dir = docs_dir
+        self._index_dir = index_dir
+        self._provider = provider
+        self._chunk_tokens = chunk_tokens
+        self._extensions = extensions
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._files: dict[str, dict] = {}
+        self._sources: list[str] = []
+        self._texts: list[str] = []
+        self._matrix = None             # np.memmap (rows, dim) float16
+        self._matrix_name = ""
+        self._last_scan = 0.0
+        self._load()
+
+    @property
+    def size(self) -> int:
+        return len(self._texts)
+
+    # ------------------------------------------------------------------ #
+    # 読み込み / 保存
+    # ------------------------------------------------------------------ #
+    def _load(self):
+        import numpy as np
+        path = os.path.join(self._index_dir, MANIFEST_NAME)
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (manifest.get("version") != MANIFEST_VERSION
+                or manifest.get("provider") != self._provider.name
+                or manifest.get("chunk_tokens") != self._chunk_tokens):
+            logger.info("インデックスの設定が変わったため作り直します")
+            return
+        try:
+            matrix = np.load(os.path.join(self._index_dir, manifest["matrix"]), mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("インデックスの読み込みに失敗しました: %s", e)
+            return
+        passages = manifest.get("passages", [])
+        if matrix.shape[0] != len(passages):
+            logger.warning("インデックスの行数が一致しないため作り直します")
+            return
+        self._files = manifest.get("files", {})
+        self._sources = [p[0] for p in passages]
+        self._texts = [p[1] for p in passages]
+        self._matrix = matrix
+        self._matrix_name = manifest["matrix"]
+        logger.info("インデックスを読み込みました (%d ファイル / %d 段落)", len(self._files), len(self._texts))
+
+    def _save(self, files: dict, sources: list[str], texts: list[str], matrix):
+        """行列とマニフェストを書き出し、読み込み直した行列（memmap）と、そのファイル名を返す。"""
+        import numpy as np
+        os.makedirs(self._index_dir, exist_ok=True)
+        generation = int(time.time() * 1000)
+        while os.path.exists(os.path.join(self._index_dir, f"embeddings-{generation}.npy")):
+            generation += 1
+        matrix_name = f"embeddings-{generation}.npy"
+        np.save(os.path.join(self._index_dir, matrix_name), matrix.astype(np.float16))
+
+        manifest = {
+            "version":      MANIFEST_VERSION,
+            "provider":     self._provider.name,
+            "chunk_tokens": self._chunk_tokens,
+            "matrix":       matrix_name,
+            "files":        files,
+            "passages":     [[s, t] for s, t in zip(sources, texts)],
+        }
+        tmp = os.path.join(self._index_dir, MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self._index_dir, MANIFEST_NAME))
+        return np.load(os.path.join(self._index_dir, matrix_name), mmap_mode="r"), matrix_name
+
+    def _remove_stale_matrices(self):
+        for name in os.listdir(self._index_dir):
+            if name.startswith("embeddings-") and name.endswith(".npy") and name != self._matrix_name:
+                try:
+                    os.remove(os.path.join(self._index_dir, name))
+                except OSError:
+                    pass    # 別スレッドの検索がまだ開いている場合は次回に回す
+
+    # ------------------------------------------------------------------ #
+    # 差分更新
+    # ------------------------------------------------------------------ #
+    def refresh(self, min_interval: float = 0.0) -> bool:
+        """
+        フォルダを走査し、変更があればインデックスを更新する。更新した場合は True。
+        min_interval 秒以内に走査済みなら何もしない。min_interval > 0 のときは、
+        別スレッドが更新中なら待たずに False を返す。
+        """
+        if not self._refresh_lock.acquire(blocking=min_interval <= 0):
+            return False
+        try:
+            return self._refresh(min_interval)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self, min_interval: float) -> bool:
+        import numpy as np
+        now = time.monotonic()
+        if self._last_scan and now - self._last_scan < min_interval:
+            return False
+        self._last_scan = now
+
+        # 入れ替えは _refresh_lock を持つこのスレッドだけが行うため、以降は手元の参照を使う
+        with self._lock:
+            old_files, old_texts, old_matrix = self._files, self._texts, self._matrix
+
+        current = _scan(self._docs_dir, self._extensions)
+        unchanged = {
+            rel for rel, (mtime, size) in current.items()
+            if rel in old_files
+            and old_files[rel]["mtime"] == mtime and old_files[rel]["size"] == size
+        }
+        if unchanged == set(current) == set(old_files):
+            return False
+
+        files, sources, texts, blocks = {}, [], [], []
+        for rel in sorted(current):
+            mtime, size = current[rel]
+            if rel in unchanged:
+                start, end = old_files[rel]["rows"]
+                passages = old_texts[start:end]
+                vectors = np.asarray(old_matrix[start:end], dtype=np.float32)
+            else:
+                passages = self._read_passages(rel)
+                vectors = (self._provider.embed(passages) if passages
+                           else np.zeros((0, 0), dtype=np.float32))
+            files[rel] = {"mtime": mtime, "size": size, "rows": [len(texts), len(texts) + len(passages)]}
+            if passages:
+                sources += [rel] * len(passages)
+                texts += passages
+                blocks.append(vectors)
+
+        matrix = np.concatenate(blocks) if blocks else np.zeros((0, 1), dtype=np.float32)
+        matrix, matrix_name = self._save(files, sources, texts, matrix)
+        with self._lock:
+            self._files, self._sources, self._texts = files, sources, texts
+            self._matrix, self._matrix_name = matrix, matrix_name
+        self._remove_stale_matrices()
+        logger.info("インデックスを更新しました (%d ファイル中 %d 件を埋め込み / %d 段落)",
+                    len(current), len(current) - len(unchanged), len(texts))
+        return True
+
+    def _read_passages(self, rel: str) -> list[str]:
+        path = os.path.join(self._docs_dir, rel)
+        try:
+            text = "".join(file_reader.TextFile(path).iter_text())
+        except (OSError, ValueError) as e:
+            logger.warning("読み込めませんでした: %s (%s)", rel, e)
+            return []
+        return [p.strip() for p in split_into_chunks(text, self._chunk_tokens) if p.strip()]
+
+    # ------------------------------------------------------------------ #
+    # 検索
+    # ------------------------------------------------------------------ #
+    def search(self, query: str, k: int = 4) -> list[Passage]:
+        """query に近い段落をスコアの高い順に最大 k 件返す。"""
+        import numpy as np
+        with self._lock:
+            matrix, sources, texts = self._matrix, self._sources, self._texts
+        if matrix is None or not texts or k <= 0:
+            return []
+
+        q = self._provider.embed([truncate_to_tokens(query, _QUERY_MAX_TOKENS)])[0]
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], _SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + _SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ q
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [Passage(sources[i], texts[i], float(scores[i])) for i in top]
+
+
+# ================================================================== #
+# シングルトン
+# ================================================================== #
+def enabled() -> bool:
+    return bool(config.RETRIEVAL_DOCS_DIR)
+
+
+_index: DocumentIndex | None = None
+_index_lock = threading.Lock()
+
+def get_index() -> DocumentIndex:
+    """DocumentIndex をシングルトン的に生成して返す。"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DocumentIndex(
+                config.RETRIEVAL_DOCS_DIR, config.RETRIEVAL_INDEX_DIR, create_provider(),
+                chunk_tokens = config.RETRIEVAL_CHUNK_TOKENS,
+                extensions   = config.RETRIEVAL_EXTENSIONS,
+            )
+        return _index
+
+
+def retrieve(query: str) -> list[Passage]:
+    """
+    今のインデックスから検索する。走査と埋め込み直しはバックグラウンドのスレッドが行い、
+    リクエストの処理中には行わない（スレッドが未起動ならここで起動する）。
+    """
+    refresh_in_background()
+    return get_index().search(query, config.RETRIEVAL_TOP_K)
+
+
+_refresher: threading.Thread | None = None
+
+def refresh_in_background():
+    """
+    インデックスを作り、以降は RETRIEVAL_RESCAN_SEC ごとに差分更新するスレッドを起動する。
+    起動時に呼んでおき、最初の質問を待たせないようにする。2 回目以降の呼び出しは何もしない。
+    """
+    global _refresher
+    with _index_lock:
+        if _refresher is not None:
+            return
+        _refresher = threading.Thread(target=_refresh_loop, name="PopAI-retrieval-index", daemon=True)
+        _refresher.start()
+
+
+def _refresh_loop():
+    while True:
+        try:
+            get_index().refresh()
+        except Exception as e:
+            logger.warning("インデックスの更新に失敗しました: %s: %s", type(e).__name__, e)
+        if config.RETRIEVAL_RESCAN_SEC <= 0:
+            return
+        time.sleep(config.RETRIEVAL_RESCAN_SEC)
@@ -0,0 +1,93 @@
+"""
+session_manager.py
+複数のフロートウィンドウ（セッション）を管理するモジュール。
+ホットキーのたびに空いているウィンドウを再利用し、無ければ新しく開く。
+各セッションは独立した ApiWorker を持ち、HTTP クライアント（接続プール）は
+action_runner のキャッシュを共有する。ウィンドウ数は config.MAX_SESSIONS までに制限する。
+"""
+
+import logging
+from typing import Callable
+
+from float_window import FloatWindow
+
+logger = logging.getLogger("popai.app")
+
+# 同時に表示するウィンドウを重ならないようずらす量（ピクセル）
+CASCADE_OFFSET = 32
+
+
+class SessionManager:
+    """
+    FloatWindow のプールを持ち、open() で表示先のウィンドウを選ぶ。
+    ウィンドウは閉じても破棄せず、次のセッションで再利用する。
+    """
+
+    def __init__(self, max_sessions: int,
+                 on_background: Callable[[str, str, int], None] | None = None):
+        self._max_sessions = max_sessions
+        self._on_background = on_background
+        # 先頭ほど最近使われていない（LRU 順）
+        self._windows: list[FloatWindow] = []
+
+    def open(self, text: str) -> FloatWindow | None:
+        """
+        text を表示するセッションを開く。上限に達していて、どのウィンドウも処理中の場合は None。
+        選ぶ順序: 閉じていて空いているもの → 新規作成 → 表示中で空いているもののうち最も古いもの
+        """
+        window = self._pick_window()
+        if window is None:
+            logger.warning("セッション数が上限 (%d) に達していて、すべて処理中です", self._max_sessions)
+            return None
+
+        visible = sum(1 for w in self._windows if w is not window and w.isVisible())
+        self._windows.remove(window)
+        self._windows.append(window)
+        window.show_with_text(text, offset=CASCADE_OFFSET * visible)
+        logger.info("セッション #%d を表示しました (表示中 %d / 上限 %d)",
+                    window.session_id, visible + 1, self._max_sessions)
+        return window
+
+    def open_result(self, text: str, answer: str) -> FloatWindow | None:
+        """完了済みの回答（バックグラウンドジョブの結果）をセッションとして開く。"""
+        window = self.open(text)
+        if window is not None:
+            window.set_result(answer)
+        return window
+
+    def open_file(self, path: str) -> FloatWindow | None:
+        """ファイルを入力にしたセッションを開く（トレイの「ファイルを開く」）。"""
+        window = self.open("")
+        if window is not None:
+            window.attach_file(path)
+        return window
+
+    def _pick_window(self) -> FloatWindow | None:
+        for window in self._windows:
+            if not window.isVisible() and not window.is_busy():
+                return window
+        if len(self._windows) < self._max_sessions:
+            window = FloatWindow(session_id=self._next_session_id())
+            if self._on_background is not None:
+                window.background_requested.connect(self._on_background)
+            self._windows.append(window)
+            return window
+        for window in self._windows:
+            if not window.is_busy():
+                return window
+        return None
+
+    def _next_session_id(self) -> int:
+        used = {w.session_id for w in self._windows}
+        return next(i for i in range(1, self._max_sessions + 1) if i not in used)
+
+    @property
+    def max_sessions(self) -> int:
+        return self._max_sessions
+
+    def request_info(self) -> dict:
+        """
+        処理中セッションの概要を返す（ウォッチドッグの context_provider）。
+        補助スレッドから呼ばれるため、リストの複製と Python の属性だけを読む。
+        """
+        return {"sessions": [w.request_info() for w in list(self._windows) if w.is_busy()]}
@@ -0,0 +1,288 @@
+"""
+singleflight.py
+同一リクエストの重複排除（single-flight）。
+ダブルクリックや、同じ選択範囲を複数のウィンドウ・ジョブから送った場合に、
+同じ内容のストリームを何本も張らず、1 本の上流ストリームを全員に配る。
+
+  ・キーはバックエンド・アクション・モデル・messages（プロンプトと入力テキスト）・生成パラメータ
+  ・上流は購読者のスレッドが読む（専用スレッドは作らない）。受信したチャンクはバッファに溜めて全購読者へ配る
+    購読者が 1 人なら、その購読者が上流をそのまま読むのと同じになる
+  ・途中から参加した購読者には、それまでのバッファを先に流す
+  ・購読者が途中で抜けても上流は続け、最後の 1 人が抜けたときだけ上流を中断する
+  ・上流が終わったキーは表から消す（完了後の同じリクエストは新しく送信する）
+
+使用量は二重に記録しないよう、最後まで受信した購読者のうち 1 人だけが記録する（claim_usage）。
+全員が途中で抜けた場合は、上流を中断した最後の 1 人が途中までの使用量を記録する。
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from typing import Iterator
+
+import backends
+import config
+
+logger = logging.getLogger("popai.api")
+
+
+def request_key(backend_name: str, request: backends.GenerationRequest) -> str:
+    payload = json.dumps([
+        backend_name, request.action, request.model, request.messages,
+        request.max_tokens, request.temperature, request.include_usage,
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """
+    1 本の上流ストリームと、受信済みチャンクのバッファ。
+    専用スレッドは使わず、バッファを読み終えた購読者が自分のスレッドで上流から次のチャンクを読む
+    （同時に読むのは 1 人だけ）。購読者が 1 人なら、上流をそのまま読むのと同じ手間で済む。
+    """
+
+    def __init__(self, group: "SingleFlight", key: str, backend: backends.Backend,
+                 request: backends.GenerationRequest):
+        self.key = key
+        self.subscribers = 0
+        self._group = group
+        self._backend = backend
+        self._upstream = backend.stream(request)
+        self._cond = threading.Condition()
+        self._chunks: list[backends.StreamChunk] = []
+        self._pulling = False           # 購読者の誰かが上流を読んでいる
+        self._abandoned = False         # 全員が抜けたため上流を閉じる
+        self._done = False
+        self._error: BaseException | None = None
+        self._error_tb = None
+        self._usage_claimed = False
+
+    def pull(self):
+        """上流から 1 チャンク読んでバッファに足す。_pulling を立てた購読者だけが呼ぶ。"""
+        chunk, done, error = None, False, None
+        try:
+            chunk = next(self._upstream)
+        except StopIteration:
+            done = True
+        except BaseException as e:
+            done, error = True, e
+        if done:
+            self._group._finished(self)
+        with self._cond:
+            self._pulling = False
+            if chunk is not None:
+                self._chunks.append(chunk)
+            if done:
+                self._done, self._error = True, error
+                self._error_tb = error.__traceback__ if error is not None else None
+            close = self._abandoned and not self._done
+            if close:
+                self._done = True
+            self._cond.notify_all()
+        if close:
+            self._close_upstream()
+
+    def raise_error(self):
+        """
+        上流の例外を送出する。購読者ごとに raise すると同じ例外オブジェクトに
+        各購読者のフレームが積み重なるため、毎回上流で発生した時点のトレースバックに戻す。
+        """
+        raise self._error.with_traceback(self._error_tb)
+
+    def cancel_upstream(self):
+        self._backend.cancel()
+        with self._cond:
+            self._abandoned = True
+            # 誰かが読んでいる最中なら、その購読者が読み終えたところで閉じる
+            close = not self._pulling and not self._done
+            if close:
+                self._done = True
+        if close:
+            self._close_upstream()
+
+    def _close_upstream(self):
+        close = getattr(self._upstream, "close", None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.warning("上流のストリームを閉じられませんでした: %s: %s", type(e).__name__, e)
+
+    def claim_usage(self) -> bool:
+        with self._cond:
+            if self._usage_claimed:
+                return False
+            self._usage_claimed = True
+            return True
+
+
+class Subscription:
+    """_Flight の購読者 1 人分。イテレートするとバッファの先頭からチャンクを返す。"""
+
+    def __init__(self, group: "SingleFlight", flight: _Flight, joined: bool):
+        self.joined = joined        # True なら既存の上流に相乗りした
+        self._group = group
+        self._flight = flight
+        self._leaving = False
+        self._left = False
+        self.stopped_upstream = False   # True なら最後の購読者として上流を中断した
+
+    def __iter__(self) -> Iterator[backends.StreamChunk]:
+        flight = self._flight
+        index = 0
+        try:
+            while True:
+                with flight._cond:
+                    while True:
+                        if self._left:
+                            return
+                        if index < len(flight._chunks):
+                            batch = flight._chunks[index:]
+                            index += len(batch)
+                            break
+                        if flight._done:
+                            if flight._error is not None:
+                                flight.raise_error()
+                            return
+                        if not flight._pulling:
+                            flight._pulling = True
+                            batch = None
+                            break
+                        flight._cond.wait()
+                if batch is None:
+                    # 上流の受信はロックの外で行い、その間も他の購読者はバッファを読める
+                    flight.pull()
+                    continue
+                # 購読者側の処理（UI へのシグナル送出など）はロックの外で行う
+                yield from batch
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        """購読をやめる。最後の購読者なら上流も中断する。何度呼んでもよい。"""
+        with self._flight._cond:
+            if self._leaving:
+                return
+            self._leaving = True
+        # stopped_upstream は、イテレーションが終わる（_left を見る）前に確定させておく
+        last = self._group._leave(self._flight)
+        with self._flight._cond:
+            self.stopped_upstream = last
+            self._left = True
+            self._flight._cond.notify_all()
+
+    def claim_usage(self) -> bool:
+        """最後まで受信した購読者のうち、最初に呼んだ 1 人だけ True（使用量を記録する役）。"""
+        return self._flight.claim_usage()
+
+
+class SingleFlight:
+    """キーごとに実行中の _Flight を管理する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+
+    def subscribe(self, backend: backends.Backend, request: backends.GenerationRequest) -> Subscription:
+        key = request_key(backend.name, request)
+        with self._lock:
+            flight = self._flights.get(key)
+            joined = flight is not None
+            if flight is None:
+                flight = _Flight(self, key, backend, request)
+                self._flights[key] = flight
+            flight.subscribers += 1
+            subscribers = flight.subscribers
+        if joined:
+            logger.info("同一リクエストのストリームに相乗りします key=%s, 購読者 %d", key[:8], subscribers)
+        return Subscription(self, flight, joined)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def _leave(self, flight: _Flight) -> bool:
+        """購読者を 1 人減らす。最後の 1 人として上流を中断した場合は True。"""
+        with self._lock:
+            flight.subscribers -= 1
+            last = flight.subscribers == 0 and self._flights.get(flight.key) is flight
+            if last:
+                # 以降の同じリクエストは中断中の上流に相乗りさせず、新しく送信する
+                del self._flights[flight.key]
+        if last:
+            logger.info("購読者がいなくなったため上流を中断します key=%s", flight.key[:8])
+            flight.cancel_upstream()
+        return last
+
+    def _finished(self, flight: _Flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+
+class SingleFlightBackend:
+    """
+    Backend をラップし、stream() を SingleFlight 経由にする。
+    ActionRunner はリクエストごとにラッパーを作るため、cancel() は自分の購読だけを止める。
+    """
+
+    def __init__(self, backend: backends.Backend, group: SingleFlight):
+        self._backend = backend
+        self._group = group
+        self._subscription: Subscription | None = None
+        self._cancelled = False
+        self.owns_usage = True
+
+    @property
+    def name(self) -> str:
+        return self._backend.name
+
+    @property
+    def default_model(self) -> str:
+        return self._backend.default_model
+
+    def stream(self, request: backends.GenerationRequest) -> Iterator[backends.StreamChunk]:
+        if self._cancelled:
+            self.owns_usage = False     # 送信していない
+            return
+        subscription = self._group.subscribe(self._backend, request)
+        self._subscription = subscription
+        if self._cancelled:
+            subscription.cancel()
+        else:
+            yield from subscription
+        if self._cancelled:
+            # 中断した場合は、上流も止めた最後の購読者だけが途中までの使用量を記録する
+            self.owns_usage = subscription.stopped_upstream and subscription.claim_usage()
+        else:
+            self.owns_usage = subscription.claim_usage()
+
+    def cancel(self) -> None:
+        self._cancelled = True
+        subscription = self._subscription
+        if subscription is not None:
+            subscription.cancel()
+
+    def health_check(self) -> backends.HealthStatus:
+        return self._backend.health_check()
+
+
+_group: SingleFlight | None = None
+_group_lock = threading.Lock()
+
+def get_group() -> SingleFlight:
+    """SingleFlight をシングルトン的に生成して返す。"""
+    global _group
+    with _group_lock:
+        if _group is None:
+            _group = SingleFlight()
+        return _group
+
+
+def wrap(backend: backends.Backend) -> backends.Backend:
+    """config.SINGLE_FLIGHT が有効ならラップして返す。"""
+    if not config.SINGLE_FLIGHT:
+        return backend
+    return SingleFlightBackend(backend, get_group())
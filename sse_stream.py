@@ -0,0 +1,210 @@
+"""
+sse_stream.py
+Chat Completions のストリームを openai SDK を介さずに受信する高速経路（config.FAST_SSE = True のとき）。
+SDK はデルタごとに型付きのチャンクオブジェクト（pydantic）を組み立てるが、
+ここでは SSE の data 行を json.loads して、本文・finish_reason・usage だけを取り出す。
+
+  ・HTTP 接続は action_runner でキャッシュした httpx.Client（SDK と同じ接続プール）を使う
+  ・エラーは SDK と同じ例外クラスにする
+      接続失敗 → APIConnectionError / タイムアウト → APITimeoutError
+      HTTP 4xx / 5xx → BadRequestError・RateLimitError などの APIStatusError
+      ストリーム中の {"error": ...} → APIError
+  ・408 / 409 / 429 / 5xx と接続失敗は、SDK と同じ回数・間隔で再試行する
+  ・受信開始後の通信エラーは SDK と同様に httpx の例外のまま送出する
+"""
+
+import json
+import logging
+import random
+from typing import Callable, Iterable, Iterator
+
+import backends
+import stream_recorder
+
+logger = logging.getLogger("popai.api")
+
+_DONE = "[DONE]"
+
+# openai SDK の既定値に合わせる
+TIMEOUT_SEC         = 600.0
+CONNECT_TIMEOUT_SEC = 5.0
+MAX_RETRIES         = 2
+_RETRY_STATUSES     = (408, 409, 429)
+
+_STATUS_ERRORS = {
+    400: "BadRequestError",
+    401: "AuthenticationError",
+    403: "PermissionDeniedError",
+    404: "NotFoundError",
+    409: "ConflictError",
+    422: "UnprocessableEntityError",
+    429: "RateLimitError",
+}
+
+
+# ================================================================== #
+# SSE の解析
+# ================================================================== #
+def iter_events(lines: Iterable[str]) -> Iterator[str]:
+    """
+    SSE の行から、イベントごとの data を返す。data: [DONE] で終わる。
+    複数行の data は "\\n" で連結する。コメント行・event / id / retry フィールドは使わない。
+    """
+    data: list[str] = []
+    for line in lines:
+        if not line:
+            if not data:
+                continue
+            value = data[0] if len(data) == 1 else "\n".join(data)
+            data.clear()
+            if value == _DONE:
+                return
+            yield value
+        elif line.startswith("data:"):
+            value = line[5:]
+            data.append(value[1:] if value.startswith(" ") else value)
+    # 末尾の空行が無いまま切れた場合
+    if data:
+        value = "\n".join(data)
+        if value != _DONE:
+            yield value
+
+
+def parse_chunk(data: str, http_request=None) -> tuple[dict, backends.StreamChunk | None]:
+    """data 1 件分を (JSON, StreamChunk) にする。意味のない空チャンクは None。"""
+    payload = json.loads(data)
+    if payload.get("error"):
+        import openai
+        error = payload["error"]
+        message = error.get("message") if isinstance(error, dict) else None
+        raise openai.APIError(message or "An error occurred during streaming", http_request, body=error)
+    return payload, backends.chunk_from_payload(payload)
+
+
+def status_error(response) -> Exception:
+    """HTTP エラーのレスポンスを、SDK と同じ APIStatusError のサブクラスにする。"""
+    import openai
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text or None
+    status = response.status_code
+    name = _STATUS_ERRORS.get(status) or ("InternalServerError" if status >= 500 else "APIStatusError")
+    data = body.get("error", body) if isinstance(body, dict) else body
+    return getattr(openai, name)(f"Error code: {status} - {body}", response=response, body=data)
+
+
+def _should_retry(response) -> bool:
+    header = response.headers.get("x-should-retry")
+    if header in ("true", "false"):
+        return header == "true"
+    return response.status_code in _RETRY_STATUSES or response.status_code >= 500
+
+
+def _retry_delay(attempt: int, response) -> float:
+    """retry-after があればそれに従い、無ければ SDK と同じ指数バックオフ（ジッター付き）。"""
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after", ""))
+            if 0 < retry_after <= 60:
+                return retry_after
+        except ValueError:
+            pass
+    return min(0.5 * 2 ** attempt, 8.0) * (1 - 0.25 * random.random())
+
+
+# ================================================================== #
+# バックエンド
+# ================================================================== #
+class SSEBackend(backends.OpenAICompatibleBackend):
+    """
+    OpenAICompatibleBackend の stream() だけを httpx での直接受信に置き換えたもの。
+    cancel()（レスポンスのクローズ）と health_check()（SDK 経由）はそのまま使う。
+    url_for(model) はリクエスト先の URL を返す（Azure はデプロイメントごとに URL が変わる）。
+    """
+
+    def __init__(self, name: str, client, http_client, url_for: Callable[[str], str],
+                 headers: dict, default_model: str, params: dict | None = None,
+                 record_dir: str = ""):
+        super().__init__(name, client, default_model, record_dir)
+        self._http = http_client
+        self._url_for = url_for
+        self._headers = headers
+        self._params = params or {}
+
+    def stream(self, request: backends.GenerationRequest) -> Iterator[backends.StreamChunk]:
+        body = {"model": request.model, "messages": request.messages, "stream": True}
+        if request.max_tokens is not None:
+            body["max_tokens"] = request.max_tokens
+        if request.temperature is not None:
+            body["temperature"] = request.temperature
+        if request.include_usage:
+            body["stream_options"] = {"include_usage": True}
+
+        response = self._open(request.model, body)
+        if response is None:
+            return
+        self._response = response
+        recorder = None
+        if self._record_dir:
+            recorder = stream_recorder.StreamRecorder.create(
+                self._record_dir, self.name, request.action, request.model, payload="wire"
+            )
+        try:
+            for data in iter_events(response.iter_lines()):
+                if self._cancelled.is_set():
+                    break
+                payload, chunk = parse_chunk(data, response.request)
+                if recorder is not None:
+                    recorder.write(payload)
+                if chunk is not None:
+                    yield chunk
+        except Exception:
+            # cancel() でレスポンスを閉じた場合の読み込みエラーは中断として扱う
+            if not self._cancelled.is_set():
+                raise
+        finally:
+            self._response = None
+            response.close()
+            if recorder is not None:
+                recorder.close()
+                logger.info("ストリームを記録しました: %s", recorder.path)
+
+    def _open(self, model: str, body: dict):
+        """リクエストを送信してストリーミング中のレスポンスを返す。中断された場合は None。"""
+        import httpx
+        import openai
+
+        timeout = httpx.Timeout(TIMEOUT_SEC, connect=CONNECT_TIMEOUT_SEC)
+        for attempt in range(MAX_RETRIES + 1):
+            if self._cancelled.is_set():
+                return None
+            http_request = self._http.build_request(
+                "POST", self._url_for(model), params=self._params,
+                headers=self._headers, json=body, timeout=timeout,
+            )
+            response = None
+            try:
+                response = self._http.send(http_request, stream=True)
+            except httpx.TimeoutException as e:
+                error = openai.APITimeoutError(request=http_request)
+                error.__cause__ = e
+            except httpx.HTTPError as e:
+                error = openai.APIConnectionError(request=http_request)
+                error.__cause__ = e
+            else:
+                if response.status_code < 400:
+                    return response
+                response.read()
+                response.close()
+                error = status_error(response)
+                if not _should_retry(response):
+                    raise error
+
+            if attempt == MAX_RETRIES:
+                raise error
+            delay = _retry_delay(attempt, response)
+            logger.info("%s のため %.1f 秒後に再試行します (%d/%d)",
+                        type(error).__name__, delay, attempt + 1, MAX_RETRIES)
+            if self._cancelled.wait(delay):
+                return None
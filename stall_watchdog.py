@@ -0,0 +1,153 @@
+"""
+stall_watchdog.py
+Qt イベントループの停止（フリーズ）を検出するウォッチドッグ。
+PopAIApp の QTimer から beat() を定期的に呼び、補助スレッドが最後の beat からの経過時間を監視する。
+しきい値を超えたら、その時点のメインスレッドの Python スタックと
+実行中のリクエスト情報（アクション・文書サイズ）を記録する。
+
+停止イベントは config.STALL_LOG_PATH に JSON Lines で追記し、
+停止時間のヒストグラムはトレイメニューから確認できる。
+ファイルへの書き込みは監視スレッドで行い、停止直後の UI スレッドでは I/O をしない。
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable
+
+import config
+
+logger = logging.getLogger("popai.watchdog")
+
+# ヒストグラムの区切り（しきい値の倍数）。しきい値未満の停止は記録しないため、最初の区間はしきい値から始まる。
+# しきい値 500 ms なら 500–750 / 750–1000 / 1000–2000 / 2000–5000 / 5000 ms 以上
+HISTOGRAM_FACTORS = (1.5, 2, 4, 10)
+
+
+class StallWatchdog:
+    """
+    beat() はメインスレッドから、それ以外は補助スレッドから呼ばれる。
+    context_provider は補助スレッドから呼ばれるため、Qt ウィジェットに触れず
+    Python の属性だけを読む関数にすること。
+    """
+
+    def __init__(self, threshold: float, check_interval: float = 0.05,
+                 context_provider: Callable[[], dict] | None = None, log_path: str = "",
+                 max_events: int = 200):
+        self._threshold = threshold
+        self._check_interval = check_interval
+        self._context_provider = context_provider
+        self._log_path = log_path
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._main_ident = threading.main_thread().ident
+        self._last_beat = time.perf_counter()
+        self._pending: dict | None = None   # 検出済みで、まだ終わっていない停止
+        self._bounds_ms = tuple(round(threshold * 1000 * f) for f in HISTOGRAM_FACTORS)
+        self._histogram = [0] * (len(self._bounds_ms) + 1)
+        self._unwritten: list[dict] = []    # 監視スレッドがファイルに書き出す停止イベント
+        # 直近の停止イベント（ヒストグラムは全件を数えるが、詳細は max_events 件だけ残す）
+        self.events: deque[dict] = deque(maxlen=max_events)
+
+    def start(self, main_ident: int | None = None):
+        if main_ident is not None:
+            self._main_ident = main_ident
+        self._last_beat = time.perf_counter()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="PopAI-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._write_events()
+
+    def beat(self):
+        """イベントループが動いていることを知らせる（メインスレッドから呼ぶ）。"""
+        now = time.perf_counter()
+        with self._lock:
+            gap = now - self._last_beat
+            self._last_beat = now
+            event, self._pending = self._pending, None
+        if event is not None:
+            self._finish(event, gap)
+
+    def _run(self):
+        while not self._stop_event.wait(self._check_interval):
+            self._write_events()
+            with self._lock:
+                gap = time.perf_counter() - self._last_beat
+                if gap < self._threshold or self._pending is not None:
+                    continue
+            # 停止を検出した時点のメインスレッドのスタックを採取する
+            frame = sys._current_frames().get(self._main_ident)
+            stack = traceback.format_stack(frame) if frame is not None else []
+            context = {}
+            if self._context_provider is not None:
+                try:
+                    context = self._context_provider()
+                except Exception as e:
+                    context = {"error": f"{type(e).__name__}: {e}"}
+            event = {
+                "detected_at": time.time(),
+                "stack":       [line.rstrip() for line in stack],
+                "context":     context,
+            }
+            with self._lock:
+                self._pending = event
+            logger.warning("UI スレッドが %.0f ms 応答していません", gap * 1000)
+
+    def _finish(self, event: dict, gap: float):
+        event["duration_ms"] = round(gap * 1000, 1)
+        with self._lock:
+            self._histogram[self._bucket(event["duration_ms"])] += 1
+            self.events.append(event)
+            if self._log_path:
+                self._unwritten.append(event)
+        where = event["stack"][-1].strip().splitlines()[0] if event["stack"] else "(スタック不明)"
+        logger.warning("フリーズ %.0f ms: %s context=%s", event["duration_ms"], where, event["context"])
+
+    def _write_events(self):
+        """溜まった停止イベントを JSON Lines で追記する（監視スレッド・stop() から呼ぶ）。"""
+        with self._lock:
+            events, self._unwritten = self._unwritten, []
+        if not events:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._log_path) or ".", exist_ok=True)
+            with open(self._log_path, "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("ログの書き込みに失敗しました: %s", e)
+
+    def _bucket(self, duration_ms: float) -> int:
+        for i, bound in enumerate(self._bounds_ms):
+            if duration_ms < bound:
+                return i
+        return len(self._bounds_ms)
+
+    def format_histogram(self) -> str:
+        """停止時間のヒストグラムと直近の停止箇所をテキストにまとめる。"""
+        with self._lock:
+            histogram = list(self._histogram)
+            recent = list(self.events)[-5:]
+        lows = (round(self._threshold * 1000),) + self._bounds_ms
+        labels = [f"{lo}–{hi} ms" for lo, hi in zip(lows, self._bounds_ms)] + [f">= {self._bounds_ms[-1]} ms"]
+        lines = [f"しきい値: {self._threshold * 1000:.0f} ms", ""]
+        for label, count in zip(labels, histogram):
+            lines.append(f"  {label:>12}: {count:4d} {'#' * min(count, 40)}")
+        if recent:
+            lines += ["", "■ 直近の停止"]
+            for ev in reversed(recent):
+                where = ev["stack"][-1].strip().splitlines()[0] if ev["stack"] else "(スタック不明)"
+                lines.append(f"  {ev['duration_ms']:.0f} ms  {where}")
+        return "\n".join(lines)
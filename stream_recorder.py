@@ -0,0 +1,87 @@
+"""
+stream_recorder.py
+実際のストリーム（チャンクの生データとタイミング）を記録・読み込みするモジュール。
+記録したファイルは backends.ReplayBackend で再生でき、ネットワーク無しで
+チャンクサイズのばらつきやトークン間の待ち時間を含めた再現性のある性能測定ができる。
+
+【ファイル形式】gzip 圧縮した JSON Lines
+  1 行目: ヘッダー {"version": 1, "backend": ..., "action": ..., "model": ..., "recorded_at": ..., "payload": ...}
+  2 行目以降: [リクエスト送信からの経過秒, チャンクの dict]
+
+チャンクの dict は受信経路によって異なる（ヘッダーの payload で区別する）。
+  "wire" … sse_stream.SSEBackend（FAST_SSE）。SSE の data 行の JSON そのもの
+  "sdk"  … OpenAICompatibleBackend。SDK のチャンクオブジェクトの model_dump(exclude_unset=True)。
+           SDK が解釈しない項目や、SDK が補う既定値の扱いがワイヤ上の JSON と異なることがある
+どちらも backends.chunk_from_payload で同じ StreamChunk になるため、再生には影響しない。
+"""
+
+import gzip
+import json
+import os
+import time
+
+FORMAT_VERSION = 1
+
+
+def to_payload(obj):
+    """SDK のチャンクオブジェクト（pydantic）等を JSON 化できる dict / list に変換する。"""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, dict):
+        return {k: to_payload(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_payload(v) for v in obj]
+    model_dump = getattr(obj, "model_dump", None)
+    if model_dump is not None:
+        return model_dump(exclude_unset=True)
+    return {k: to_payload(v) for k, v in vars(obj).items()}
+
+
+class StreamRecorder:
+    """1 回分のストリームをファイルへ書き出す。"""
+
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"version": FORMAT_VERSION, **header}, ensure_ascii=False) + "\n")
+        self._started = time.perf_counter()
+
+    @classmethod
+    def create(cls, directory: str, backend: str, action: str, model: str,
+               payload: str = "sdk") -> "StreamRecorder":
+        """directory に一意な名前でファイルを作って記録を開始する。payload は "sdk" / "wire"。"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"{stamp}-{int(time.time_ns() % 1_000_000):06d}-{action}.jsonl.gz")
+        return cls(path, {
+            "backend": backend, "action": action, "model": model, "recorded_at": time.time(),
+            "payload": payload,
+        })
+
+    def write(self, chunk):
+        elapsed = round(time.perf_counter() - self._started, 6)
+        self._file.write(json.dumps([elapsed, to_payload(chunk)], ensure_ascii=False,
+                                    separators=(",", ":")) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path: str) -> tuple[dict, list[tuple[float, dict]]]:
+    """記録ファイルを読み込み、(ヘッダー, [(経過秒, チャンク dict), ...]) を返す。"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"未対応の記録ファイルです (version={header.get('version')}): {path}")
+        events = [tuple(json.loads(line)) for line in f if line.strip()]
+    return header, events
+
+
+def list_recordings(path: str) -> list[str]:
+    """path がディレクトリなら中の記録ファイル一覧を、ファイルならそれ自身を返す。存在しなければ空。"""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl.gz")
+        )
+    return [path] if os.path.isfile(path) else []
+
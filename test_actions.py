@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import actions
+from actions import ActionRegistry, ActionSpec, InputRoute
+
+
+class TestActionRegistry(unittest.TestCase):
+
+    def test_defaults_when_file_missing(self):
+        registry = ActionRegistry(os.path.join(tempfile.gettempdir(), "no_such_actions.json"))
+        self.assertEqual([s.key for s in registry.actions()], ["S", "Q", "T", "C"])
+        self.assertEqual(registry.get("S").button_text, "要約(&S)")
+
+    def test_reload_on_mtime_change(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "actions.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"actions": [{"key": "S", "label": "要約"}]}, f)
+            registry = ActionRegistry(path)
+            version = registry.version
+            self.assertEqual([s.key for s in registry.actions()], ["S"])
+
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"actions": [{"key": "S", "label": "要約"},
+                                       {"key": "E", "label": "英訳"}]}, f)
+            os.utime(path, (0, 12345))
+            self.assertEqual([s.key for s in registry.actions()], ["S", "E"])
+            self.assertGreater(registry.version, version)
+
+            # 壊れたファイルでは直前の定義を維持する
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("{")
+            os.utime(path, (0, 23456))
+            self.assertEqual([s.key for s in registry.actions()], ["S", "E"])
+
+    def test_parse_rejects_duplicates_and_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            actions.parse_actions({"actions": [{"key": "S", "label": "a"},
+                                               {"key": "S", "label": "b"}]})
+        with self.assertRaises(ValueError):
+            actions.parse_actions({"actions": [{"key": "S", "label": "a", "colour": "#fff"}]})
+
+    def test_resolve_routes_by_input_size(self):
+        spec = ActionSpec(
+            "S", "要約", deployment="large", max_tokens=800,
+            routes=(InputRoute(max_input_tokens=10, deployment="small", max_tokens=100),),
+        )
+        short = spec.resolve("短い文")
+        self.assertEqual((short.deployment, short.max_tokens), ("small", 100))
+        long = spec.resolve("長い文章" * 50)
+        self.assertEqual((long.deployment, long.max_tokens), ("large", 800))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,29 +8,52 @@ class DummyQThread:
         pass
 
 # PyQt6 などをモックする（GUIを起動せずにテストするため）
-sys.modules['PyQt6'] = MagicMock()
-sys.modules['PyQt6.QtCore'] = MagicMock()
-sys.modules['PyQt6.QtCore'].QThread = DummyQThread # 継承できるようにダミークラスにする
-sys.modules['dotenv'] = MagicMock()
-sys.modules['httpx'] = MagicMock()
-sys.modules['openai'] = MagicMock()
-
-# configモジュールをインポート前にモックする
+# 他のテストが実際の httpx / openai を使えるよう、モックはこのモジュールのテスト中だけ有効にする
+_qtcore = MagicMock()
+_qtcore.QThread = DummyQThread # 継承できるようにダミークラスにする
+_modules = patch.dict(sys.modules, {
+    'PyQt6': MagicMock(),
+    'PyQt6.QtCore': _qtcore,
+    'dotenv': MagicMock(),
+    'httpx': MagicMock(),
+    'openai': MagicMock(),
+})
+
 import config
-config.USE_DUMMY_API = False
-config.AZURE_OPENAI_ENDPOINT = "https://dummy.openai.azure.com/"
-config.AZURE_OPENAI_API_KEY = "dummy_key"
-config.AZURE_OPENAI_DEPLOYMENT_NAME = "dummy_deployment"
-config.AZURE_OPENAI_API_VERSION = "2024-02-01"
-config.DISABLE_SSL_VERIFY = False
 
-import httpx
-import openai
-from api_worker import ApiWorker
+# config の値もこのモジュールのテスト中だけ差し替える
+_config = patch.multiple(
+    config,
+    USE_DUMMY_API = False,
+    POPAI_BACKEND = "",
+    AZURE_OPENAI_ENDPOINT = "https://dummy.openai.azure.com/",
+    AZURE_OPENAI_API_KEY = "dummy_key",
+    AZURE_OPENAI_DEPLOYMENT_NAME = "dummy_deployment",
+    AZURE_OPENAI_API_VERSION = "2024-02-01",
+    DISABLE_SSL_VERIFY = False,
+    USAGE_LOG_PATH = "",
+    FAST_SSE = False,
+    PROCESS_WORKER = False,
+)
+
+ApiWorker = None
+
+
+def setUpModule():
+    global ApiWorker
+    _modules.start()
+    _config.start()
+    from api_worker import ApiWorker
+
+    # emit用のモック
+    ApiWorker.result_ready = MagicMock()
+    ApiWorker.error_occurred = MagicMock()
+
 
-# emit用のモック
-ApiWorker.result_ready = MagicMock()
-ApiWorker.error_occurred = MagicMock()
+def tearDownModule():
+    _config.stop()
+    # モック環境で読み込んだ api_worker / action_runner なども sys.modules から取り除かれる
+    _modules.stop()
 
 class TestApiWorkerProxy(unittest.TestCase):
 
@@ -40,8 +63,8 @@ class TestApiWorkerProxy(unittest.TestCase):
         worker = ApiWorker(button_key="C", user_text="Hello")
 
         with patch.dict(os.environ, {"HTTP_PROXY": "http://my.proxy:8080"}, clear=True):
-            import api_worker
-            api_worker._azure_client = None  # Reset cache for testing
+            import action_runner
+            action_runner._azure_client = None  # Reset cache for testing
             worker.run()
             mock_httpx_client.assert_called_with(proxy="http://my.proxy:8080")
 
@@ -51,8 +74,8 @@ class TestApiWorkerProxy(unittest.TestCase):
         worker = ApiWorker(button_key="C", user_text="Hello")
 
         with patch.dict(os.environ, {"HTTPS_PROXY": "https://my.secure.proxy:8443", "HTTP_PROXY": "http://my.proxy:8080"}, clear=True):
-            import api_worker
-            api_worker._azure_client = None  # Reset cache for testing
+            import action_runner
+            action_runner._azure_client = None  # Reset cache for testing
             worker.run()
             mock_httpx_client.assert_called_with(proxy="https://my.secure.proxy:8443")
 
@@ -62,8 +85,8 @@ class TestApiWorkerProxy(unittest.TestCase):
         worker = ApiWorker(button_key="C", user_text="Hello")
 
         with patch.dict(os.environ, {}, clear=True):
-            import api_worker
-            api_worker._azure_client = None  # Reset cache for testing
+            import action_runner
+            action_runner._azure_client = None  # Reset cache for testing
             worker.run()
             mock_httpx_client.assert_called_with()
 
@@ -77,8 +100,8 @@ class TestApiWorkerProxy(unittest.TestCase):
         config.DISABLE_SSL_VERIFY = True
         try:
             with patch.dict(os.environ, {"HTTP_PROXY": "http://my.proxy:8080"}, clear=True):
-                import api_worker
-                api_worker._azure_client = None  # Reset cache for testing
+                import action_runner
+                action_runner._azure_client = None  # Reset cache for testing
                 worker.run()
                 mock_httpx_client.assert_called_with(proxy="http://my.proxy:8080", verify=False)
         finally:
@@ -0,0 +1,251 @@
+import gzip
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import backends
+import sse_stream
+import stream_recorder
+from backends import GenerationRequest
+
+
+# ------------------------------------------------------------------ #
+# openai SDK クライアントのローカル代替
+# ------------------------------------------------------------------ #
+def _chunk(content=None, finish_reason=None, usage=None, empty=False):
+    choices = [] if empty else [SimpleNamespace(
+        delta=SimpleNamespace(content=content), finish_reason=finish_reason)]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        for c in self._chunks:
+            if self.closed:
+                return
+            yield c
+
+    def close(self):
+        self.closed = True
+
+
+class FakeOpenAIClient:
+    """chat.completions.create(stream=True) と models.list() だけを持つ代替クライアント。"""
+
+    def __init__(self, pieces, with_filter_chunk=False, healthy=True):
+        self._pieces = pieces
+        self._with_filter_chunk = with_filter_chunk
+        self._healthy = healthy
+        self.last_kwargs = None
+        self.last_stream = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=self._list)
+
+    def _create(self, **kwargs):
+        self.last_kwargs = kwargs
+        chunks = [_chunk(empty=True)] if self._with_filter_chunk else []
+        chunks += [_chunk(content=p) for p in self._pieces]
+        chunks.append(_chunk(finish_reason="stop"))
+        if kwargs.get("stream_options", {}).get("include_usage"):
+            chunks.append(_chunk(empty=True, usage=SimpleNamespace(
+                prompt_tokens=5, completion_tokens=len(self._pieces))))
+        self.last_stream = FakeStream(chunks)
+        return self.last_stream
+
+    def _list(self):
+        if not self._healthy:
+            raise ConnectionError("connection refused")
+        return []
+
+
+# ------------------------------------------------------------------ #
+# 全バックエンド共通のテスト
+# ------------------------------------------------------------------ #
+class BackendContract:
+    """サブクラスで make_backend() を実装すると、同じテストが各バックエンドに適用される。"""
+
+    def make_backend(self, healthy=True):
+        raise NotImplementedError
+
+    def _request(self, include_usage=False):
+        return GenerationRequest(
+            action="S", model="m", include_usage=include_usage,
+            messages=[{"role": "user", "content": "テスト入力です"}],
+        )
+
+    def test_stream_yields_text_and_finishes(self):
+        chunks = list(self.make_backend().stream(self._request()))
+        self.assertTrue("".join(c.text for c in chunks))
+        self.assertTrue(all(isinstance(c, backends.StreamChunk) for c in chunks))
+        self.assertEqual([c.finish_reason for c in chunks if c.finish_reason], ["stop"])
+
+    def test_usage_reported_when_requested(self):
+        chunks = list(self.make_backend().stream(self._request(include_usage=True)))
+        usages = [c.usage for c in chunks if c.usage]
+        self.assertTrue(usages)
+        self.assertIsInstance(usages[-1]["prompt_tokens"], int)
+        self.assertIsInstance(usages[-1]["completion_tokens"], int)
+
+    def test_cancel_stops_stream(self):
+        backend = self.make_backend()
+        full = len(list(self.make_backend().stream(self._request())))
+        it = backend.stream(self._request())
+        next(it)
+        backend.cancel()
+        self.assertLess(1 + len(list(it)), full)
+
+    def test_cancel_before_stream(self):
+        backend = self.make_backend()
+        backend.cancel()
+        self.assertEqual(list(backend.stream(self._request())), [])
+
+    def test_health_check(self):
+        status = self.make_backend().health_check()
+        self.assertTrue(status.ok)
+
+
+class TestAzureBackend(BackendContract, unittest.TestCase):
+
+    def make_backend(self, healthy=True):
+        self.client = FakeOpenAIClient(["こん", "にち", "は"] * 5, with_filter_chunk=True,
+                                       healthy=healthy)
+        return backends.OpenAICompatibleBackend("azure", self.client, "deployment")
+
+    def test_generation_parameters_passed(self):
+        backend = self.make_backend()
+        request = self._request(include_usage=True)
+        request.max_tokens, request.temperature = 100, 0.2
+        list(backend.stream(request))
+        self.assertEqual(self.client.last_kwargs["max_tokens"], 100)
+        self.assertEqual(self.client.last_kwargs["temperature"], 0.2)
+        self.assertEqual(self.client.last_kwargs["stream_options"], {"include_usage": True})
+        self.assertTrue(self.client.last_stream.closed)
+
+    def test_health_check_failure(self):
+        status = self.make_backend(healthy=False).health_check()
+        self.assertFalse(status.ok)
+        self.assertIn("ConnectionError", status.detail)
+
+
+class TestLocalBackend(BackendContract, unittest.TestCase):
+
+    def make_backend(self, healthy=True):
+        self.client = FakeOpenAIClient(["Hello", ",", " world", "!"] * 5, healthy=healthy)
+        return backends.OpenAICompatibleBackend("local", self.client, "local-model")
+
+
+@unittest.skipUnless(importlib.util.find_spec("httpx") and importlib.util.find_spec("openai"),
+                     "httpx / openai are not installed")
+class TestSSEBackend(BackendContract, unittest.TestCase):
+
+    PIECES = ["こん", "にち", "は"] * 5
+
+    def _respond(self, request):
+        import httpx
+        body = json.loads(request.content)
+        self.last_body = body
+        events = [{"choices": [], "prompt_filter_results": []}]
+        events += [{"choices": [{"index": 0, "delta": {"content": p}, "finish_reason": None}]}
+                   for p in self.PIECES]
+        events.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if body.get("stream_options", {}).get("include_usage"):
+            events.append({"choices": [], "usage": {"prompt_tokens": 5,
+                                                    "completion_tokens": len(self.PIECES)}})
+        content = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+        return httpx.Response(200, content=content.encode("utf-8"))
+
+    def make_backend(self, healthy=True):
+        import httpx
+        http_client = httpx.Client(transport=httpx.MockTransport(self._respond))
+        self.addCleanup(http_client.close)
+        return sse_stream.SSEBackend(
+            "azure", FakeOpenAIClient([], healthy=healthy), http_client,
+            lambda model: f"https://example.invalid/openai/deployments/{model}/chat/completions",
+            {"api-key": "k"}, "deployment", params={"api-version": "2024-02-01"},
+        )
+
+    def test_generation_parameters_passed(self):
+        request = self._request(include_usage=True)
+        request.max_tokens, request.temperature = 100, 0.2
+        list(self.make_backend().stream(request))
+        self.assertEqual(self.last_body["max_tokens"], 100)
+        self.assertEqual(self.last_body["temperature"], 0.2)
+        self.assertEqual(self.last_body["stream_options"], {"include_usage": True})
+
+    def test_records_wire_payloads(self):
+        import httpx
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        record_dir = tmp.name
+        http_client = httpx.Client(transport=httpx.MockTransport(self._respond))
+        self.addCleanup(http_client.close)
+        backend = sse_stream.SSEBackend(
+            "azure", FakeOpenAIClient([]), http_client, lambda model: "https://example.invalid/chat",
+            {}, "deployment", record_dir=record_dir,
+        )
+        list(backend.stream(self._request()))
+
+        [path] = stream_recorder.list_recordings(record_dir)
+        header, events = stream_recorder.read_recording(path)
+        self.assertEqual(header["payload"], "wire")
+        # 受信した JSON をそのまま残す（SDK が解釈しない prompt_filter_results も含む）
+        self.assertEqual(events[0][1], {"choices": [], "prompt_filter_results": []})
+
+
+class TestDummyBackend(BackendContract, unittest.TestCase):
+
+    def make_backend(self, healthy=True):
+        return backends.DummyBackend(tokens_per_sec=0, first_token_delay=0)
+
+
+class TestReplayBackend(BackendContract, unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        # 代替クライアントのストリームを記録しておき、それを再生する
+        client = FakeOpenAIClient(["記録", "した", "ストリーム"] * 5, with_filter_chunk=True)
+        recording = backends.OpenAICompatibleBackend("azure", client, "m", record_dir=self._tmp.name)
+        self.recorded = list(recording.stream(self._request(include_usage=True)))
+
+    def make_backend(self, healthy=True):
+        return backends.ReplayBackend(self._tmp.name if healthy else "", speed=0)
+
+    def test_replay_matches_recorded_stream(self):
+        self.assertEqual(list(self.make_backend().stream(self._request())), self.recorded)
+
+    def test_replay_speed_scales_timing(self):
+        path = os.path.join(self._tmp.name, "manual.jsonl.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"version": stream_recorder.FORMAT_VERSION}) + "\n")
+            f.write(json.dumps([0.2, {"choices": [{"delta": {"content": "a"}}]}]) + "\n")
+            f.write(json.dumps([0.4, {"choices": [{"delta": {}, "finish_reason": "stop"}]}]) + "\n")
+
+        started = time.perf_counter()
+        chunks = list(backends.ReplayBackend(path, speed=4.0).stream(self._request()))
+        elapsed = time.perf_counter() - started
+        self.assertEqual([c.text for c in chunks], ["a", ""])
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertLess(elapsed, 0.3)
+
+    def test_health_check_without_recordings(self):
+        with tempfile.TemporaryDirectory() as empty:
+            self.assertFalse(backends.ReplayBackend(empty).health_check().ok)
+            missing = os.path.join(empty, "missing.jsonl.gz")
+            self.assertFalse(backends.ReplayBackend(missing).health_check().ok)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import codecs
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import file_reader
+from actions import ActionSpec
+from file_reader import TextFile, detect_encoding
+
+
+class DetectEncodingTest(unittest.TestCase):
+
+    def test_bom(self):
+        self.assertEqual(detect_encoding(codecs.BOM_UTF8 + b"abc"), ("utf-8", 3))
+        self.assertEqual(detect_encoding(codecs.BOM_UTF16_LE + "abc".encode("utf-16-le")), ("utf-16-le", 2))
+
+    def test_utf16_without_bom(self):
+        self.assertEqual(detect_encoding("hello world".encode("utf-16-le"))[0], "utf-16-le")
+        self.assertEqual(detect_encoding("hello world".encode("utf-16-be"))[0], "utf-16-be")
+
+    def test_utf8_cut_in_the_middle_of_a_character(self):
+        data = "日本語のテキスト".encode("utf-8")[:-1]
+        self.assertEqual(detect_encoding(data), ("utf-8", 0))
+
+    def test_cp932(self):
+        self.assertEqual(detect_encoding("日本語のテキスト".encode("cp932")), ("cp932", 0))
+
+    def test_binary_is_rejected(self):
+        with self.assertRaises(ValueError):
+            detect_encoding(b"\x89PNG\r\n\x1a\n" + b"".join(i.to_bytes(4, "little") for i in range(1000)))
+        # UTF-16 の NUL は許容する
+        self.assertEqual(detect_encoding("abc".encode("utf-16-le") * 100)[0], "utf-16-le")
+
+
+class TextFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, data: bytes) -> TextFile:
+        path = os.path.join(self._dir.name, "input.txt")
+        with open(path, "wb") as f:
+            f.write(data)
+        return TextFile(path)
+
+    def test_crlf_split_across_blocks(self):
+        text = "一行目\r\n二行目\r\n三行目\r\n"
+        source = self._write(text.encode("cp932"))
+        # ブロックを小さくして、"\r\n" やマルチバイト文字がブロックの境目で分かれるようにする
+        for block_size in range(1, 8):
+            joined = "".join(source.iter_text(block_size=block_size))
+            self.assertEqual(joined, "一行目\n二行目\n三行目\n", block_size)
+
+    def test_cp932_after_sniffed_range_falls_back(self):
+        head = "ascii だけでなく UTF-8 の行\n".encode("utf-8")
+        head *= file_reader._SNIFF_SIZE // len(head) + 1
+        source = self._write(head + "ここから Shift_JIS\n".encode("cp932"))
+        self.assertEqual(source.encoding, "utf-8")
+        # ブロックの境目がどこにあっても、UTF-8 の部分と cp932 の部分の両方を読める
+        for block_size in (7, 4096, file_reader.BLOCK_SIZE):
+            joined = "".join(source.iter_text(block_size=block_size))
+            self.assertEqual(joined, head.decode("utf-8") + "ここから Shift_JIS\n", block_size)
+
+    def test_bom_is_skipped(self):
+        source = self._write(codecs.BOM_UTF16_LE + "abc".encode("utf-16-le"))
+        self.assertEqual("".join(source.iter_text()), "abc")
+
+    def test_empty_file(self):
+        source = self._write(b"")
+        self.assertEqual(list(source.iter_text()), [])
+        self.assertEqual(source.measure(100), (0, 0))
+
+    def test_chunks_cover_whole_file(self):
+        paragraphs = [f"段落{i}の本文です。" * 20 for i in range(30)]
+        source = self._write("\n\n".join(paragraphs).encode("utf-8"))
+        chunks = list(source.iter_chunks(200, block_size=512))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks).replace("\n", ""), "".join(paragraphs))
+        self.assertEqual(source.measure(200)[0], len(list(source.iter_chunks(200))))
+
+    def test_plan_file(self):
+        source = self._write(("あいうえお" * 200 + "\n\n").encode("utf-8") * 10)
+        count = source.measure(300)[0]
+
+        chunked = ActionSpec("S", "要約", max_input_tokens=300, overflow="chunk").plan_file(source)
+        self.assertEqual(chunked.mode, "chunked")
+        self.assertEqual(chunked.count, count)
+        self.assertEqual(len(list(chunked.chunks)), count)
+
+        limited = ActionSpec("S", "要約", max_input_tokens=300, overflow="chunk").plan_file(source, max_chunks=2)
+        self.assertEqual(len(list(limited.chunks)), 2)
+
+        truncated = ActionSpec("T", "翻訳", max_input_tokens=300, overflow="truncate").plan_file(source)
+        self.assertEqual(truncated.mode, "truncated")
+        self.assertEqual(len(list(truncated.chunks)), 1)
+
+    def test_format_size(self):
+        self.assertEqual(file_reader.format_size(512), "512 B")
+        self.assertEqual(file_reader.format_size(1536), "1.5 KB")
+
+
+if __name__ == "__main__":
+    unittest.main()
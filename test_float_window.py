@@ -0,0 +1,85 @@
+import importlib.util
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+_HAS_QT = importlib.util.find_spec("PyQt6") is not None
+
+if _HAS_QT:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtCore import QThread, pyqtSignal
+    from PyQt6.QtWidgets import QApplication
+
+    import float_window
+
+    class FakeWorker(QThread):
+        """cancel() されるか release がセットされるまで応答を返さない ApiWorker の代わり。"""
+
+        chunk_received = pyqtSignal(str)
+        result_ready   = pyqtSignal(str)
+        error_occurred = pyqtSignal(str)
+
+        created: list["FakeWorker"] = []
+
+        def __init__(self, button_key, user_text, history=None, parent=None, source=None):
+            super().__init__(parent)
+            self.user_text = user_text
+            self.release = threading.Event()
+            self.cancelled = False
+            FakeWorker.created.append(self)
+
+        def cancel(self):
+            self.cancelled = True
+            self.release.set()
+
+        def run(self):
+            self.release.wait(5)
+            if not self.cancelled:
+                self.result_ready.emit(f"answer: {self.user_text}")
+
+
+@unittest.skipUnless(_HAS_QT, "PyQt6 が必要です")
+class TestFloatWindowWorkers(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QApplication.instance() or QApplication([])
+
+    def setUp(self):
+        FakeWorker.created.clear()
+        patcher = patch.object(float_window, "ApiWorker", FakeWorker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.window = float_window.FloatWindow()
+        self.addCleanup(self.window.deleteLater)
+
+    def _settle(self, worker):
+        worker.wait(5000)
+        self.app.processEvents()
+
+    def test_second_click_keeps_window_busy(self):
+        self.window._input_area.setPlainText("first")
+        self.window._on_button_clicked("S")
+        self.window._input_area.setPlainText("second")
+        self.window._on_button_clicked("S")
+        first, second = FakeWorker.created
+
+        # 中断した 1 回目のワーカーが終わっても、2 回目の処理中のまま
+        self._settle(first)
+        self.assertTrue(first.cancelled)
+        self.assertTrue(self.window.is_busy())
+        self.assertFalse(any(b.isEnabled() for b in self.window._buttons))
+
+        second.release.set()
+        self._settle(second)
+        self.assertFalse(self.window.is_busy())
+        self.assertEqual(self.window._result_area.toPlainText(), "answer: second")
+        self.assertEqual(self.window._retired_workers, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
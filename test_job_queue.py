@@ -0,0 +1,151 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import job_queue
+from job_queue import JobQueue, JobStore
+
+
+class FakeRunner:
+
+    def __init__(self, action, text, order):
+        self._action, self._text, self._order = action, text, order
+        self.cancelled = False
+
+    def run(self):
+        self._order.append(self._text)
+        if self._action == "X":
+            raise RuntimeError("boom")
+        return self._text.upper()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class BlockingRunner:
+    """cancel() されるまで待ち、閉じられたストリームのように例外を送出する。"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self._cancel = threading.Event()
+        self.cancelled = False
+
+    def run(self):
+        self.started.set()
+        self._cancel.wait(5)
+        raise ConnectionError("stream closed")
+
+    def cancel(self):
+        self.cancelled = True
+        self._cancel.set()
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def _run_all(self, store, count):
+        order, done = [], []
+        finished = threading.Semaphore(0)
+
+        def on_finished(job):
+            done.append(job)
+            finished.release()
+
+        queue = JobQueue(store, workers=1, on_finished=on_finished,
+                         runner_factory=lambda a, t: FakeRunner(a, t, order))
+        queue.start()
+        try:
+            for _ in range(count):
+                self.assertTrue(finished.acquire(timeout=5))
+        finally:
+            queue.stop()
+        return order, done
+
+    def test_priority_order_and_results(self):
+        store = JobStore("")
+        store.add("S", "low-1")
+        store.add("S", "high", job_queue.PRIORITY_HIGH)
+        store.add("X", "fails")
+        order, done = self._run_all(store, 3)
+
+        self.assertEqual(order, ["high", "low-1", "fails"])
+        by_text = {j.text: j for j in done}
+        self.assertEqual(by_text["high"].status, job_queue.STATUS_DONE)
+        self.assertEqual(store.get(by_text["high"].id).result, "HIGH")
+        self.assertEqual(by_text["fails"].status, job_queue.STATUS_FAILED)
+        self.assertIn("boom", store.get(by_text["fails"].id).error)
+        self.assertEqual(store.pending_count(), 0)
+
+    def test_running_jobs_resume_after_restart(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "jobs.sqlite3")
+            store = JobStore(path)
+            job = store.add("S", "interrupted")
+            self.assertEqual(store.claim_next().id, job.id)
+            store.close()
+
+            reopened = JobStore(path)
+            self.assertEqual(reopened.get(job.id).status, job_queue.STATUS_QUEUED)
+            order, _ = self._run_all(reopened, 1)
+            self.assertEqual(order, ["interrupted"])
+            reopened.close()
+
+    def test_job_interrupted_by_stop_is_requeued(self):
+        store = JobStore("")
+        job = store.add("S", "long")
+        runner = BlockingRunner()
+        finished = []
+        queue = JobQueue(store, workers=1, on_finished=finished.append,
+                         runner_factory=lambda a, t: runner)
+        queue.start()
+        self.assertTrue(runner.started.wait(5))
+        queue.stop()
+
+        self.assertEqual(finished, [])
+        self.assertEqual(store.get(job.id).status, job_queue.STATUS_QUEUED)
+
+    def test_runner_factory_error_fails_job(self):
+        store = JobStore("")
+        bad = store.add("?", "unknown action")
+        good = store.add("S", "next")
+        order, done = [], []
+        finished = threading.Semaphore(0)
+
+        def factory(action, text):
+            if action == "?":
+                raise KeyError(action)
+            return FakeRunner(action, text, order)
+
+        def on_finished(job):
+            done.append(job)
+            finished.release()
+
+        queue = JobQueue(store, workers=1, on_finished=on_finished, runner_factory=factory)
+        queue.start()
+        try:
+            for _ in range(2):
+                self.assertTrue(finished.acquire(timeout=5))
+        finally:
+            queue.stop()
+
+        # ワーカースレッドは止まらず、ジョブは RUNNING のまま残らない
+        self.assertEqual(store.get(bad.id).status, job_queue.STATUS_FAILED)
+        self.assertIn("KeyError", store.get(bad.id).error)
+        self.assertEqual(store.get(good.id).status, job_queue.STATUS_DONE)
+
+    def test_prune_keeps_recent_finished_jobs(self):
+        store = JobStore("")
+        ids = [store.add("S", str(i)).id for i in range(5)]
+        for job_id in ids[:4]:
+            store.finish(job_id, job_queue.STATUS_DONE, "r")
+        store.prune(2)
+        remaining = sorted(j.id for j in store.recent(10))
+        self.assertEqual(remaining, [ids[2], ids[3], ids[4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
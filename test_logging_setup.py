@@ -0,0 +1,80 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import config
+import logging_setup
+from logging_setup import parse_module_levels, redact
+
+
+class TestRedact(unittest.TestCase):
+
+    def test_length_only_by_default(self):
+        with patch.object(config, "LOG_CLIPBOARD_CONTENT", False):
+            self.assertEqual(str(redact("秘密のテキスト")), "<7 文字 非表示>")
+
+    def test_preview_when_enabled(self):
+        with patch.object(config, "LOG_CLIPBOARD_CONTENT", True):
+            self.assertEqual(str(redact("abcdef", preview=3)), repr("abc"))
+
+
+class TestLevels(unittest.TestCase):
+
+    def test_parse_module_levels(self):
+        levels = parse_module_levels(" api=debug , hotkey=OFF,, ")
+        self.assertEqual(levels, {"popai.api": logging.DEBUG, "popai.hotkey": logging.CRITICAL + 1})
+
+    def test_invalid_level(self):
+        with self.assertRaises(ValueError):
+            parse_module_levels("api=LOUD")
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, "popai.log")
+        root = logging.getLogger(logging_setup.ROOT_LOGGER)
+        saved = (list(root.handlers), root.level, root.propagate)
+
+        def restore():
+            logging_setup.shutdown_logging()
+            root.handlers[:] = saved[0]
+            root.setLevel(saved[1])
+            root.propagate = saved[2]
+            logging.getLogger("popai.test").setLevel(logging.NOTSET)
+            self._dir.cleanup()
+
+        self.addCleanup(restore)
+        patcher = patch.multiple(
+            config, LOG_CONSOLE=False, LOG_FILE=self.path, LOG_FORMAT="text",
+            LOG_LEVEL="INFO", LOG_MODULE_LEVELS="test=WARNING",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_records_reach_file_through_listener(self):
+        logging_setup.setup_logging()
+        for handler in logging_setup._listener.handlers:
+            self.addCleanup(handler.close)
+        logger = logging.getLogger("popai.test")
+        context = {"session": 1}
+        logger.warning("context=%s", context)
+        # 整形はリスナースレッドで後から行われるが、ログ時点の値が出力される
+        context["session"] = 2
+        logger.info("module level filters this out")
+        logging_setup.shutdown_logging()
+
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn("context={'session': 1}", lines[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
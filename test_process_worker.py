@@ -0,0 +1,101 @@
+import importlib.machinery
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import process_worker
+from process_worker import ProcessEngine, RemoteActionRunner, WorkerCrashedError
+
+
+class FakeRunner:
+    """子プロセスで ActionRunner の代わりに使う。user_text を 1 文字ずつ返す。"""
+
+    def __init__(self, payload, on_chunk, on_usage):
+        self._text = payload["user_text"]
+        self._on_chunk = on_chunk
+        self.cancelled = False
+
+    def run(self):
+        if self._text.startswith("crash:"):
+            marker = self._text[len("crash:"):]
+            # 1 回目だけ、何も送らずにプロセスごと落ちる
+            if not os.path.exists(marker):
+                open(marker, "w").close()
+                os._exit(1)
+        for ch in self._text:
+            self._on_chunk(ch)
+        return self._text
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class ChildWorkerTest(unittest.TestCase):
+
+    def test_chunks_are_batched_and_flushed_before_done(self):
+        parent, child = multiprocessing.Pipe()
+        worker = process_worker._ChildWorker(child, flush_interval=10.0, runner_factory=FakeRunner)
+        thread = threading.Thread(target=worker.serve, daemon=True)
+        thread.start()
+
+        text = "あいうえお" * 100
+        parent.send(("run", 1, {"button_key": "T", "user_text": text}))
+        messages = []
+        while not messages or messages[-1][0] != "done":
+            messages.append(parent.recv())
+        parent.send(("stop",))
+        thread.join(2)
+
+        chunks = [m for m in messages if m[0] == "chunks"]
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0][1], {1: text})
+        self.assertEqual(messages[-1], ("done", 1, True))
+
+
+# 子プロセスは dotenv のモックを引き継がず、config を実際に読み込む
+@unittest.skipUnless(importlib.machinery.PathFinder.find_spec("dotenv"), "python-dotenv is not installed")
+class ProcessEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.engine = ProcessEngine(0.01, runner_factory=FakeRunner)
+        # 予算の確認は実際の使用量ファイルを読むため差し替える
+        self._budget = patch("action_runner.check_budget", return_value="ok")
+        self._budget.start()
+
+    def tearDown(self):
+        self._budget.stop()
+        self.engine.stop()
+        self._dir.cleanup()
+
+    def test_stream_roundtrip(self):
+        received = []
+        runner = RemoteActionRunner("T", "hello world", on_chunk=received.append, engine=self.engine)
+        self.assertEqual(runner.run(), "hello world")
+        self.assertEqual("".join(received), "hello world")
+
+    def test_crash_before_first_chunk_is_resubmitted(self):
+        marker = os.path.join(self._dir.name, "crashed")
+        runner = RemoteActionRunner("T", f"crash:{marker}", engine=self.engine)
+        self.assertEqual(runner.run(), f"crash:{marker}")
+        self.assertEqual(self.engine.restarts, 1)
+
+        # 再起動後のプロセスでもそのまま使える
+        self.assertEqual(RemoteActionRunner("T", "again", engine=self.engine).run(), "again")
+
+    def test_crash_after_retry_is_reported(self):
+        with patch.object(process_worker, "_MAX_RESUBMITS", 0):
+            marker = os.path.join(self._dir.name, "crashed")
+            runner = RemoteActionRunner("T", f"crash:{marker}", engine=self.engine)
+            with self.assertRaises(WorkerCrashedError):
+                runner.run()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import profiling
+
+
+def _busy_worker_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_samples_other_threads_and_dumps(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=_busy_worker_loop, args=(stop,), name="BusyWorker")
+        worker.start()
+        profiler = profiling.SamplingProfiler(interval=0.001)
+        try:
+            profiler.start()
+            self.assertTrue(profiler.running)
+            time.sleep(0.2)
+            samples = profiler.stop()
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertFalse(profiler.running)
+        worker_stacks = [s for s in samples if s[0] == "BusyWorker"]
+        self.assertTrue(worker_stacks)
+        self.assertTrue(any("_busy_worker_loop" in s[-1] or "_busy_worker_loop" in s[-2]
+                            for s in worker_stacks))
+        # プロファイラ自身のスレッドは含めない
+        self.assertFalse([s for s in samples if s[0] == "PopAI-profiler"])
+
+        with tempfile.TemporaryDirectory() as d:
+            collapsed, summary = profiler.dump(samples, d)
+            with open(collapsed, encoding="utf-8") as f:
+                line = f.readline().rstrip("\n")
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            self.assertIn(";", stack)
+            with open(summary, encoding="utf-8") as f:
+                self.assertIn("BusyWorker", f.read())
+
+    def test_stop_without_start(self):
+        self.assertEqual(profiling.SamplingProfiler().stop(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import backends
+import prompt_builder
+
+
+class TestBuildMessages(unittest.TestCase):
+
+    def test_stable_parts_come_first(self):
+        history = [{"role": "user", "content": "q1"}, {"role": "assistant", "content": "a1"}]
+        first = prompt_builder.build_messages("指示", "q2", history, context="用語集")
+        self.assertEqual([m["role"] for m in first], ["system", "user", "assistant", "user"])
+        self.assertTrue(first[0]["content"].startswith("指示"))
+        self.assertIn("用語集", first[0]["content"])
+        self.assertEqual(first[-1]["content"], "q2")
+
+        # 入力が変わっても、それより前の部分は完全に一致する（プロンプトキャッシュの前提）
+        second = prompt_builder.build_messages("指示", "別の質問", history, context="用語集")
+        self.assertEqual(first[:-1], second[:-1])
+
+    def test_without_system_prompt(self):
+        self.assertEqual(prompt_builder.build_messages("", "hi", context=""),
+                         [{"role": "user", "content": "hi"}])
+        messages = prompt_builder.build_messages("", "hi", context="ctx")
+        self.assertEqual(messages[0], {"role": "system", "content": "ctx"})
+
+
+class TestCachedTokens(unittest.TestCase):
+
+    def test_chunk_from_payload_reads_cached_tokens(self):
+        chunk = backends.chunk_from_payload({"choices": [], "usage": {
+            "prompt_tokens": 2048, "completion_tokens": 5,
+            "prompt_tokens_details": {"cached_tokens": 1024},
+        }})
+        self.assertEqual(chunk.usage["cached_tokens"], 1024)
+
+        chunk = backends.chunk_from_payload({"choices": [], "usage": {
+            "prompt_tokens": 10, "completion_tokens": 5,
+        }})
+        self.assertEqual(chunk.usage["cached_tokens"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
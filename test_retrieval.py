@@ -0,0 +1,164 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import prompt_builder
+import retrieval
+
+
+def _write(path, text, mtime_offset=0.0):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime_offset:
+        t = time.time() + mtime_offset
+        os.utime(path, (t, t))
+
+
+class CountingProvider(retrieval.HashingEmbeddingProvider):
+
+    def __init__(self):
+        super().__init__(dim=128)
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded += texts
+        return super().embed(texts)
+
+
+class BlockingProvider(CountingProvider):
+    """block_on を含む埋め込みを、release がセットされるまで止める（通信中の代わり）。"""
+
+    def __init__(self, block_on):
+        super().__init__()
+        self.block_on = block_on
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def embed(self, texts):
+        if self.block_on in texts:
+            self.entered.set()
+            self.release.wait(5)
+        return super().embed(texts)
+
+
+@unittest.skipUnless(numpy, "numpy が必要です")
+class TestDocumentIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.docs = os.path.join(self._tmp.name, "docs")
+        self.index_dir = os.path.join(self._tmp.name, "index")
+        os.makedirs(os.path.join(self.docs, "sub"))
+        _write(os.path.join(self.docs, "vpn.md"), "VPN の接続手順: 社内ポータルから証明書をダウンロードする。")
+        _write(os.path.join(self.docs, "sub", "expense.txt"), "経費精算は月末までに申請システムで提出する。")
+        _write(os.path.join(self.docs, "ignored.pdf"), "binary")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_search_ranks_relevant_passage_first(self):
+        index = retrieval.DocumentIndex(self.docs, self.index_dir, CountingProvider())
+        self.assertTrue(index.refresh())
+        self.assertEqual(index.size, 2)
+
+        results = index.search("経費精算の申請方法", k=2)
+        self.assertEqual(results[0].source, "sub/expense.txt")
+        self.assertGreater(results[0].score, results[1].score)
+
+    def test_incremental_refresh_and_reload(self):
+        provider = CountingProvider()
+        index = retrieval.DocumentIndex(self.docs, self.index_dir, provider)
+        index.refresh()
+        self.assertEqual(len(provider.embedded), 2)
+        self.assertFalse(index.refresh())
+
+        # 変更したファイルだけを埋め込み直し、削除したファイルの段落は消える
+        _write(os.path.join(self.docs, "vpn.md"), "VPN は廃止されました。", mtime_offset=10)
+        os.remove(os.path.join(self.docs, "sub", "expense.txt"))
+        provider.embedded.clear()
+        self.assertTrue(index.refresh())
+        self.assertEqual(provider.embedded, ["VPN は廃止されました。"])
+        self.assertEqual(index.size, 1)
+
+        # 保存したインデックスを mmap で開き直せる
+        reopened = retrieval.DocumentIndex(self.docs, self.index_dir, CountingProvider())
+        self.assertEqual(reopened.size, 1)
+        self.assertIsInstance(reopened._matrix, numpy.memmap)
+        self.assertFalse(reopened.refresh())
+        self.assertEqual(reopened.search("VPN", k=3)[0].text, "VPN は廃止されました。")
+        npy_files = [n for n in os.listdir(self.index_dir) if n.endswith(".npy")]
+        self.assertEqual(len(npy_files), 1)
+
+    def test_search_not_blocked_while_embedding(self):
+        provider = BlockingProvider("VPN は廃止されました。")
+        index = retrieval.DocumentIndex(self.docs, self.index_dir, provider)
+        index.refresh()
+        _write(os.path.join(self.docs, "vpn.md"), "VPN は廃止されました。", mtime_offset=10)
+
+        worker = threading.Thread(target=index.refresh)
+        worker.start()
+        try:
+            self.assertTrue(provider.entered.wait(5))
+            # 埋め込みの間も古いインデックスで検索でき、間隔付きの更新は実行中の更新を待たない
+            self.assertFalse(index.refresh(min_interval=60))
+            self.assertEqual(index.search("経費精算", k=1)[0].source, "sub/expense.txt")
+            self.assertEqual(index.search("VPN", k=1)[0].text,
+                             "VPN の接続手順: 社内ポータルから証明書をダウンロードする。")
+        finally:
+            provider.release.set()
+            worker.join(5)
+        self.assertEqual(index.search("VPN", k=1)[0].text, "VPN は廃止されました。")
+
+    def test_documents_use_file_reader_decoding(self):
+        with open(os.path.join(self.docs, "sjis.txt"), "wb") as f:
+            f.write("勤怠の締め日は毎月 25 日です。".encode("cp932"))
+        with open(os.path.join(self.docs, "binary.txt"), "wb") as f:
+            f.write(b"".join(i.to_bytes(4, "little") for i in range(1000)))
+
+        index = retrieval.DocumentIndex(self.docs, self.index_dir, CountingProvider())
+        index.refresh()
+        texts = [p.text for p in index.search("勤怠の締め日", k=5)]
+        self.assertEqual(texts[0], "勤怠の締め日は毎月 25 日です。")
+        self.assertEqual(index.size, 3)     # バイナリは入れない
+
+    def test_retrieve_does_not_refresh_in_request_path(self):
+        index = MagicMock()
+        with patch.object(retrieval, "get_index", return_value=index), \
+                patch.object(retrieval, "refresh_in_background") as background:
+            retrieval.retrieve("質問")
+        background.assert_called_once_with()
+        index.refresh.assert_not_called()
+        index.search.assert_called_once()
+
+    def test_provider_change_rebuilds(self):
+        retrieval.DocumentIndex(self.docs, self.index_dir, CountingProvider()).refresh()
+        other = retrieval.HashingEmbeddingProvider(dim=64)
+        index = retrieval.DocumentIndex(self.docs, self.index_dir, other)
+        self.assertEqual(index.size, 0)
+        self.assertTrue(index.refresh())
+        self.assertEqual(index.size, 2)
+
+
+class TestReferencesInPrompt(unittest.TestCase):
+
+    def test_references_go_before_user_text(self):
+        messages = prompt_builder.build_messages(
+            "指示", "質問です", context="", references=[("a.md", "抜粋")])
+        self.assertEqual(messages[0], {"role": "system", "content": "指示"})
+        content = messages[-1]["content"]
+        self.assertLess(content.index("[1] a.md"), content.index("質問です"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+
+class StubWindow:
+    """FloatWindow の代わり。SessionManager が使う属性だけを持つ。"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.visible = False
+        self.busy = False
+        self.background_requested = MagicMock()
+        self.shown: list[tuple[str, int]] = []
+
+    def isVisible(self):
+        return self.visible
+
+    def is_busy(self):
+        return self.busy
+
+    def show_with_text(self, text, offset=0):
+        self.visible = True
+        self.shown.append((text, offset))
+
+    def request_info(self):
+        return {"session": self.session_id}
+
+
+# float_window は Qt を読み込むため、テスト中だけ差し替えてから import する
+_modules = patch.dict(sys.modules, {"float_window": types.SimpleNamespace(FloatWindow=StubWindow)})
+session_manager = None
+
+
+def setUpModule():
+    global session_manager
+    _modules.start()
+    sys.modules.pop("session_manager", None)
+    import session_manager as module
+    session_manager = module
+
+
+def tearDownModule():
+    _modules.stop()
+
+
+class TestSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.on_background = MagicMock()
+        self.manager = session_manager.SessionManager(3, on_background=self.on_background)
+
+    def _open_all(self):
+        return [self.manager.open(f"text{i}") for i in range(3)]
+
+    def test_new_windows_until_limit(self):
+        windows = self._open_all()
+        self.assertEqual([w.session_id for w in windows], [1, 2, 3])
+        # 表示中のウィンドウ数だけずらして表示する
+        self.assertEqual([w.shown[-1][1] for w in windows],
+                         [0, session_manager.CASCADE_OFFSET, 2 * session_manager.CASCADE_OFFSET])
+        for window in windows:
+            window.background_requested.connect.assert_called_once_with(self.on_background)
+
+    def test_prefers_hidden_idle_window_over_new(self):
+        first = self.manager.open("a")
+        first.visible = False
+        self.assertIs(self.manager.open("b"), first)
+
+    def test_hidden_busy_window_is_not_reused(self):
+        first = self.manager.open("a")
+        first.visible, first.busy = False, True
+        second = self.manager.open("b")
+        self.assertIsNot(second, first)
+        self.assertEqual(second.session_id, 2)
+
+    def test_reuses_oldest_visible_idle_window_at_limit(self):
+        windows = self._open_all()
+        self.manager.open("again")      # windows[0] が最も古い
+        self.assertEqual(windows[0].shown[-1][0], "again")
+        self.assertIs(self.manager.open("next"), windows[1])
+
+    def test_returns_none_when_all_busy_at_limit(self):
+        for window in self._open_all():
+            window.busy = True
+        self.assertIsNone(self.manager.open("x"))
+
+    def test_next_session_id_fills_gap(self):
+        windows = self._open_all()
+        self.manager._windows.remove(windows[1])
+        self.assertEqual(self.manager._next_session_id(), 2)
+
+    def test_request_info_lists_busy_sessions(self):
+        windows = self._open_all()
+        windows[2].busy = True
+        self.assertEqual(self.manager.request_info(), {"sessions": [{"session": 3}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import sys
+import threading
+import traceback
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import backends
+from singleflight import SingleFlight, SingleFlightBackend
+
+
+class GatedBackend:
+    """gate を 1 回 release するごとに 1 チャンク流すテスト用バックエンド。"""
+
+    name = "gated"
+    default_model = "m"
+
+    def __init__(self, pieces):
+        self._pieces = pieces
+        self.gate = threading.Semaphore(0)
+        self.started = 0
+        self.cancelled = threading.Event()
+
+    def stream(self, request):
+        self.started += 1
+        self.thread = threading.current_thread()
+        for piece in self._pieces:
+            while not self.gate.acquire(timeout=0.01):
+                if self.cancelled.is_set():
+                    return
+            yield backends.StreamChunk(piece)
+        yield backends.StreamChunk(finish_reason="stop", usage={"prompt_tokens": 1, "completion_tokens": 2})
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def health_check(self):
+        return backends.HealthStatus(True, "ok")
+
+
+def _request(text="hello"):
+    return backends.GenerationRequest(action="S", messages=[{"role": "user", "content": text}], model="m")
+
+
+def _collect(stream, out, started=None):
+    for chunk in stream:
+        out.append(chunk.text)
+        if started is not None:
+            started.set()
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_late_joiner_gets_buffered_prefix(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a", "b", "c"])
+        first, second = SingleFlightBackend(upstream, group), SingleFlightBackend(upstream, group)
+        out1, out2 = [], []
+        got_first = threading.Event()
+
+        t1 = threading.Thread(target=_collect, args=(first.stream(_request()), out1, got_first))
+        t1.start()
+        upstream.gate.release()
+        self.assertTrue(got_first.wait(2))
+
+        # 1 チャンク受信済みの状態で同じリクエストを送ると、既存の上流に相乗りする
+        t2 = threading.Thread(target=_collect, args=(second.stream(_request()), out2))
+        t2.start()
+        upstream.gate.release()
+        upstream.gate.release()
+        t1.join(2)
+        t2.join(2)
+
+        self.assertEqual(upstream.started, 1)
+        self.assertEqual("".join(out1), "abc")
+        self.assertEqual("".join(out2), "abc")
+        # 使用量を記録するのはどちらか 1 人だけ
+        self.assertEqual(sorted([first.owns_usage, second.owns_usage]), [False, True])
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_upstream_cancelled_only_when_last_subscriber_leaves(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a", "b"])
+        subs = [group.subscribe(upstream, _request()) for _ in range(2)]
+        self.assertEqual([s.joined for s in subs], [False, True])
+
+        subs[0].cancel()
+        self.assertFalse(upstream.cancelled.is_set())
+        subs[1].cancel()
+        self.assertTrue(upstream.cancelled.wait(1))
+        self.assertEqual(group.in_flight(), 0)
+
+        # 中断後の同じリクエストは新しい上流を開始する
+        fresh = GatedBackend(["x"])
+        fresh.gate.release()
+        self.assertEqual([c.text for c in group.subscribe(fresh, _request())], ["x", ""])
+
+    def test_last_cancelled_subscriber_owns_usage(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a", "b"])
+        first, second = SingleFlightBackend(upstream, group), SingleFlightBackend(upstream, group)
+        streams = [first.stream(_request()), second.stream(_request())]
+        upstream.gate.release()
+        self.assertEqual([next(s).text for s in streams], ["a", "a"])
+
+        # 全員が途中で抜けた場合は、上流を中断した最後の 1 人だけが使用量を記録する
+        first.cancel()
+        self.assertEqual(list(streams[0]), [])
+        second.cancel()
+        self.assertEqual(list(streams[1]), [])
+        self.assertEqual([first.owns_usage, second.owns_usage], [False, True])
+
+    def test_different_text_does_not_share(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a"])
+        a = group.subscribe(upstream, _request("one"))
+        b = group.subscribe(upstream, _request("two"))
+        self.assertFalse(b.joined)
+        self.assertEqual(group.in_flight(), 2)
+        a.cancel()
+        b.cancel()
+
+    def test_upstream_error_reaches_all_subscribers(self):
+        class FailingBackend(GatedBackend):
+            def stream(self, request):
+                yield backends.StreamChunk("partial")
+                raise RuntimeError("upstream failed")
+
+        group = SingleFlight()
+        upstream = FailingBackend([])
+        depths = []
+        for sub in [group.subscribe(upstream, _request()) for _ in range(2)]:
+            try:
+                list(sub)
+            except RuntimeError as e:
+                depths.append(len(traceback.extract_tb(e.__traceback__)))
+        self.assertEqual(len(depths), 2)
+        # 2 人目の例外に 1 人目のフレームが積み重ならない
+        self.assertEqual(depths[0], depths[1])
+
+    def test_single_subscriber_reads_upstream_inline(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a", "b"])
+        for _ in range(2):
+            upstream.gate.release()
+        threads = threading.active_count()
+        chunks = list(SingleFlightBackend(upstream, group).stream(_request()))
+
+        # 専用スレッドを作らず、呼び出したスレッドで上流を読む
+        self.assertEqual([c.text for c in chunks], ["a", "b", ""])
+        self.assertIs(upstream.thread, threading.current_thread())
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(group.in_flight(), 0)
+
+    def test_joiner_continues_after_leader_leaves(self):
+        group = SingleFlight()
+        upstream = GatedBackend(["a", "b"])
+        leader, follower = group.subscribe(upstream, _request()), group.subscribe(upstream, _request())
+        upstream.gate.release()
+        leader_iter = iter(leader)
+        self.assertEqual(next(leader_iter).text, "a")
+
+        # 上流を読んでいた購読者が抜けても、残った購読者が続きを読む
+        leader.cancel()
+        self.assertEqual(list(leader_iter), [])
+        self.assertFalse(upstream.cancelled.is_set())
+        upstream.gate.release()
+        self.assertEqual([c.text for c in follower], ["a", "b", ""])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import importlib.util
+import json
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import backends
+import sse_stream
+from sse_stream import iter_events, parse_chunk
+
+
+def _sse(*payloads) -> bytes:
+    return b"".join(b"data: " + json.dumps(p).encode() + b"\n\n" for p in payloads) + b"data: [DONE]\n\n"
+
+
+def _delta(content=None, finish_reason=None) -> dict:
+    delta = {"content": content} if content is not None else {}
+    return {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+
+class SSEParseTest(unittest.TestCase):
+
+    def test_iter_events(self):
+        lines = [
+            ": keep-alive", "",
+            "data: {\"a\": 1}", "",
+            "event: message", "data:{\"b\":", "data: 2}", "",
+            "data: [DONE]", "",
+            "data: {\"ignored\": true}", "",
+        ]
+        self.assertEqual(list(iter_events(lines)), ['{"a": 1}', '{"b":\n2}'])
+
+    def test_last_event_without_blank_line(self):
+        self.assertEqual(list(iter_events(["data: {}"])), ["{}"])
+
+    def test_parse_chunk_matches_sdk_rules(self):
+        self.assertEqual(parse_chunk(json.dumps(_delta("こん")))[1], backends.StreamChunk("こん"))
+        self.assertEqual(parse_chunk(json.dumps(_delta(None, "stop")))[1].finish_reason, "stop")
+        # role だけのデルタや、Azure のプロンプトフィルタ結果（choices が空）は捨てる
+        self.assertIsNone(parse_chunk(json.dumps({"choices": [{"delta": {"role": "assistant"}}]}))[1])
+        self.assertIsNone(parse_chunk(json.dumps({"choices": [], "prompt_filter_results": []}))[1])
+
+        usage = {"choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 3,
+                                          "prompt_tokens_details": {"cached_tokens": 8}}}
+        self.assertEqual(parse_chunk(json.dumps(usage))[1].usage,
+                         {"prompt_tokens": 10, "completion_tokens": 3, "cached_tokens": 8})
+
+
+@unittest.skipUnless(importlib.util.find_spec("httpx") and importlib.util.find_spec("openai"),
+                     "httpx / openai are not installed")
+class SSEBackendTest(unittest.TestCase):
+
+    def _backend(self, handler):
+        import httpx
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        return sse_stream.SSEBackend("local", MagicMock(), client,
+                                     lambda model: "http://test/v1/chat/completions",
+                                     {"Authorization": "Bearer x"}, "m")
+
+    def _request(self):
+        return backends.GenerationRequest(action="S", messages=[], model="m")
+
+    def test_stream(self):
+        import httpx
+        body = _sse(_delta("a"), _delta("b"), _delta(None, "stop"))
+        backend = self._backend(lambda request: httpx.Response(200, content=body))
+        chunks = list(backend.stream(self._request()))
+        self.assertEqual("".join(c.text for c in chunks), "ab")
+        self.assertEqual(chunks[-1].finish_reason, "stop")
+
+    def test_status_errors_use_sdk_classes(self):
+        import httpx
+        import openai
+        backend = self._backend(lambda request: httpx.Response(401, json={"error": {"message": "bad key"}}))
+        with self.assertRaises(openai.AuthenticationError) as ctx:
+            list(backend.stream(self._request()))
+        self.assertEqual(ctx.exception.body, {"message": "bad key"})
+
+    def test_rate_limit_is_retried(self):
+        import httpx
+        responses = [httpx.Response(429, headers={"retry-after": "0.01"}),
+                     httpx.Response(200, content=_sse(_delta("ok")))]
+        backend = self._backend(lambda request: responses.pop(0))
+        self.assertEqual([c.text for c in backend.stream(self._request())], ["ok"])
+
+    def test_error_event_in_stream(self):
+        import httpx
+        import openai
+        body = _sse(_delta("a"), {"error": {"message": "content filtered"}})
+        backend = self._backend(lambda request: httpx.Response(200, content=body))
+        with self.assertRaises(openai.APIError):
+            list(backend.stream(self._request()))
+
+    def test_connection_error(self):
+        import httpx
+        import openai
+
+        def refuse(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        with patch.object(sse_stream, "_retry_delay", return_value=0):
+            with self.assertRaises(openai.APIConnectionError):
+                list(self._backend(refuse).stream(self._request()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+from stall_watchdog import StallWatchdog
+
+
+def _blocking_call(seconds):
+    time.sleep(seconds)
+
+
+class TestStallWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.path = os.path.join(self._dir.name, "stalls.jsonl")
+
+    def _watchdog(self, **kwargs):
+        watchdog = StallWatchdog(0.05, check_interval=0.01, log_path=self.path,
+                                 context_provider=lambda: {"sessions": 1}, **kwargs)
+        # テストを実行しているスレッドを「UI スレッド」として監視する
+        watchdog.start(main_ident=threading.get_ident())
+        self.addCleanup(watchdog.stop)
+        return watchdog
+
+    def test_stall_captures_stack_and_histogram(self):
+        watchdog = self._watchdog()
+        watchdog.beat()
+        _blocking_call(0.3)
+        watchdog.beat()
+        watchdog.stop()
+
+        self.assertEqual(len(watchdog.events), 1)
+        event = watchdog.events[0]
+        self.assertTrue(any("_blocking_call" in line for line in event["stack"]))
+        self.assertEqual(event["context"], {"sessions": 1})
+        self.assertGreaterEqual(event["duration_ms"], 250)
+        # 区切りはしきい値 50 ms から 75 / 100 / 200 / 500 ms。300 ms 前後の停止は 200–500 ms に入る
+        self.assertEqual(watchdog._bounds_ms, (75, 100, 200, 500))
+        self.assertEqual(watchdog._histogram, [0, 0, 0, 1, 0])
+        self.assertIn("200–500 ms:    1", watchdog.format_histogram())
+
+        with open(self.path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([e["duration_ms"] for e in lines], [event["duration_ms"]])
+
+    def test_no_event_without_stall(self):
+        watchdog = self._watchdog()
+        for _ in range(5):
+            watchdog.beat()
+            time.sleep(0.01)
+        watchdog.stop()
+        self.assertEqual(len(watchdog.events), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_events_are_capped(self):
+        watchdog = StallWatchdog(0.05, max_events=2)
+        for i in range(5):
+            watchdog._finish({"stack": [], "context": {}, "n": i}, 0.1)
+        self.assertEqual([e["n"] for e in watchdog.events], [3, 4])
+        # ヒストグラムは全件を数える
+        self.assertEqual(watchdog._histogram[watchdog._bucket(100)], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
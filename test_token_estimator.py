@@ -0,0 +1,64 @@
+import sys
+import timeit
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import token_estimator
+from actions import ActionSpec
+
+MIXED = "PopAI は Windows 11 向けのデスクトップ常駐アシスタントです。Select text and press Ctrl+Alt+Space.\n"
+
+
+class TestTokenEstimator(unittest.TestCase):
+
+    def test_estimate_ascii_and_japanese(self):
+        self.assertEqual(token_estimator.estimate_tokens(""), 0)
+        self.assertEqual(token_estimator.estimate_tokens("abcdefgh"), 2)
+        self.assertEqual(token_estimator.estimate_tokens("要約"), 2)
+        # 混在テキストは ASCII 部分と日本語部分の和になる
+        mixed = "abcdefgh要約"
+        self.assertEqual(token_estimator.estimate_tokens(mixed), 4)
+
+    def test_estimate_is_fast_enough_for_every_edit(self):
+        text = (MIXED * 200)[:10_000]
+        per_call = min(timeit.repeat(lambda: token_estimator.estimate_tokens(text),
+                                     number=100, repeat=3)) / 100
+        self.assertLess(per_call, 0.001)
+
+    def test_truncate_to_tokens(self):
+        text = MIXED * 50
+        cut = token_estimator.truncate_to_tokens(text, 100)
+        self.assertTrue(text.startswith(cut))
+        self.assertLessEqual(token_estimator.estimate_tokens(cut), 100)
+        self.assertGreater(token_estimator.estimate_tokens(cut), 80)
+
+    def test_split_into_chunks_preserves_text(self):
+        text = MIXED * 50 + "改行の無い長い文" * 200
+        chunks = token_estimator.split_into_chunks(text, 150)
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(token_estimator.estimate_tokens(c) <= 150 for c in chunks))
+        # 行単位で収まる部分は行の途中で切らない
+        self.assertTrue(chunks[0].endswith("\n"))
+
+    def test_plan_input(self):
+        text = MIXED * 50
+        self.assertEqual(ActionSpec("S", "要約").plan_input(text).mode, "single")
+
+        warn = ActionSpec("S", "要約", max_input_tokens=100).plan_input(text)
+        self.assertEqual((warn.mode, warn.chunks), ("single", [text]))
+        self.assertTrue(warn.warning)
+
+        truncated = ActionSpec("S", "要約", max_input_tokens=100, overflow="truncate").plan_input(text)
+        self.assertEqual(truncated.mode, "truncated")
+        self.assertLessEqual(token_estimator.estimate_tokens(truncated.chunks[0]), 100)
+
+        chunked = ActionSpec("S", "要約", max_input_tokens=100, overflow="chunk",
+                             chunk_tokens=200).plan_input(text)
+        self.assertEqual(chunked.mode, "chunked")
+        self.assertEqual("".join(chunked.chunks), text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('dotenv', MagicMock())
+
+import action_runner
+import backends
+import config
+import usage
+from usage import UsageRecord, UsageTracker
+
+
+class TestUsageTracker(unittest.TestCase):
+
+    def setUp(self):
+        self._orig = (config.DAILY_TOKEN_BUDGET, config.BUDGET_MODE,
+                      config.BUDGET_DOWNGRADE_DEPLOYMENT)
+
+    def tearDown(self):
+        (config.DAILY_TOKEN_BUDGET, config.BUDGET_MODE,
+         config.BUDGET_DOWNGRADE_DEPLOYMENT) = self._orig
+
+    def test_summary_aggregates_per_action(self):
+        tracker = UsageTracker("")
+        tracker.record(UsageRecord("S", "dep", 100, 50, elapsed=1.5, ttft=0.5))
+        tracker.record(UsageRecord("S", "dep", 200, 50, elapsed=2.0, ttft=1.0))
+        tracker.record(UsageRecord("Q", "dep", 10, 10, elapsed=1.0))
+
+        stats = tracker.summary()
+        self.assertEqual(stats["S"].requests, 2)
+        self.assertEqual(stats["S"].total_tokens, 400)
+        self.assertAlmostEqual(stats["S"].tokens_per_sec, 50.0)
+        self.assertAlmostEqual(stats["S"].avg_ttft, 0.75)
+        self.assertIsNone(stats["Q"].avg_ttft)
+
+    def test_cache_hit_ratio_and_ttft_split(self):
+        tracker = UsageTracker("")
+        tracker.record(UsageRecord("C", "dep", 2000, 10, elapsed=2.0, ttft=1.2))
+        tracker.record(UsageRecord("C", "dep", 2000, 10, elapsed=1.0, ttft=0.4, cached_tokens=1536))
+        # 推定値の記録はキャッシュ率・TTFT 比較に含めない
+        tracker.record(UsageRecord("C", "dep", 5000, 10, elapsed=1.0, ttft=3.0, estimated=True))
+
+        s = tracker.summary()["C"]
+        self.assertAlmostEqual(s.cache_hit_ratio, 1536 / 4000)
+        self.assertAlmostEqual(s.avg_ttft_hit, 0.4)
+        self.assertAlmostEqual(s.avg_ttft_miss, 1.2)
+        self.assertIn("キャッシュ 38%", tracker.format_summary())
+        self.assertIn("1 件は usage チャンクが無いため推定値です", tracker.format_summary())
+
+    def test_records_persist_to_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "sub", "usage.jsonl")
+            UsageTracker(path).record(UsageRecord("T", "dep", 1, 2, elapsed=0.1))
+            reloaded = UsageTracker(path)
+            self.assertEqual(len(reloaded.records()), 1)
+            self.assertEqual(reloaded.records()[0].completion_tokens, 2)
+
+    def test_budget_block_and_downgrade(self):
+        tracker = UsageTracker("")
+        tracker.record(UsageRecord("S", "dep", 600, 600, elapsed=1.0))
+        # 昨日の記録は本日の予算に含めない
+        tracker.record(UsageRecord("S", "dep", 9999, 0, elapsed=1.0,
+                                   timestamp=time.time() - 2 * 86400))
+
+        config.DAILY_TOKEN_BUDGET = 0
+        self.assertEqual(tracker.check_budget(), usage.BUDGET_OK)
+
+        config.DAILY_TOKEN_BUDGET = 2000
+        self.assertEqual(tracker.check_budget(), usage.BUDGET_OK)
+
+        config.DAILY_TOKEN_BUDGET = 1000
+        config.BUDGET_MODE = "block"
+        self.assertEqual(tracker.check_budget(), usage.BUDGET_BLOCK)
+
+        config.BUDGET_MODE = "downgrade"
+        config.BUDGET_DOWNGRADE_DEPLOYMENT = "small"
+        self.assertEqual(tracker.check_budget(), usage.BUDGET_DOWNGRADE)
+
+
+
+class TestIncludeUsage(unittest.TestCase):
+
+    def test_default_depends_on_azure_api_version(self):
+        with patch.object(config, "STREAM_INCLUDE_USAGE", None):
+            with patch.object(config, "AZURE_OPENAI_API_VERSION", "2024-02-01"):
+                self.assertFalse(action_runner.include_usage("azure"))
+                self.assertTrue(action_runner.include_usage("local"))
+            with patch.object(config, "AZURE_OPENAI_API_VERSION", "2024-10-21"):
+                self.assertTrue(action_runner.include_usage("azure"))
+
+    def test_explicit_setting_wins(self):
+        with patch.object(config, "STREAM_INCLUDE_USAGE", False):
+            self.assertFalse(action_runner.include_usage("local"))
+        with patch.object(config, "STREAM_INCLUDE_USAGE", True), \
+                patch.object(config, "AZURE_OPENAI_API_VERSION", "2024-02-01"):
+            self.assertTrue(action_runner.include_usage("azure"))
+
+
+
+class CancelAfterFirstChunkBackend:
+    """最初のチャンクを流した後、中断されるまで待つテスト用バックエンド（usage チャンクは返さない）。"""
+
+    name = "fake"
+    default_model = "m"
+
+    def __init__(self):
+        self.cancelled = False
+
+    def stream(self, request):
+        yield backends.StreamChunk("途中までの回答")
+        if not self.cancelled:
+            raise ConnectionError("closed")
+        yield backends.StreamChunk("届かない")
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TestCancelledUsage(unittest.TestCase):
+
+    def test_cancelled_stream_is_recorded_as_estimate(self):
+        records = []
+        runner = action_runner.ActionRunner("S", "入力テキスト", budget=usage.BUDGET_OK,
+                                            on_usage=records.append)
+        runner._on_chunk = lambda text: runner.cancel()
+        with patch.object(action_runner, "create_backend", CancelAfterFirstChunkBackend), \
+                patch.object(config, "SINGLE_FLIGHT", False):
+            self.assertIsNone(runner.run())
+
+        # 中断しても、送信済みの入力と途中までの出力は予算に数える
+        self.assertEqual(len(records), 1)
+        self.assertTrue(records[0].estimated)
+        self.assertGreater(records[0].prompt_tokens, 0)
+        self.assertGreater(records[0].completion_tokens, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
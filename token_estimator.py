@@ -0,0 +1,90 @@
+"""
+token_estimator.py
+ネットワーク不要・辞書ダウンロード不要のオフライン・トークン数推定。
+日本語と英語が混在したテキストを想定し、入力欄の編集ごとに呼べるよう
+10 kB あたり 1 ms 未満で動作することを目標にしている。
+
+【推定方法】
+  文字単位のループは Python では遅いため、UTF-8 エンコード後のバイト数と文字数の差から
+  非 ASCII 文字数を求める（日本語の大半は 3 バイト → 1 文字あたり 2 バイト増える）。
+    ASCII 部分  : 約 4 文字 = 1 トークン
+    非 ASCII 部分: 約 1 文字 = 1 トークン（かな・漢字）
+  実際のトークナイザより少し多めに見積もる（予算判定で安全側に倒す）。
+"""
+
+import re
+
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_TOKENS_PER_CHAR = 1.0
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数の推定値を返す。"""
+    if not text:
+        return 0
+    n = len(text)
+    if text.isascii():
+        return max(1, int(n / ASCII_CHARS_PER_TOKEN + 0.5))
+    extra = len(text.encode("utf-8", "surrogatepass")) - n
+    non_ascii = min(n, (extra + 1) // 2)
+    ascii_chars = n - non_ascii
+    return max(1, int(ascii_chars / ASCII_CHARS_PER_TOKEN
+                      + non_ascii * NON_ASCII_TOKENS_PER_CHAR + 0.5))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """推定トークン数が max_tokens 以下になるよう末尾を切り詰める。"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # 文字数をトークン比で見積もってから、超えている間だけ縮める
+    cut = int(len(text) * max_tokens / tokens)
+    while cut > 0 and estimate_tokens(text[:cut]) > max_tokens:
+        cut = int(cut * 0.95)
+    return text[:cut]
+
+
+# 段落 → 行 → 句点 の順で区切りを探す
+_SPLIT_PATTERNS = (re.compile(r"(?<=\n\n)"), re.compile(r"(?<=\n)"), re.compile(r"(?<=[。．.!?！？])"))
+
+
+def split_into_chunks(text: str, max_tokens: int) -> list[str]:
+    """
+    テキストを推定トークン数が max_tokens 以下のチャンクに分割する。
+    できるだけ段落・行・文の境界で区切り、それでも収まらない部分は文字数で切る。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    return _split(text, max_tokens, 0)
+
+
+def _split(text: str, max_tokens: int, level: int) -> list[str]:
+    if level >= len(_SPLIT_PATTERNS):
+        chunks = []
+        while text:
+            head = truncate_to_tokens(text, max_tokens) or text[:1]
+            chunks.append(head)
+            text = text[len(head):]
+        return chunks
+
+    chunks: list[str] = []
+    current: list[str] = []
+    current_tokens = 0
+    for piece in _SPLIT_PATTERNS[level].split(text):
+        if not piece:
+            continue
+        piece_tokens = estimate_tokens(piece)
+        if piece_tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split(piece, max_tokens, level + 1))
+            continue
+        if current_tokens + piece_tokens > max_tokens and current:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
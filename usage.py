@@ -0,0 +1,256 @@
+"""
+usage.py
+リクエストごとのトークン使用量・スループットを記録し、集計するモジュール。
+ストリームの最終 usage チャンクが得られない場合はオフライン推定値で補う。
+記録は JSON Lines 形式で config.USAGE_LOG_PATH に追記される。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict, field
+
+import config
+
+logger = logging.getLogger("popai.usage")
+
+
+# ================================================================== #
+# 記録データ
+# ================================================================== #
+@dataclass
+class UsageRecord:
+    """1 リクエスト分の使用量。"""
+    action: str
+    deployment: str
+    prompt_tokens: int
+    completion_tokens: int
+    elapsed: float                  # 送信〜完了までの秒数
+    ttft: float | None = None       # 送信〜最初のチャンクまでの秒数
+    estimated: bool = False         # True なら usage チャンクが無くオフライン推定
+    cached_tokens: int = 0          # prompt_tokens のうちプロンプトキャッシュから読まれた分
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def tokens_per_sec(self) -> float:
+        """生成スループット（最初のチャンク以降の completion トークン / 秒）。"""
+        gen_time = self.elapsed - (self.ttft or 0.0)
+        if gen_time <= 0:
+            return 0.0
+        return self.completion_tokens / gen_time
+
+
+@dataclass
+class ActionStats:
+    """アクション単位の集計結果。"""
+    action: str
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    gen_time: float = 0.0
+    ttft_total: float = 0.0
+    ttft_count: int = 0
+    cached_tokens: int = 0
+    cached_prompt_tokens: int = 0   # キャッシュ量を報告できた（usage チャンクのある）リクエストの入力合計
+    estimated_requests: int = 0     # usage チャンクが無く推定値で記録したリクエスト数
+    ttft_hit_total: float = 0.0     # cached_tokens > 0 だったリクエストの TTFT
+    ttft_hit_count: int = 0
+    ttft_miss_total: float = 0.0
+    ttft_miss_count: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.completion_tokens / self.gen_time if self.gen_time > 0 else 0.0
+
+    @property
+    def avg_ttft(self) -> float | None:
+        return self.ttft_total / self.ttft_count if self.ttft_count else None
+
+    @property
+    def cache_hit_ratio(self) -> float | None:
+        """入力トークンのうちキャッシュから読まれた割合（推定値の記録は分母に含めない）。"""
+        if not self.cached_prompt_tokens:
+            return None
+        return self.cached_tokens / self.cached_prompt_tokens
+
+    @property
+    def avg_ttft_hit(self) -> float | None:
+        return self.ttft_hit_total / self.ttft_hit_count if self.ttft_hit_count else None
+
+    @property
+    def avg_ttft_miss(self) -> float | None:
+        return self.ttft_miss_total / self.ttft_miss_count if self.ttft_miss_count else None
+
+    @property
+    def cost(self) -> float:
+        return (self.prompt_tokens / 1000 * config.PRICE_PER_1K_PROMPT_TOKENS
+                + self.completion_tokens / 1000 * config.PRICE_PER_1K_COMPLETION_TOKENS)
+
+
+# ================================================================== #
+# 予算判定
+# ================================================================== #
+BUDGET_OK        = "ok"
+BUDGET_BLOCK     = "block"
+BUDGET_DOWNGRADE = "downgrade"
+
+
+def _start_of_today() -> float:
+    lt = time.localtime()
+    return time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+def _fmt_sec(value: float | None) -> str:
+    return f"{value:.2f}s" if value is not None else "-"
+
+
+# ================================================================== #
+# トラッカー
+# ================================================================== #
+class UsageTracker:
+    """
+    使用量の記録と集計を行う。ApiWorker など複数スレッドから呼ばれるためロックで保護する。
+    path が空文字の場合はファイルに保存せずメモリ上のみで保持する。
+    """
+
+    def __init__(self, path: str = ""):
+        self._path = path
+        self._lock = threading.Lock()
+        self._records: list[UsageRecord] = []
+        self._load()
+
+    def _load(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._records.append(UsageRecord(**json.loads(line)))
+                    except (TypeError, ValueError):
+                        continue    # 壊れた行は無視する
+        except OSError as e:
+            logger.warning("使用量ログの読み込みに失敗しました: %s", e)
+
+    def record(self, rec: UsageRecord):
+        with self._lock:
+            self._records.append(rec)
+            if not self._path:
+                return
+            try:
+                os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+                with open(self._path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(asdict(rec), ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning("使用量ログの書き込みに失敗しました: %s", e)
+
+    def records(self) -> list[UsageRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def tokens_today(self, action: str | None = None) -> int:
+        since = _start_of_today()
+        with self._lock:
+            return sum(
+                r.total_tokens for r in self._records
+                if r.timestamp >= since and (action is None or r.action == action)
+            )
+
+    def check_budget(self) -> str:
+        """
+        本日の合計トークン数を config.DAILY_TOKEN_BUDGET と比較し、
+        BUDGET_OK / BUDGET_BLOCK / BUDGET_DOWNGRADE のいずれかを返す。
+        """
+        budget = config.DAILY_TOKEN_BUDGET
+        if budget <= 0 or self.tokens_today() < budget:
+            return BUDGET_OK
+        if config.BUDGET_MODE == "downgrade" and config.BUDGET_DOWNGRADE_DEPLOYMENT:
+            return BUDGET_DOWNGRADE
+        return BUDGET_BLOCK
+
+    def summary(self, since: float | None = None) -> dict[str, ActionStats]:
+        stats: dict[str, ActionStats] = {}
+        with self._lock:
+            for r in self._records:
+                if since is not None and r.timestamp < since:
+                    continue
+                s = stats.setdefault(r.action, ActionStats(action=r.action))
+                s.requests          += 1
+                s.prompt_tokens     += r.prompt_tokens
+                s.completion_tokens += r.completion_tokens
+                s.gen_time          += max(0.0, r.elapsed - (r.ttft or 0.0))
+                if r.estimated:
+                    s.estimated_requests   += 1
+                else:
+                    s.cached_tokens        += r.cached_tokens
+                    s.cached_prompt_tokens += r.prompt_tokens
+                if r.ttft is not None:
+                    s.ttft_total += r.ttft
+                    s.ttft_count += 1
+                    # 推定値の記録はキャッシュの有無が分からないため比較に含めない
+                    if r.estimated:
+                        continue
+                    if r.cached_tokens > 0:
+                        s.ttft_hit_total += r.ttft
+                        s.ttft_hit_count += 1
+                    else:
+                        s.ttft_miss_total += r.ttft
+                        s.ttft_miss_count += 1
+        return stats
+
+    def format_summary(self) -> str:
+        """トレイメニューから表示するためのテキストを組み立てる。"""
+        lines = []
+        estimated = 0
+        for title, since in (("本日", _start_of_today()), ("累計", None)):
+            stats = self.summary(since)
+            estimated = sum(s.estimated_requests for s in stats.values())
+            lines.append(f"■ {title}")
+            if not stats:
+                lines.append("  (記録なし)")
+            for s in sorted(stats.values(), key=lambda s: s.action):
+                ttft = _fmt_sec(s.avg_ttft)
+                line = (f"  [{s.action}] {s.requests} 回 / "
+                        f"入力 {s.prompt_tokens:,} + 出力 {s.completion_tokens:,} tok / "
+                        f"{s.tokens_per_sec:.1f} tok/s / TTFT {ttft}")
+                if s.cost > 0:
+                    line += f" / {s.cost:.4f} {config.PRICE_CURRENCY}"
+                lines.append(line)
+                if s.cache_hit_ratio is not None:
+                    lines.append(f"      キャッシュ {s.cache_hit_ratio:.0%} "
+                                 f"({s.cached_tokens:,} / {s.cached_prompt_tokens:,} tok) / "
+                                 f"TTFT ヒット時 {_fmt_sec(s.avg_ttft_hit)} ・ "
+                                 f"ミス時 {_fmt_sec(s.avg_ttft_miss)}")
+            lines.append("")
+        budget = config.DAILY_TOKEN_BUDGET
+        if budget > 0:
+            lines.append(f"本日の予算: {self.tokens_today():,} / {budget:,} tok")
+        if estimated:
+            lines.append(f"※ {estimated:,} 件は usage チャンクが無いため推定値です（キャッシュ率・TTFT 比較の対象外）。"
+                         "STREAM_INCLUDE_USAGE と API バージョン（2024-09-01-preview 以降）を確認してください。")
+        return "\n".join(lines).rstrip()
+
+
+_tracker: UsageTracker | None = None
+_tracker_lock = threading.Lock()
+
+def get_tracker() -> UsageTracker:
+    """UsageTracker をシングルトン的に生成して返す。"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = UsageTracker(config.USAGE_LOG_PATH)
+        return _tracker